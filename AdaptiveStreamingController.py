@@ -1,9 +1,12 @@
 
 import json
+import os
 import time
 
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "quality_profiles.json")
+
 class AdaptiveStreamingController:
-    def __init__(self, profile_file="quality_profiles.json"):
+    def __init__(self, profile_file=PROFILE_FILE):
         with open(profile_file, "r") as f:
             self.quality_profiles = json.load(f)
         self.current_quality = "medium"
@@ -12,7 +15,9 @@ class AdaptiveStreamingController:
     def analyze_network_conditions(self, net_stats):
         score = 0
         score += max(0, 100 - net_stats['latency'])
-        score += max(0, 100 - net_stats['packet_loss'] * 200)
+        # A frame spans dozens of packets, so a few percent packet loss already costs
+        # most frames; heavy loss can pull the score below what latency/bandwidth add
+        score += max(-100, 100 - net_stats['packet_loss'] * 2000)
         score += min(100, net_stats['bandwidth'] / 10)
         return score
 
@@ -0,0 +1,137 @@
+import asyncio, socket
+
+from ServerWorker import ServerWorker, HAVE_SENDMSG
+from RtspParser import RtspParser, RtspParseError
+
+
+class AsyncServerWorker(ServerWorker):
+    """ServerWorker that runs RTSP and RTP on a shared asyncio event loop."""
+
+    def __init__(self, clientInfo, loop, writer):
+        super().__init__(clientInfo)
+        self.loop = loop
+        self.writer = writer
+        self.rtpTask = None
+
+    def sendRtspReply(self, reply):
+        """Queue an RTSP reply on the stream writer."""
+        self.writer.write(reply.encode())
+
+    def startStreaming(self):
+        """Schedule the RTP sender coroutine for this session."""
+        if self.channel:
+            return super().startStreaming()
+        self.rtpTask = self.loop.create_task(self.streamRtp())
+
+    def stopStreaming(self):
+        """Cancel the RTP sender coroutine (PAUSE or TEARDOWN)."""
+        if self.channel:
+            return super().stopStreaming()
+        if self.rtpTask:
+            self.rtpTask.cancel()
+            self.rtpTask = None
+
+    def closeRtp(self):
+        """Close the RTP datagram transport (and its socket) if one was opened."""
+        rtpSocket = self.clientInfo.pop('rtpSocket', None)
+        transport = self.clientInfo.pop('rtpTransport', None)
+        if transport:
+            transport.close()
+        elif rtpSocket:
+            rtpSocket.close()
+        self.closeRtcp()
+
+    def retransmit(self, lost):
+        """Resend NACKed packets on the event loop, which owns the RTP socket and transport."""
+        try:
+            self.loop.call_soon_threadsafe(super().retransmit, lost)
+        except RuntimeError:
+            pass # loop closed: the server is shutting down
+
+    def sendPacket(self, header, payload, address):
+        """Send straight from the endpoint's socket unless the transport is backed up."""
+        transport = self.clientInfo['rtpTransport']
+        if HAVE_SENDMSG and not transport.get_write_buffer_size():
+            try:
+                self.clientInfo['rtpSocket'].sendmsg((header, payload), (), 0, address)
+                return
+            except BlockingIOError:
+                pass
+        # The transport keeps the datagram, so it must not alias the reused header
+        transport.sendto(header + payload, address)
+
+    async def streamRtp(self):
+        """Send one RTP frame per frame interval through a datagram endpoint."""
+        if 'rtpTransport' not in self.clientInfo:
+            # The socket bound at SETUP (its port was announced to the client)
+            rtpSocket = self.clientInfo.get('rtpSocket') or socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rtpSocket.setblocking(False)
+            transport, _ = await self.loop.create_datagram_endpoint(
+                asyncio.DatagramProtocol, sock=rtpSocket)
+            self.clientInfo['rtpSocket'] = rtpSocket
+            self.clientInfo['rtpTransport'] = transport
+        address = (self.clientInfo['rtspSocket'][1][0], int(self.clientInfo['rtpPort']))
+        interval = 1.0 / self.clientInfo['videoStream'].fps
+
+        deadline = self.loop.time()
+        while True:
+            deadline += interval
+            await asyncio.sleep(max(0, deadline - self.loop.time()))
+            self.scheduler.record_lag(self.loop.time() - deadline, interval)
+
+            data, frameNumber = self.readNextFrame()
+            if not data:
+                break
+            if self.thinForCongestion():
+                continue
+            try:
+                self.sendFrame(data, frameNumber, address)
+                self.scheduler.record_sent()
+            except Exception:
+                self.network_monitor.log_send_error()
+                print("Connection Error")
+
+
+class AsyncServer:
+    """Single event-loop RTSP server; one task per session instead of threads."""
+
+    def __init__(self, port, reusePort=False):
+        self.port = port
+        self.reusePort = reusePort
+
+    async def handleClient(self, reader, writer):
+        """Serve RTSP requests for one client connection until it closes."""
+        loop = asyncio.get_running_loop()
+        clientInfo = {}
+        clientInfo['rtspSocket'] = (writer.get_extra_info('socket'), writer.get_extra_info('peername'))
+        worker = AsyncServerWorker(clientInfo, loop, writer)
+        parser = RtspParser()
+        try:
+            while worker.state != worker.TORN_DOWN:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                try:
+                    requests = parser.feed(data)
+                except RtspParseError as e:
+                    print("Bad RTSP request: %s" % e)
+                    worker.replyRtsp(worker.BAD_REQUEST_400, '0')
+                    await writer.drain()
+                    break
+                for request in requests:
+                    worker.handleRequest(request)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            worker.closeSession()
+            writer.close()
+
+    async def serve(self):
+        server = await asyncio.start_server(self.handleClient, '', self.port,
+                                            reuse_port=self.reusePort or None)
+        async with server:
+            await server.serve_forever()
+
+    def run(self):
+        asyncio.run(self.serve())
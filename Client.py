@@ -1,89 +1,35 @@
 from tkinter import *
 import tkinter.messagebox
 from tkinter import messagebox as tkMessageBox
-from PIL import Image, ImageTk
-import socket, threading, os, time, io
-from queue import Queue
+from PIL import ImageTk
+import socket, threading, os, time, select, random
 
 from ClientNetworkAnalyzer import ClientNetworkAnalyzer
+from FrameBuffer import FrameBuffer
+from PlayoutBuffer import PlayoutBuffer
+from FrameDecoder import FrameDecoder, FrameMailbox, DEFAULT_WORKERS
+from StreamingAnalytics import StreamingAnalytics
+from AdaptiveStreamingController import AdaptiveStreamingController
 from RtpPacket import RtpPacket
+from RtcpPacket import RtcpPacket, RTCP_SR
+from NackTracker import NackTracker, GIVE_UP_AFTER
+from RtcpListener import REPORT_INTERVAL
 
 CACHE_FILE_NAME = "cache-"
 CACHE_FILE_EXT = ".jpg"
 
+DISPLAY_FPS = 30
 
-class FrameBuffer:
-    def __init__(self, max_buffer_size=50, fragment_timeout=2.0, cleanup_interval=1.0):
-        self.fragment_map = {}
-        self.frame_queue = Queue(maxsize=max_buffer_size)
-        self.max_buffer_size = max_buffer_size
-        self.fragment_timeout = fragment_timeout
-        self.lock = threading.Lock()
-        self._stop_cleanup = threading.Event()
-        self._cleanup_thread = threading.Thread(target=self._cleanup_loop, daemon=True)
-        self._cleanup_thread.start()
-
-    def add_frame_fragment(self, frame_id, fragment_id, total_fragments, payload):
-        with self.lock:
-            if frame_id not in self.fragment_map:
-                self.fragment_map[frame_id] = {
-                    "total": total_fragments,
-                    "received": {},
-                    "timestamp": time.time()
-                }
-            entry = self.fragment_map[frame_id]
-            # store fragment if new
-            if fragment_id not in entry["received"]:
-                entry["received"][fragment_id] = payload
-            # check completion
-            if len(entry["received"]) == entry["total"]:
-                return self._assemble_frame_locked(frame_id)
-        return None
-
-    def _assemble_frame_locked(self, frame_id):
-        data = self.fragment_map.pop(frame_id, None)
-        if data is None:
-            return None
-        fragments = data["received"]
-        try:
-            frame_bytes = b"".join(fragments[i] for i in sorted(fragments.keys()))
-        except Exception:
-            # malformed fragments
-            return None
-        if not self.frame_queue.full():
-            try:
-                self.frame_queue.put_nowait(frame_bytes)
-            except:
-                pass
-        return frame_bytes
-
-    def _cleanup_loop(self):
-        while not self._stop_cleanup.is_set():
-            now = time.time()
-            with self.lock:
-                to_delete = [fid for fid, d in self.fragment_map.items() if now - d["timestamp"] > self.fragment_timeout]
-                for fid in to_delete:
-                    try:
-                        del self.fragment_map[fid]
-                    except:
-                        pass
-            time.sleep(1.0)
+# How often the Tk main loop checks the mailbox for a new frame
+RENDER_INTERVAL_MS = 5
 
-    def get_buffer_health(self):
-        return self.frame_queue.qsize() / self.max_buffer_size
+# How often network conditions are re-scored for rendition switching
+ADAPT_INTERVAL_MS = 1000
 
-    def get_next_frame(self):
-        try:
-            return self.frame_queue.get_nowait()
-        except:
-            return None
-
-    def stop(self):
-        self._stop_cleanup.set()
-        try:
-            self._cleanup_thread.join(timeout=1.0)
-        except:
-            pass
+# An incomplete frame is given up once retransmissions can no longer arrive
+FRAGMENT_TIMEOUT = GIVE_UP_AFTER + 0.1
+# Batch NACKs for at most this long
+NACK_INTERVAL = 0.01
 
 
 class Client:
@@ -96,8 +42,10 @@ class Client:
     PLAY = 1
     PAUSE = 2
     TEARDOWN = 3
+    SET_PARAMETER = 4
 
-    def __init__(self, master, serveraddr, serverport, rtpport, filename):
+    def __init__(self, master, serveraddr, serverport, rtpport, filename,
+                 display_size=None, decode_workers=DEFAULT_WORKERS):
         self.master = master
         self.master.protocol("WM_DELETE_WINDOW", self.handler)
         self.createWidgets()
@@ -108,17 +56,41 @@ class Client:
         self.rtspSeq = 0
         self.sessionId = 0
         self.requestSent = -1
+        # Set from a request until its reply arrives; only one RTSP request is outstanding at a time
+        self.replyPending = False
         self.teardownAcked = 0
         self.frameNbr = 0
         self.playEvent = threading.Event()
         self.playEvent.clear()
         self.analyzer = ClientNetworkAnalyzer()
-        self.frame_buffer = FrameBuffer()
+        self.frame_buffer = FrameBuffer(fragment_timeout=FRAGMENT_TIMEOUT)
+        # Frames are shown at their RTP media time plus a delay adapted to the measured jitter
+        self.playout = PlayoutBuffer(late_after=1 / DISPLAY_FPS)
+        # Missing RTP packets are NACKed over RTCP and retransmitted by the server
+        self.nack_tracker = NackTracker()
+        # Frames are decoded off the playback thread, scaled to display_size (w, h) if given
+        self.decoder = FrameDecoder(workers=decode_workers, target_size=display_size)
+        # Decoded frames reach the Tk main loop through a single-slot mailbox
+        self.mailbox = FrameMailbox()
+        self.analytics = StreamingAnalytics()
+        # Rendition switching; renditions the server does not have are not asked for again
+        self.controller = AdaptiveStreamingController()
+        self.unavailableQualities = set()
+        self.quality = None
+        self.requestedQuality = None
         self.rtpSocket = None
+        self.rtcpSocket = None
         self.rtspSocket = None
+        # RTCP: receiver reports go to the server port named in the SETUP reply
+        self.ssrc = random.randint(1, 0xFFFFFFFF)
+        self.serverRtcpPort = None
+        self.rtcp_thread = None
         self.rtp_listen_thread = None
         self.rtsp_reply_thread = None
         self.connectToServer()
+        self.renderJob = self.master.after(RENDER_INTERVAL_MS, self.renderFrame)
+        # Rendition checks start with the first PLAY
+        self.adaptJob = None
 
     def createWidgets(self):
         self.setup = Button(self.master, width=20, padx=3, pady=3)
@@ -150,6 +122,10 @@ class Client:
 
     def exitClient(self):
         self.sendRtspRequest(self.TEARDOWN)
+        self.master.after_cancel(self.renderJob)
+        if self.adaptJob is not None:
+            self.master.after_cancel(self.adaptJob)
+            self.adaptJob = None
         self.master.destroy()
         cachename = CACHE_FILE_NAME + str(self.sessionId) + CACHE_FILE_EXT
         if os.path.exists(cachename):
@@ -162,6 +138,7 @@ class Client:
             self.frame_buffer.stop()
         except:
             pass
+        self.decoder.shutdown()
 
     def pauseMovie(self):
         if self.state == self.PLAYING:
@@ -170,6 +147,8 @@ class Client:
     def playMovie(self):
         if self.state == self.READY:
             self.sendRtspRequest(self.PLAY)
+            if self.adaptJob is None:
+                self.adaptJob = self.master.after(ADAPT_INTERVAL_MS, self.adaptQuality)
 
     def connectToServer(self):
         try:
@@ -181,9 +160,11 @@ class Client:
             tkinter.messagebox.showwarning('Unable to Connect', f'Unable to connect to RTSP server {self.serverAddr}:{self.serverPort}')
 
     def sendRtspRequest(self, requestCode):
+        # A newer CSeq makes parseRtspReply drop the reply to an outstanding rendition switch
+        superseded = self.replyPending and self.requestSent == self.SET_PARAMETER
         if requestCode == self.SETUP and self.state == self.INIT:
             self.rtspSeq += 1
-            request = f"SETUP {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nTransport: RTP/UDP; client_port={self.rtpPort}"
+            request = f"SETUP {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nTransport: RTP/UDP; client_port={self.rtpPort}-{self.rtpPort + 1}\r\n\r\n"
             self.requestSent = self.SETUP
             self.analyzer.record_rtsp_send(self.rtspSeq)
             if not self.rtsp_reply_thread or not self.rtsp_reply_thread.is_alive():
@@ -192,37 +173,54 @@ class Client:
 
         elif requestCode == self.PLAY and self.state == self.READY:
             self.rtspSeq += 1
-            request = f"PLAY {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
+            request = f"PLAY {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}\r\n\r\n"
             self.requestSent = self.PLAY
             self.analyzer.record_rtsp_send(self.rtspSeq)
 
         elif requestCode == self.PAUSE and self.state == self.PLAYING:
             self.rtspSeq += 1
-            request = f"PAUSE {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
+            request = f"PAUSE {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}\r\n\r\n"
             self.requestSent = self.PAUSE
             self.analyzer.record_rtsp_send(self.rtspSeq)
 
         elif requestCode == self.TEARDOWN and self.state != self.INIT:
             self.rtspSeq += 1
-            request = f"TEARDOWN {self.fileName} RTSP/1.0\nCSeq: {self.rtspSeq}\nSession: {self.sessionId}"
+            request = f"TEARDOWN {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}\r\n\r\n"
             self.requestSent = self.TEARDOWN
             self.analyzer.record_rtsp_send(self.rtspSeq)
 
+        elif requestCode == self.SET_PARAMETER and self.state in (self.READY, self.PLAYING):
+            self.rtspSeq += 1
+            body = f"quality: {self.requestedQuality}\r\n"
+            request = f"SET_PARAMETER {self.fileName} RTSP/1.0\r\nCSeq: {self.rtspSeq}\r\nSession: {self.sessionId}\r\nContent-Type: text/parameters\r\nContent-Length: {len(body)}\r\n\r\n{body}"
+            self.requestSent = self.SET_PARAMETER
+            self.analyzer.record_rtsp_send(self.rtspSeq)
+
         else:
             return
 
+        if superseded and requestCode != self.SET_PARAMETER:
+            # Its outcome will never be known: let adaptQuality ask for the rendition again
+            self.requestedQuality = self.quality
+        self.replyPending = True
         try:
             self.rtspSocket.send(request.encode())
         except Exception:
             pass
 
     def recvRtspReply(self):
+        pending = ''
         while True:
             try:
                 reply = self.rtspSocket.recv(4096)
                 if not reply:
-                    continue
-                self.parseRtspReply(reply.decode("utf-8"))
+                    break # server closed the connection
+                # Replies end with a blank line; a read may hold several or a partial one
+                pending += reply.decode("utf-8").replace('\r\n', '\n')
+                while '\n\n' in pending:
+                    message, pending = pending.split('\n\n', 1)
+                    if message.strip():
+                        self.parseRtspReply(message)
             except Exception:
                 # exit on teardown acked and socket closed
                 if self.requestSent == self.TEARDOWN:
@@ -248,6 +246,7 @@ class Client:
 
         if seqNum != self.rtspSeq:
             return
+        self.replyPending = False
 
         try:
             session = int(lines[2].split(' ')[1])
@@ -265,15 +264,32 @@ class Client:
         except Exception:
             status_code = 0
 
+        if self.requestSent == self.SET_PARAMETER:
+            if status_code == 200:
+                self.quality = self.requestedQuality
+            else:
+                # no such rendition on the server: stay on the current one
+                self.unavailableQualities.add(self.requestedQuality)
+            return
+
         if status_code != 200:
             return
 
         if self.requestSent == self.SETUP:
             self.state = self.READY
+            if 'server_port=' in data:
+                self.serverRtcpPort = int(data.split('server_port=')[1].split()[0].split(';')[0].split('-')[-1])
+                # Lost fragments can be retransmitted: keep frames in order while they are
+                self.frame_buffer.in_order = True
             self.openRtpPort()
+            if not self.rtcp_thread or not self.rtcp_thread.is_alive():
+                self.rtcp_thread = threading.Thread(target=self.listenRtcp, daemon=True)
+                self.rtcp_thread.start()
 
         elif self.requestSent == self.PLAY:
             self.state = self.PLAYING
+            # Time spent paused is not network delay: map timestamps afresh
+            self.playout.reset()
             self.playEvent.clear()
             # start buffered playback and RTP listening
             self.start_buffered_playback()
@@ -292,6 +308,8 @@ class Client:
             try:
                 if self.rtpSocket:
                     self.rtpSocket.close()
+                if self.rtcpSocket:
+                    self.rtcpSocket.close()
             except:
                 pass
             try:
@@ -305,13 +323,42 @@ class Client:
             self.rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
             self.rtpSocket.settimeout(0.5)
             self.rtpSocket.bind(('', self.rtpPort))
+            self.rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self.rtcpSocket.bind(('', self.rtpPort + 1))
         except Exception:
             tkinter.messagebox.showwarning('Unable to Bind', f'Unable to bind PORT={self.rtpPort}')
 
+    def listenRtcp(self):
+        """Take in the server's sender reports and send a receiver report every interval."""
+        next_report = time.monotonic() + REPORT_INTERVAL
+        while self.teardownAcked == 0 and self.rtcpSocket:
+            try:
+                readable, _, _ = select.select([self.rtcpSocket], [], [], max(0, next_report - time.monotonic()))
+                if readable:
+                    data = self.rtcpSocket.recv(2048)
+                    try:
+                        packets = RtcpPacket.decode(data)
+                    except ValueError:
+                        packets = [] # malformed report
+                    for packet in packets:
+                        if packet.packetType == RTCP_SR:
+                            self.analyzer.handle_sender_report(packet)
+                if time.monotonic() >= next_report:
+                    next_report = time.monotonic() + REPORT_INTERVAL
+                    report = self.analyzer.make_receiver_report(self.ssrc)
+                    if report and self.serverRtcpPort and self.state == self.PLAYING:
+                        self.rtcpSocket.sendto(report.encode(), (self.serverAddr, self.serverRtcpPort))
+            except (OSError, ValueError):
+                break # socket closed on teardown
+
     def listenRtp(self):
+        # One receive buffer and one packet object are reused for every datagram
+        buffer = bytearray(65535)
+        packet = RtpPacket()
+        next_nack = 0
         while True:
             try:
-                data, addr = self.rtpSocket.recvfrom(65535)
+                nbytes, addr = self.rtpSocket.recvfrom_into(buffer)
             except Exception:
                 if self.playEvent.is_set():
                     break
@@ -319,12 +366,11 @@ class Client:
                     break
                 continue
 
-            if not data:
+            if not nbytes:
                 continue
 
             try:
-                packet = RtpPacket()
-                packet.decode(data)
+                packet.decode(buffer, nbytes)
             except Exception:
                 continue
 
@@ -332,13 +378,22 @@ class Client:
                 frame_id = packet.frame_id()
                 frag_id = packet.fragment_id()
                 total_frag = packet.total_fragments()
+                frame_size = packet.frame_size()
                 payload = packet.get_payload()
+                timestamp = packet.timestamp()
             except Exception:
                 continue
 
             self.analyzer.handle_rtp(packet)
-
-            assembled = self.frame_buffer.add_frame_fragment(frame_id, frag_id, total_frag, payload)
+            if self.nack_tracker.on_packet(packet.seqNum()):
+                self.analyzer.record_repaired()
+            now = time.monotonic()
+            if now >= next_nack:
+                next_nack = now + NACK_INTERVAL
+                self.sendNack(now)
+
+            assembled = self.frame_buffer.add_frame_fragment(frame_id, frag_id, total_frag, payload, frame_size,
+                                                             timestamp)
             # If frame assembled immediately, we don't need to do anything here; playback thread will consume queue
 
             # check exit condition
@@ -347,6 +402,16 @@ class Client:
             if self.teardownAcked == 1:
                 break
 
+    def sendNack(self, now):
+        """Ask the server to resend the RTP packets that are still missing."""
+        lost = self.nack_tracker.due(self.analyzer.rtt_ms / 1000, now)
+        if lost and self.serverRtcpPort and self.analyzer.source_ssrc is not None:
+            try:
+                packet = RtcpPacket.nack(self.ssrc, self.analyzer.source_ssrc, lost)
+                self.rtcpSocket.sendto(packet.encode(), (self.serverAddr, self.serverRtcpPort))
+            except OSError:
+                pass
+
     def start_buffered_playback(self):
         if not hasattr(self, "_playback_thread") or not getattr(self, "_playback_thread").is_alive():
             t = threading.Thread(target=self.play_from_buffer, daemon=True)
@@ -354,26 +419,78 @@ class Client:
             t.start()
 
     def play_from_buffer(self):
-        delay = 1 / 30
+        interval = 1 / DISPLAY_FPS
         while True:
+            if self.teardownAcked == 1:
+                break
             if self.playEvent.is_set() and self.state != self.PLAYING:
                 # paused or stopping
+                self.decoder.clear()
                 time.sleep(0.01)
                 continue
-            frame = self.frame_buffer.get_next_frame()
-            if frame:
-                try:
-                    img = Image.open(io.BytesIO(frame))
-                    imgtk = ImageTk.PhotoImage(image=img)
-                    self.label.configure(image=imgtk)
-                    self.label.image = imgtk
-                except Exception:
-                    pass
-                time.sleep(delay)
-            else:
+
+            # Keep the decode pool fed; each frame is due at its playout time
+            now = time.monotonic()
+            while self.decoder.has_capacity():
+                timed = self.frame_buffer.get_next_timed_frame()
+                if timed is None:
+                    break
+                frame, received_at, timestamp = timed
+                deadline = self.playout.schedule(timestamp, received_at, now)
+                if deadline is not None:  # None: too late to be worth decoding
+                    self.decoder.submit(frame, deadline, received_at)
+
+            # Frames more than one interval late are dropped rather than shown
+            ready = self.decoder.next_ready(now, interval)
+            if ready is None:
                 time.sleep(0.005)
-            if self.teardownAcked == 1:
-                break
+                continue
+            deadline, img, received_at = ready
+            wait = deadline - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            # Tk is not thread-safe: the main loop picks the frame up in renderFrame
+            self.mailbox.put((img, received_at))
+
+    def renderFrame(self):
+        """Show the newest decoded frame; runs on the Tk main loop via after()."""
+        item = self.mailbox.take()
+        if item:
+            img, received_at = item
+            try:
+                imgtk = ImageTk.PhotoImage(image=img)
+                self.label.configure(image=imgtk)
+                self.label.image = imgtk
+                self.analytics.collect_playback_metrics(time.monotonic() - received_at, False)
+            except Exception:
+                pass
+        self.renderJob = self.master.after(RENDER_INTERVAL_MS, self.renderFrame)
+
+    def adaptQuality(self):
+        """Score recent network conditions and ask the server for the matching rendition.
+
+        Runs once per ADAPT_INTERVAL_MS from the first PLAY. A switch is only
+        requested while no other RTSP reply is awaited (a newer CSeq would
+        make the client discard it) and not requested again while pending.
+        """
+        if self.state == self.PLAYING and not self.replyPending:
+            score = self.controller.analyze_network_conditions(self.analyzer.get_network_stats())
+            quality = self.controller.adjust_streaming_quality(score)
+            if quality not in (self.quality, self.requestedQuality) and quality not in self.unavailableQualities:
+                self.requestedQuality = quality
+                self.sendRtspRequest(self.SET_PARAMETER)
+        self.adaptJob = self.master.after(ADAPT_INTERVAL_MS, self.adaptQuality)
+
+    def get_playback_stats(self):
+        """Reassembly and decode counters for this session."""
+        stats = self.frame_buffer.get_stats()
+        stats.update(self.decoder.get_stats())
+        stats.update(self.nack_tracker.get_stats())
+        stats.update(self.playout.get_stats())
+        stats['frames_replaced'] = self.mailbox.frames_replaced
+        stats['rendition'] = self.quality or 'source'
+        stats['display_latency'] = self.analytics.generate_performance_report()
+        return stats
 
     def handler(self):
         self.pauseMovie()
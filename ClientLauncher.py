@@ -1,6 +1,7 @@
 import sys
 from tkinter import Tk
 from Client import Client
+from FrameDecoder import DEFAULT_WORKERS
 
 if __name__ == "__main__":
 	try:
@@ -9,12 +10,18 @@ if __name__ == "__main__":
 		rtpPort = sys.argv[3]
 		fileName = sys.argv[4]	
 	except:
-		print("[Usage: ClientLauncher.py localhost Server_name Server_port RTP_port Video_file]\n")	
+		print("[Usage: ClientLauncher.py localhost Server_name Server_port RTP_port Video_file [WIDTHxHEIGHT] [decode_workers]]\n")	
+	
+	# Optional display size: frames are decoded straight to it
+	displaySize = None
+	if len(sys.argv) > 5:
+		displaySize = tuple(int(n) for n in sys.argv[5].lower().split('x'))
+	decodeWorkers = int(sys.argv[6]) if len(sys.argv) > 6 else DEFAULT_WORKERS
 	
 	root = Tk()
 	
 	# Create a new client
-	app = Client(root, serverAddr, serverPort, rtpPort, fileName)
+	app = Client(root, serverAddr, serverPort, rtpPort, fileName, displaySize, decodeWorkers)
 	app.master.title("RTPClient")	
 	root.mainloop()
 	
\ No newline at end of file
@@ -1,5 +1,8 @@
 import time
 
+from RtpPacket import RTP_CLOCK_RATE
+from RtcpPacket import RtcpPacket, ReportBlock, RTCP_RR
+
 class ClientNetworkAnalyzer:
     def __init__(self):
         self.last_timestamp = time.time()
@@ -9,29 +12,85 @@ class ClientNetworkAnalyzer:
         self.bytes_since_last = 0
         self.last_bandwidth_calc = time.time()
         self.current_bandwidth = 0
+        # Loss over the last bandwidth window, for adaptation
+        self.window_received = 0
+        self.window_lost = 0
+        self.recent_loss = 0
+        # RTSP round-trip time, smoothed
+        self.rtsp_sent = {}
+        self.rtt_ms = 0
+        # RFC 3550 reception statistics for RTCP receiver reports
+        self.source_ssrc = None
+        self.base_seq = 0
+        self.max_seq = 0
+        self.cycles = 0
+        self.expected_prior = 0
+        self.received_prior = 0
+        self.transit = None
+        self.jitter = 0.0  # RTP timestamp units
+        self.last_sr = 0
+        self.last_sr_arrival = 0
 
-    def record_rtsp_send(self, message):
-        pass
+    def record_rtsp_send(self, seq):
+        self.rtsp_sent[seq] = time.time()
 
-    def record_rtsp_reply(self, message):
-        pass
+    def record_rtsp_reply(self, seq):
+        sent = self.rtsp_sent.pop(seq, None)
+        if sent is None:
+            return
+        rtt = (time.time() - sent) * 1000
+        self.rtt_ms = rtt if not self.rtt_ms else 0.875 * self.rtt_ms + 0.125 * rtt
 
     def handle_rtp(self, packet):
         seq = packet.seqNum()
-        if self.expected_rtp_seq is None:
-            self.expected_rtp_seq = seq + 1
+        now = time.time()
+        in_order = True
+        if self.expected_rtp_seq is not None:
+            # 16-bit sequence numbers wrap; a small forward gap is loss
+            gap = (seq - self.expected_rtp_seq) & 0xFFFF
+            in_order = gap < 0x8000
+            if in_order:
+                self.lost_packets += gap
+                self.window_lost += gap
+                if seq < self.max_seq:
+                    self.cycles += 0x10000
+                self.max_seq = seq
+                self.expected_rtp_seq = (seq + 1) & 0xFFFF
         else:
-            if seq > self.expected_rtp_seq:
-                self.lost_packets += seq - self.expected_rtp_seq
-            self.expected_rtp_seq = seq + 1
+            self.source_ssrc = packet.ssrc
+            self.base_seq = self.max_seq = seq
+            self.expected_rtp_seq = (seq + 1) & 0xFFFF
         self.received_packets += 1
+        self.window_received += 1
+
+        # Interarrival jitter (RFC 3550 A.8), in RTP timestamp units; late
+        # (retransmitted or reordered) packets would only inflate it
+        if in_order:
+            transit = int(now * RTP_CLOCK_RATE) - packet.timestamp()
+            if self.transit is not None:
+                d = ((transit - self.transit + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+                self.jitter += (abs(d) - self.jitter) / 16
+            self.transit = transit
+
         payload = packet.getPayload()
         self.bytes_since_last += len(payload)
-        now = time.time()
         if now - self.last_bandwidth_calc >= 1:
             self.current_bandwidth = self.bytes_since_last / (now - self.last_bandwidth_calc)
             self.bytes_since_last = 0
             self.last_bandwidth_calc = now
+            self.recent_loss = self.window_lost / (self.window_lost + self.window_received)
+            self.window_lost = 0
+            self.window_received = 0
+
+    def record_repaired(self):
+        """A packet counted as lost arrived after all (NACK retransmission).
+
+        Only loss that was not repaired should push adaptation to a lower
+        rendition, so it comes off the current window's count; the
+        cumulative counters keep measuring the network's raw loss.
+        """
+        if self.window_lost:
+            self.window_lost -= 1
 
     def get_packet_loss(self):
         total = self.received_packets + self.lost_packets
@@ -41,3 +100,36 @@ class ClientNetworkAnalyzer:
 
     def get_bandwidth(self):
         return self.current_bandwidth
+
+    def get_network_stats(self):
+        """Recent conditions in the form AdaptiveStreamingController expects."""
+        return {
+            'latency': self.rtt_ms,
+            'packet_loss': self.recent_loss,
+            'bandwidth': self.current_bandwidth * 8 / 1000  # kbit/s
+        }
+
+    def handle_sender_report(self, packet):
+        """Remember the last SR so the next receiver report can echo it (LSR/DLSR)."""
+        self.last_sr = packet.compact_ntp()
+        self.last_sr_arrival = time.time()
+
+    def get_jitter_ms(self):
+        return self.jitter * 1000 / RTP_CLOCK_RATE
+
+    def make_receiver_report(self, ssrc):
+        """Build an RTCP RR about the stream received so far (RFC 3550 A.3); None before any RTP."""
+        if self.source_ssrc is None:
+            return None
+        extended_max = self.cycles + self.max_seq
+        expected = extended_max - self.base_seq + 1
+        lost = expected - self.received_packets
+        expected_interval = expected - self.expected_prior
+        lost_interval = expected_interval - (self.received_packets - self.received_prior)
+        self.expected_prior = expected
+        self.received_prior = self.received_packets
+        fraction = (lost_interval << 8) // expected_interval if expected_interval > 0 and lost_interval > 0 else 0
+        dlsr = int((time.time() - self.last_sr_arrival) * 65536) if self.last_sr else 0
+        block = ReportBlock(self.source_ssrc, min(fraction, 255), lost, extended_max, self.jitter,
+                            self.last_sr, dlsr & 0xFFFFFFFF)
+        return RtcpPacket(RTCP_RR, ssrc, [block])
@@ -0,0 +1,60 @@
+import struct
+
+# Prefix of every parity payload: data fragments per group (k), parity packets per group (m)
+FEC_HEADER_STRUCT = struct.Struct('!BB')
+FEC_HEADER_SIZE = FEC_HEADER_STRUCT.size
+
+
+def parse_fec(value):
+    """Parse a "K:M" FEC setting into (k, m); m parity packets protect every k data fragments."""
+    k, sep, m = value.partition(':')
+    k, m = int(k), int(m or 1)
+    if not 1 <= m <= k <= 255:
+        raise ValueError("FEC needs 1 <= M <= K <= 255, got %s" % value)
+    return k, m
+
+
+def parity_index(fragment, k, m):
+    """Index (counted from the first parity packet) of the parity covering a data fragment."""
+    return fragment // k * m + fragment % k % m
+
+
+def parity_members(index, k, m, total):
+    """Data fragments XORed into parity packet index.
+
+    Parity j of a group covers every m-th fragment starting at j, so a
+    burst of up to m consecutive losses in one group is still recoverable.
+    """
+    start = index // m * k
+    return range(start + index % m, min(start + k, total), m)
+
+
+def xor_payloads(payloads, size):
+    """XOR byte strings of at most size bytes, zero-padding the short ones."""
+    value = 0
+    for payload in payloads:
+        # Little-endian so that zero padding at the end does not change the integer
+        value ^= int.from_bytes(payload, 'little')
+    return value.to_bytes(size, 'little')
+
+
+def protect_fragments(fragments, k, m):
+    """Interleave XOR parity packets into a frame's (payload, marker) fragments.
+
+    Returns (fragment index, (payload, marker)) pairs in send order: each
+    group of k data fragments is followed by its parity packets, numbered
+    from len(fragments) on. Parity payloads are padded to the size of a
+    full fragment so the receiver can rebuild any fragment from them.
+    """
+    total = len(fragments)
+    size = len(fragments[0][0])
+    header = FEC_HEADER_STRUCT.pack(k, m)
+    packets = []
+    for start in range(0, total, k):
+        end = min(start + k, total)
+        packets.extend((index, fragments[index]) for index in range(start, end))
+        for j in range(min(m, end - start)):
+            index = start // k * m + j
+            parity = xor_payloads((fragments[i][0] for i in parity_members(index, k, m, total)), size)
+            packets.append((total + index, (header + parity, 0)))
+    return packets
@@ -0,0 +1,268 @@
+import threading, time, heapq
+from array import array
+from queue import Queue
+
+from FecCodec import FEC_HEADER_STRUCT, FEC_HEADER_SIZE, parity_index, parity_members, xor_payloads
+
+# Header fields come off the network: a frame claiming more is dropped rather than allocated
+MAX_FRAME_SIZE = 8 * 1024 * 1024
+MAX_FRAGMENTS = 8192
+
+
+class FrameSlot:
+    """Preallocated reassembly slot; reused for every frame id that maps to it."""
+    __slots__ = ('frameId', 'data', 'stamps', 'received', 'total', 'size', 'active',
+                 'parity', 'fecK', 'fecM', 'recovered', 'timestamp')
+
+    def __init__(self, capacity):
+        self.frameId = -1
+        self.data = bytearray(capacity)
+        # stamps[i] == frameId + 1 marks fragment i of the current frame as received,
+        # so the slot never has to be cleared between frames
+        self.stamps = array('L')
+        self.received = 0
+        self.total = 0
+        self.size = 0
+        self.active = False
+        # XOR parity payloads of the current frame by parity index, and their (k, m)
+        self.parity = {}
+        self.fecK = self.fecM = 1
+        self.recovered = 0
+        self.timestamp = 0  # RTP timestamp of the current frame
+
+
+class FrameBuffer:
+    """Reassembles fragmented frames into a ring of preallocated slots.
+
+    Each fragment is written straight to its offset in the slot's buffer.
+    Incomplete frames expire through a deadline heap that is checked on
+    insert, so no background cleanup thread is needed. With in_order set,
+    frames are queued in frame-id order: a frame completed while an earlier
+    one is still being filled (e.g. waiting for a retransmission) is held
+    until that one completes or expires. FEC parity packets (fragment index
+    >= fragment count) rebuild a single lost fragment of their group locally.
+    """
+
+    def __init__(self, max_buffer_size=50, fragment_timeout=2.0, cleanup_interval=1.0,
+                 max_pending_frames=64, slot_capacity=256 * 1024, in_order=False):
+        self.frame_queue = Queue(maxsize=max_buffer_size)
+        self.max_buffer_size = max_buffer_size
+        self.fragment_timeout = fragment_timeout
+        self.slots = [FrameSlot(slot_capacity) for _ in range(max_pending_frames)]
+        self.deadlines = []
+        self.lock = threading.Lock()
+        self.in_order = in_order
+        self.next_frame_id = None  # next frame id to queue, once known
+        self.held = {}  # frame_id -> (frame_bytes, completed_at, timestamp)
+        self.frames_completed = 0
+        self.frames_expired = 0
+        self.fragments_dropped = 0
+        self.frames_held = 0
+        self.frames_late = 0
+        self.fec_seen = False
+        self.fragments_recovered = 0
+        self.frames_recovered = 0
+        self.frames_unrecoverable = 0
+
+    def add_frame_fragment(self, frame_id, fragment_id, total_fragments, payload, frame_size, timestamp=0):
+        """Store one fragment or parity packet; return the frame bytes when it completes the frame.
+
+        timestamp is the packet's RTP timestamp, handed out with the frame for playout scheduling.
+        """
+        is_parity = fragment_id >= total_fragments
+        if (not 0 < total_fragments <= MAX_FRAGMENTS or not 0 <= frame_size <= MAX_FRAME_SIZE
+                or (is_parity and (len(payload) <= FEC_HEADER_SIZE or fragment_id >= 2 * total_fragments))):
+            self.fragments_dropped += 1
+            return None
+        now = time.monotonic()
+        with self.lock:
+            self._expire_locked(now)
+
+            slot = self.slots[frame_id % len(self.slots)]
+            if slot.frameId != frame_id:
+                if 0 < slot.frameId - frame_id <= len(self.slots):
+                    # late fragment of a frame whose slot was already reused
+                    self.fragments_dropped += 1
+                    return None
+                self._open_slot_locked(slot, frame_id, total_fragments, frame_size, timestamp)
+                heapq.heappush(self.deadlines, (now + self.fragment_timeout, frame_id))
+            elif not slot.active:
+                if not is_parity:  # parity for a frame completed without it is expected
+                    self.fragments_dropped += 1
+                return None
+            if total_fragments != slot.total:
+                # disagrees with the packet that opened the slot
+                self.fragments_dropped += 1
+                return None
+
+            if is_parity:
+                return self._add_parity_locked(slot, fragment_id - total_fragments, payload)
+            stamp = frame_id + 1
+            if slot.stamps[fragment_id] == stamp:
+                return None  # duplicate
+            length = len(payload)
+            offset = slot.size - length if fragment_id == slot.total - 1 else fragment_id * length
+            if offset < 0 or offset + length > slot.size:
+                self.fragments_dropped += 1
+                return None
+            slot.data[offset:offset + length] = payload
+            slot.stamps[fragment_id] = stamp
+            slot.received += 1
+
+            if slot.received == slot.total:
+                return self._assemble_frame_locked(slot)
+            if slot.parity:
+                return self._recover_locked(slot, parity_index(fragment_id, slot.fecK, slot.fecM))
+        return None
+
+    def _add_parity_locked(self, slot, index, payload):
+        k, m = FEC_HEADER_STRUCT.unpack_from(payload)
+        if not 1 <= m <= k or index in slot.parity:
+            self.fragments_dropped += 1
+            return None
+        self.fec_seen = True
+        slot.fecK, slot.fecM = k, m
+        # Copy: the payload is a view of the receive buffer
+        slot.parity[index] = bytes(payload[FEC_HEADER_SIZE:])
+        return self._recover_locked(slot, index)
+
+    def _recover_locked(self, slot, index):
+        """Rebuild the one missing fragment of a parity group; return the frame if that completes it."""
+        parity = slot.parity.get(index)
+        if parity is None:
+            return None
+        stamp = slot.frameId + 1
+        members = parity_members(index, slot.fecK, slot.fecM, slot.total)
+        missing = [i for i in members if slot.stamps[i] != stamp]
+        if len(missing) != 1:
+            return None
+        lost = missing[0]
+        # Parity is as long as a full fragment; only the last fragment is shorter
+        length = len(parity)
+        start = lost * length
+        end = min(start + length, slot.size)
+        if start >= end:
+            self.fragments_dropped += 1
+            return None
+        data = slot.data
+        rebuilt = xor_payloads([parity] + [data[i * length:min(i * length + length, slot.size)]
+                                           for i in members if i != lost], length)
+        data[start:end] = rebuilt[:end - start]
+        slot.stamps[lost] = stamp
+        slot.received += 1
+        slot.recovered += 1
+        self.fragments_recovered += 1
+        if slot.received == slot.total:
+            return self._assemble_frame_locked(slot)
+        return None
+
+    def _open_slot_locked(self, slot, frame_id, total, size, timestamp):
+        if slot.active:
+            # an incomplete frame is being overwritten by a newer one
+            self._count_expired_locked()
+        if len(slot.data) < size:
+            slot.data.extend(bytes(size - len(slot.data)))
+        if len(slot.stamps) < total:
+            slot.stamps.extend(bytes(total - len(slot.stamps)))
+        slot.frameId = frame_id
+        slot.total = total
+        slot.size = size
+        slot.timestamp = timestamp
+        slot.received = 0
+        slot.active = True
+        if slot.parity:
+            slot.parity.clear()
+        slot.recovered = 0
+
+    def _assemble_frame_locked(self, slot):
+        slot.active = False
+        self.frames_completed += 1
+        if slot.recovered:
+            self.frames_recovered += 1
+        frame_bytes = bytes(memoryview(slot.data)[:slot.size])
+        frame_id = slot.frameId
+        if not self.in_order:
+            self._queue_frame((frame_bytes, time.monotonic(), slot.timestamp))
+            return frame_bytes
+        if self.next_frame_id is not None and frame_id < self.next_frame_id:
+            # a newer frame was already shown; this one would go backwards
+            self.frames_late += 1
+            return frame_bytes
+        self.held[frame_id] = (frame_bytes, time.monotonic(), slot.timestamp)
+        if self._pending_before_locked(frame_id):
+            self.frames_held += 1
+        self._release_locked()
+        return frame_bytes
+
+    def _pending_before_locked(self, frame_id):
+        """True while a frame older than frame_id (and not yet queued) is still filling."""
+        start = frame_id - len(self.slots) if self.next_frame_id is None else self.next_frame_id
+        for earlier in range(max(start, frame_id - len(self.slots)), frame_id):
+            slot = self.slots[earlier % len(self.slots)]
+            if slot.active and slot.frameId == earlier:
+                return True
+        return False
+
+    def _release_locked(self):
+        """Queue held frames in order, stopping at the first older frame still filling."""
+        while self.held:
+            frame_id = min(self.held)
+            if self._pending_before_locked(frame_id):
+                return
+            self._queue_frame(self.held.pop(frame_id))
+            self.next_frame_id = frame_id + 1
+
+    def _queue_frame(self, timed):
+        if not self.frame_queue.full():
+            try:
+                self.frame_queue.put_nowait(timed)
+            except:
+                pass
+
+    def _expire_locked(self, now):
+        deadlines = self.deadlines
+        while deadlines and deadlines[0][0] <= now:
+            _, frame_id = heapq.heappop(deadlines)
+            slot = self.slots[frame_id % len(self.slots)]
+            if slot.frameId == frame_id and slot.active:
+                slot.active = False
+                self._count_expired_locked()
+        if self.held:
+            self._release_locked()
+
+    def _count_expired_locked(self):
+        self.frames_expired += 1
+        if self.fec_seen:
+            # lost even though the stream carries parity
+            self.frames_unrecoverable += 1
+
+    def get_buffer_health(self):
+        return self.frame_queue.qsize() / self.max_buffer_size
+
+    def get_next_frame(self):
+        timed = self.get_next_timed_frame()
+        return timed[0] if timed else None
+
+    def get_next_timed_frame(self):
+        """Return (frame_bytes, completed_at, timestamp): the monotonic time the frame was
+        reassembled and its RTP timestamp."""
+        try:
+            return self.frame_queue.get_nowait()
+        except:
+            return None
+
+    def get_stats(self):
+        return {
+            'frames_completed': self.frames_completed,
+            'frames_expired': self.frames_expired,
+            'fragments_dropped': self.fragments_dropped,
+            'frames_held': self.frames_held,
+            'frames_late': self.frames_late,
+            'fec_recovered_fragments': self.fragments_recovered,
+            'fec_recovered_frames': self.frames_recovered,
+            'fec_unrecoverable_frames': self.frames_unrecoverable
+        }
+
+    def stop(self):
+        """Kept for callers of the old cleanup thread; nothing runs in the background."""
+        pass
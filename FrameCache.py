@@ -0,0 +1,110 @@
+import os
+import threading
+from collections import OrderedDict
+
+DEFAULT_BUDGET_BYTES = 256 * 1024 * 1024
+
+
+class FrameCache:
+    """Process-wide LRU cache of video frames keyed by (file, frame number).
+
+    Entries are evicted least-recently-used first once the cached payload
+    bytes exceed the budget. Frame indexes are shared per file as well, so
+    a second viewer of a title does not rescan it. Keys include the file's
+    size and modification time: a file replaced while the server runs gets
+    a fresh index and fresh frames instead of stale offsets.
+    """
+
+    def __init__(self, budget_bytes=DEFAULT_BUDGET_BYTES):
+        self.budget_bytes = budget_bytes
+        self.frames = OrderedDict()
+        self.indexes = {}
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(filename, fileno=None):
+        """(path, size, mtime) of a file; pass fileno to describe the file actually opened."""
+        info = os.fstat(fileno) if fileno is not None else os.stat(filename)
+        return os.path.abspath(filename), info.st_size, info.st_mtime_ns
+
+    def get_index(self, filename, build, key=None):
+        """Return the (offsets, lengths) index of a file, building it once via build()."""
+        if key is None:
+            key = self.key(filename)
+        with self.lock:
+            index = self.indexes.get(key)
+        if index is None:
+            index = build()
+            with self.lock:
+                # Indexes of earlier versions of the file are no use any more
+                for stale in [other for other in self.indexes if other[0] == key[0] and other != key]:
+                    del self.indexes[stale]
+                index = self.indexes.setdefault(key, index)
+        return index
+
+    def get_frame(self, file_key, frame_number, read):
+        """Return a cached frame, calling read(frame_number) and caching the result on a miss.
+
+        file_key is the value of FrameCache.key() for the file, computed once
+        by the caller rather than on every frame.
+        """
+        key = (file_key, frame_number)
+        with self.lock:
+            data = self.frames.get(key)
+            if data is not None:
+                self.frames.move_to_end(key)
+                self.hits += 1
+                return data
+            self.misses += 1
+
+        data = read(frame_number)
+        if data:
+            self.put(key, data)
+        return data
+
+    def put(self, key, data):
+        size = len(data)
+        if size > self.budget_bytes:
+            return
+        with self.lock:
+            old = self.frames.pop(key, None)
+            if old is not None:
+                self.current_bytes -= len(old)
+            self.frames[key] = data
+            self.current_bytes += size
+            while self.current_bytes > self.budget_bytes:
+                _, evicted = self.frames.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def resize(self, budget_bytes):
+        """Change the byte budget, evicting immediately if it shrank."""
+        with self.lock:
+            self.budget_bytes = budget_bytes
+            while self.current_bytes > self.budget_bytes and self.frames:
+                _, evicted = self.frames.popitem(last=False)
+                self.current_bytes -= len(evicted)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.frames.clear()
+            self.indexes.clear()
+            self.current_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self.frames),
+                'bytes': self.current_bytes,
+                'budget_bytes': self.budget_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': self.hits / lookups if lookups else 0
+            }
@@ -0,0 +1,121 @@
+import io, time, threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+DEFAULT_WORKERS = 2
+
+
+class FrameDecoder:
+    """Decodes JPEG frames on a small thread pool, in display order.
+
+    With a target size set, Pillow's draft() lets libjpeg decode at 1/2, 1/4
+    or 1/8 scale before the final resize, so a 1080p frame shown in a small
+    window never pays for a full-size decode. Frames whose display time has
+    already passed are dropped instead of delaying the ones behind them.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, target_size=None):
+        self.workers = workers
+        self.target_size = target_size
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='jpeg-decode')
+        self.pending = deque()  # (deadline, future) in display order
+        self.lock = threading.Lock()
+        self.frames_decoded = 0
+        self.frames_dropped = 0
+        self.decode_errors = 0
+        self.total_decode_time = 0.0
+        self.max_decode_time = 0.0
+
+    def decode(self, frame):
+        start = time.perf_counter()
+        img = Image.open(io.BytesIO(frame))
+        size = self.target_size
+        if size and (img.size[0] > size[0] or img.size[1] > size[1]):
+            img.draft('RGB', size)
+            img.thumbnail(size, Image.BILINEAR)
+        img.load()
+        elapsed = time.perf_counter() - start
+        with self.lock:
+            self.frames_decoded += 1
+            self.total_decode_time += elapsed
+            if elapsed > self.max_decode_time:
+                self.max_decode_time = elapsed
+        return img
+
+    def submit(self, frame, deadline, tag=None):
+        """Queue a frame for decoding; it is due on screen at deadline (time.monotonic)."""
+        self.pending.append((deadline, tag, self.pool.submit(self.decode, frame)))
+
+    def has_capacity(self):
+        return len(self.pending) < self.workers
+
+    def next_ready(self, now, late_after):
+        """Return (deadline, image, tag) for the next frame in order once it is decoded.
+
+        Decoded frames already more than late_after seconds past their deadline
+        are dropped. Returns None while the next frame is still decoding.
+        """
+        while self.pending:
+            deadline, tag, future = self.pending[0]
+            if not future.done():
+                return None
+            self.pending.popleft()
+            try:
+                img = future.result()
+            except Exception:
+                self.decode_errors += 1
+                continue
+            if now - deadline > late_after:
+                self.drop()
+                continue
+            return deadline, img, tag
+        return None
+
+    def drop(self, count=1):
+        """Count frames skipped without being shown."""
+        with self.lock:
+            self.frames_dropped += count
+
+    def clear(self):
+        """Forget frames queued for display (e.g. on PAUSE)."""
+        while self.pending:
+            self.pending.popleft()[2].cancel()
+
+    def get_stats(self):
+        with self.lock:
+            return {
+                'frames_decoded': self.frames_decoded,
+                'frames_dropped': self.frames_dropped,
+                'decode_errors': self.decode_errors,
+                'avg_decode_ms': 1000 * self.total_decode_time / self.frames_decoded if self.frames_decoded else 0,
+                'max_decode_ms': 1000 * self.max_decode_time
+            }
+
+    def shutdown(self):
+        self.clear()
+        self.pool.shutdown(wait=False)
+
+
+class FrameMailbox:
+    """Single-slot hand-off of the latest decoded frame to the GUI thread.
+
+    put() never blocks: a frame the GUI has not picked up yet is replaced,
+    so a slow main loop shows fewer frames instead of falling behind.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.item = None
+        self.frames_replaced = 0
+
+    def put(self, item):
+        with self.lock:
+            if self.item is not None:
+                self.frames_replaced += 1
+            self.item = item
+
+    def take(self):
+        with self.lock:
+            item, self.item = self.item, None
+            return item
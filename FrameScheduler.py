@@ -0,0 +1,142 @@
+import threading, time, heapq, itertools
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+
+# Once a stream falls this many frame intervals behind, its clock is rebased
+# to now instead of bursting the backlog out
+MAX_BACKLOG_FRAMES = 5
+
+
+class ScheduledStream:
+    """Per-session frame clock owned by a FrameScheduler."""
+    __slots__ = ('send', 'interval', 'start', 'frame', 'cancelled', 'idle')
+
+    def __init__(self, send, interval, start):
+        self.send = send
+        self.interval = interval
+        self.start = start
+        self.frame = 0
+        self.cancelled = False
+        self.idle = threading.Event()
+        self.idle.set()
+
+    def deadline(self):
+        return self.start + self.frame * self.interval
+
+
+class FrameScheduler:
+    """Serves every session's frames from one timer thread.
+
+    Each stream's deadlines are absolute (start + n / fps on the monotonic
+    clock), so pacing does not drift with send time. Due frames are handed
+    to a small worker pool; PAUSE and TEARDOWN simply cancel the stream.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS):
+        self.workers = workers
+        self.heap = []
+        self.order = itertools.count()
+        self.cond = threading.Condition()
+        self.pool = None
+        self.thread = None
+        self.active_streams = 0
+        self.frames_sent = 0
+        self.deadline_misses = 0
+        self.lag_samples = 0
+        self.total_lag = 0.0
+        self.max_lag = 0.0
+        self.stats_lock = threading.Lock()
+
+    def schedule(self, send, fps):
+        """Start calling send() once per frame at fps; send returns False to stop."""
+        stream = ScheduledStream(send, 1.0 / fps, time.monotonic())
+        with self.cond:
+            if self.thread is None:
+                self.pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='rtp-send')
+                self.thread = threading.Thread(target=self.run, name='frame-clock', daemon=True)
+                self.thread.start()
+            stream.frame = 1
+            heapq.heappush(self.heap, (stream.deadline(), next(self.order), stream))
+            self.active_streams += 1
+            self.cond.notify()
+        return stream
+
+    def cancel(self, stream, wait=True):
+        """Stop a stream; optionally wait for a frame that is being sent to finish."""
+        with self.cond:
+            if not stream.cancelled:
+                stream.cancelled = True
+                self.active_streams -= 1
+        if wait and not threading.current_thread().name.startswith('rtp-send'):
+            stream.idle.wait()
+
+    def run(self):
+        while True:
+            with self.cond:
+                while True:
+                    # Drop cancelled streams as they reach the top of the heap
+                    while self.heap and self.heap[0][2].cancelled:
+                        heapq.heappop(self.heap)
+                    if self.heap:
+                        timeout = self.heap[0][0] - time.monotonic()
+                        if timeout <= 0:
+                            break
+                    else:
+                        timeout = None
+                    self.cond.wait(timeout)
+                deadline, _, stream = heapq.heappop(self.heap)
+
+            # A stream is only re-queued once its previous frame is sent
+            stream.idle.clear()
+            self.pool.submit(self.dispatch, stream, deadline)
+
+    def dispatch(self, stream, deadline):
+        now = time.monotonic()
+        self.record_lag(now - deadline, stream.interval)
+        try:
+            if stream.cancelled:
+                return
+            if stream.send() is False:
+                self.cancel(stream, wait=False)
+                return
+            self.record_sent()
+        except Exception:
+            print("Connection Error")
+        finally:
+            stream.idle.set()
+        self.reschedule(stream, now)
+
+    def reschedule(self, stream, now):
+        with self.cond:
+            if stream.cancelled:
+                return
+            stream.frame += 1
+            if now - stream.deadline() > MAX_BACKLOG_FRAMES * stream.interval:
+                stream.start = now - stream.frame * stream.interval
+            heapq.heappush(self.heap, (stream.deadline(), next(self.order), stream))
+            self.cond.notify()
+
+    def record_sent(self):
+        with self.stats_lock:
+            self.frames_sent += 1
+
+    def record_lag(self, lag, interval):
+        """Account dispatch lag; more than half a frame interval counts as a deadline miss."""
+        with self.stats_lock:
+            self.lag_samples += 1
+            self.total_lag += lag
+            if lag > self.max_lag:
+                self.max_lag = lag
+            if lag > interval / 2:
+                self.deadline_misses += 1
+
+    def get_stats(self):
+        with self.stats_lock:
+            return {
+                'active_streams': self.active_streams,
+                'frames_sent': self.frames_sent,
+                'deadline_misses': self.deadline_misses,
+                'avg_lag_ms': 1000 * self.total_lag / self.lag_samples if self.lag_samples else 0,
+                'max_lag_ms': 1000 * self.max_lag
+            }
@@ -0,0 +1,327 @@
+import socket, selectors, random, time
+
+from ClientNetworkAnalyzer import ClientNetworkAnalyzer
+from FrameBuffer import FrameBuffer
+from PlayoutBuffer import PlayoutBuffer
+from NackTracker import NackTracker, GIVE_UP_AFTER
+from RtpPacket import RtpPacket
+from RtcpPacket import RtcpPacket, RTCP_SR
+from RtcpListener import REPORT_INTERVAL
+from RtspParser import RtspReplyParser, RtspParseError
+
+# Same reassembly and NACK timing as the Tk client
+FRAGMENT_TIMEOUT = GIVE_UP_AFTER + 0.1
+NACK_INTERVAL = 0.01
+
+# Even ports tried for the RTP/RTCP socket pair
+CLIENT_PORT_RANGE = (20000, 60000)
+PORT_PAIR_ATTEMPTS = 32
+
+RECV_BUFFER_BYTES = 1 << 20
+
+
+def bind_port_pair(host=''):
+    """Bind UDP sockets on an even port and the odd port above it (RTP, RTCP)."""
+    for _ in range(PORT_PAIR_ATTEMPTS):
+        port = random.randrange(CLIENT_PORT_RANGE[0], CLIENT_PORT_RANGE[1], 2)
+        rtp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        rtcp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            rtp.bind((host, port))
+            rtcp.bind((host, port + 1))
+            return rtp, rtcp
+        except OSError:
+            rtp.close()
+            rtcp.close()
+    raise OSError("no free RTP/RTCP port pair")
+
+
+class HeadlessClient:
+    """RTSP/RTP client without Tk or PIL, for load tests and scripted playback.
+
+    It speaks the same protocol as Client: SETUP with an RTP/RTCP port
+    pair, PLAY and TEARDOWN over RTSP, frames reassembled in a FrameBuffer,
+    lost packets NACKed and receiver reports sent over RTCP. Frames are
+    counted, not decoded. All sockets are non-blocking so one selector can
+    drive many clients: register() them, call the on_* handlers as they
+    become readable and tick() every few milliseconds.
+    """
+    INIT = 0
+    READY = 1
+    PLAYING = 2
+    CLOSED = 3
+
+    def __init__(self, serverAddr, serverPort, fileName, nack=True, autoplay=True):
+        self.serverAddr = serverAddr
+        self.serverPort = int(serverPort)
+        self.fileName = fileName
+        self.nack = nack
+        self.autoplay = autoplay
+        self.state = self.INIT
+        self.rtspSeq = 0
+        self.sessionId = None
+        self.pending = {}  # CSeq -> method awaiting a reply
+        self.parser = RtspReplyParser()
+        self.rtspSocket = self.rtpSocket = self.rtcpSocket = None
+        self.selector = None
+        self.serverRtcpPort = None
+        self.ssrc = random.randint(1, 0xFFFFFFFF)
+        self.analyzer = ClientNetworkAnalyzer()
+        self.frame_buffer = FrameBuffer(fragment_timeout=FRAGMENT_TIMEOUT)
+        # Frames are not shown, but scheduled as the Tk client would to count late ones
+        self.playout = PlayoutBuffer()
+        self.nack_tracker = NackTracker()
+        self.packet = RtpPacket()
+        self.buffer = bytearray(65535)
+        self.next_nack = 0
+        self.next_report = 0
+        self.error = None
+        # Playback counters
+        self.started_at = None
+        self.first_frame_at = None
+        self.last_frame_at = None
+        self.frames = 0
+        self.frame_bytes = 0
+        self.packets = 0
+        self.bytes = 0
+
+    # ---- connection and RTSP ----
+
+    def connect(self, timeout=5.0):
+        """Open the RTSP connection and the RTP/RTCP pair, then send SETUP."""
+        self.started_at = time.monotonic()
+        self.rtspSocket = socket.create_connection((self.serverAddr, self.serverPort), timeout=timeout)
+        self.rtspSocket.setblocking(False)
+        self.rtpSocket, self.rtcpSocket = bind_port_pair()
+        self.rtpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        self.rtpSocket.setblocking(False)
+        self.rtcpSocket.setblocking(False)
+        rtpPort = self.rtpSocket.getsockname()[1]
+        self.sendRequest('SETUP', 'Transport: RTP/UDP; client_port=%d-%d' % (rtpPort, rtpPort + 1))
+
+    def register(self, selector):
+        self.selector = selector
+        selector.register(self.rtspSocket, selectors.EVENT_READ, (self, self.on_rtsp))
+        selector.register(self.rtpSocket, selectors.EVENT_READ, (self, self.on_rtp))
+        selector.register(self.rtcpSocket, selectors.EVENT_READ, (self, self.on_rtcp))
+
+    def sendRequest(self, method, *headers):
+        self.rtspSeq += 1
+        lines = ['%s %s RTSP/1.0' % (method, self.fileName), 'CSeq: %d' % self.rtspSeq]
+        if self.sessionId is not None:
+            lines.append('Session: %s' % self.sessionId)
+        lines.extend(headers)
+        self.pending[self.rtspSeq] = method
+        self.analyzer.record_rtsp_send(self.rtspSeq)
+        try:
+            self.rtspSocket.send(('\r\n'.join(lines) + '\r\n\r\n').encode())
+        except OSError as e:
+            self.fail('send %s: %s' % (method, e))
+
+    def play(self, scale=None):
+        """PLAY, or with scale (e.g. 4, -8) fast-forward/rewind by sending every Nth frame."""
+        if self.state == self.READY or (self.state == self.PLAYING and scale is not None):
+            self.sendRequest('PLAY', *(['Scale: %g' % scale] if scale is not None else []))
+
+    def pause(self):
+        if self.state == self.PLAYING:
+            self.sendRequest('PAUSE')
+
+    def teardown(self):
+        if self.state in (self.READY, self.PLAYING):
+            self.sendRequest('TEARDOWN')
+
+    def on_rtsp(self):
+        try:
+            data = self.rtspSocket.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            return self.fail('rtsp: %s' % e)
+        if not data:
+            if self.state != self.INIT or self.pending:
+                self.close()
+            return
+        try:
+            replies = self.parser.feed(data)
+        except RtspParseError as e:
+            return self.fail('bad reply: %s' % e)
+        for reply in replies:
+            self.handleReply(reply)
+
+    def handleReply(self, reply):
+        try:
+            seq = int(reply.cseq)
+        except ValueError:
+            return
+        method = self.pending.pop(seq, None)
+        self.analyzer.record_rtsp_reply(seq)
+        if method is None:
+            return
+        if reply.status != 200:
+            if method in ('SETUP', 'PLAY'):
+                self.fail('%s: %d %s' % (method, reply.status, reply.reason))
+            return
+        if method == 'SETUP':
+            self.sessionId = reply.header('session', '').split(';')[0] or None
+            transport = reply.header('transport', '')
+            if 'server_port=' in transport:
+                self.serverRtcpPort = int(transport.split('server_port=')[1].split(';')[0].split('-')[-1])
+                # Lost fragments can be retransmitted: keep frames in order while they are
+                self.frame_buffer.in_order = self.nack
+            self.state = self.READY
+            if self.autoplay:
+                self.play()
+        elif method == 'PLAY':
+            self.state = self.PLAYING
+            self.playout.reset()
+        elif method == 'PAUSE':
+            self.state = self.READY
+        elif method == 'TEARDOWN':
+            self.close()
+
+    # ---- RTP and RTCP ----
+
+    def on_rtp(self):
+        """Read every datagram waiting on the RTP socket."""
+        packet = self.packet
+        buffer = self.buffer
+        while True:
+            try:
+                nbytes = self.rtpSocket.recv_into(buffer)
+            except BlockingIOError:
+                break
+            except OSError:
+                return
+            try:
+                packet.decode(buffer, nbytes)
+            except Exception:
+                continue
+            self.packets += 1
+            self.bytes += nbytes
+            self.analyzer.handle_rtp(packet)
+            if self.nack:
+                if self.nack_tracker.on_packet(packet.seqNum()):
+                    self.analyzer.record_repaired()
+            self.frame_buffer.add_frame_fragment(packet.frame_id(), packet.fragment_id(),
+                                                 packet.total_fragments(), packet.get_payload(),
+                                                 packet.frame_size(), packet.timestamp())
+        self.drainFrames()
+
+    def drainFrames(self):
+        while True:
+            timed = self.frame_buffer.get_next_timed_frame()
+            if timed is None:
+                return
+            frame, completed_at, timestamp = timed
+            self.playout.schedule(timestamp, completed_at)
+            if self.first_frame_at is None:
+                self.first_frame_at = completed_at
+            self.last_frame_at = completed_at
+            self.frames += 1
+            self.frame_bytes += len(frame)
+
+    def on_rtcp(self):
+        try:
+            data = self.rtcpSocket.recv(2048)
+        except OSError:
+            return
+        try:
+            packets = RtcpPacket.decode(data)
+        except ValueError:
+            return
+        for packet in packets:
+            if packet.packetType == RTCP_SR:
+                self.analyzer.handle_sender_report(packet)
+
+    def tick(self, now=None):
+        """Send due NACKs and receiver reports; call every few milliseconds."""
+        if self.state != self.PLAYING or not self.serverRtcpPort:
+            return
+        now = time.monotonic() if now is None else now
+        address = (self.serverAddr, self.serverRtcpPort)
+        try:
+            if self.nack and now >= self.next_nack:
+                self.next_nack = now + NACK_INTERVAL
+                lost = self.nack_tracker.due(self.analyzer.rtt_ms / 1000, now)
+                if lost and self.analyzer.source_ssrc is not None:
+                    self.rtcpSocket.sendto(RtcpPacket.nack(self.ssrc, self.analyzer.source_ssrc, lost).encode(),
+                                           address)
+            if now >= self.next_report:
+                self.next_report = now + REPORT_INTERVAL
+                report = self.analyzer.make_receiver_report(self.ssrc)
+                if report:
+                    self.rtcpSocket.sendto(report.encode(), address)
+        except OSError:
+            pass
+
+    # ---- lifecycle ----
+
+    def fail(self, message):
+        if self.error is None:
+            self.error = message
+        self.close()
+
+    def close(self):
+        """Close every socket (unregistering it from the selector); safe to call twice."""
+        self.state = self.CLOSED
+        for sock in (self.rtspSocket, self.rtpSocket, self.rtcpSocket):
+            if sock is None or sock.fileno() < 0:
+                continue
+            if self.selector is not None:
+                try:
+                    self.selector.unregister(sock)
+                except (KeyError, ValueError):
+                    pass
+            sock.close()
+
+    def run(self, duration):
+        """Play for duration seconds on a private selector, tear down and return get_stats()."""
+        selector = selectors.DefaultSelector()
+        self.connect()
+        self.register(selector)
+        deadline = time.monotonic() + duration
+        drive(selector, [self], deadline)
+        self.teardown()
+        drive(selector, [self], time.monotonic() + 1.0, until=lambda: self.state == self.CLOSED)
+        self.close()
+        selector.close()
+        return self.get_stats()
+
+    def get_stats(self):
+        """Playback summary: frame rate, time to first frame, loss and reassembly."""
+        buffer_stats = self.frame_buffer.get_stats()
+        attempted = buffer_stats['frames_completed'] + buffer_stats['frames_expired']
+        span = (self.last_frame_at - self.first_frame_at) if self.frames > 1 else 0
+        stats = {
+            'frames': self.frames,
+            'fps': (self.frames - 1) / span if span > 0 else 0,
+            'ttff_ms': (self.first_frame_at - self.started_at) * 1000 if self.first_frame_at is not None else None,
+            'packets': self.packets,
+            'bytes': self.bytes,
+            'loss_ratio': self.analyzer.get_packet_loss(),
+            'reassembly_ratio': buffer_stats['frames_completed'] / attempted if attempted else None,
+            'error': self.error
+        }
+        stats.update(buffer_stats)
+        stats.update(self.nack_tracker.get_stats())
+        stats.update(self.playout.get_stats())
+        return stats
+
+
+def drive(selector, clients, deadline, until=None, tick_interval=NACK_INTERVAL):
+    """Run a selector loop over HeadlessClients until deadline (or until() is true)."""
+    next_tick = 0
+    while True:
+        now = time.monotonic()
+        if now >= deadline or (until is not None and until()):
+            return
+        for key, _ in selector.select(max(0, min(next_tick, deadline) - now)):
+            client, handler = key.data
+            if client.state != client.CLOSED:
+                handler()
+        now = time.monotonic()
+        if now >= next_tick:
+            next_tick = now + tick_interval
+            for client in clients:
+                client.tick(now)
@@ -0,0 +1,460 @@
+import re, sys, json, time, heapq, random, signal, socket, argparse, selectors, threading
+
+from HeadlessClient import bind_port_pair
+from RtspParser import HEADER_END
+
+# Packets read from one socket before other sockets and due deliveries get a turn
+RECV_BATCH = 64
+# Longest the engine sleeps, so script steps apply on time
+MAX_WAIT = 0.05
+# Full-HD streams arrive in bursts of a whole frame's packets
+RECV_BUFFER_BYTES = 4 << 20
+
+CONTENT_LENGTH = re.compile(rb'(?im)^content-length:\s*(\d+)')
+CSEQ = re.compile(rb'(?im)^cseq:\s*(\d+)')
+CLIENT_PORT = re.compile(rb'client_port=(\d+)(?:-(\d+))?')
+SERVER_PORT = re.compile(rb'server_port=(\d+)(?:-(\d+))?')
+
+# Impairment settings and their defaults; times are seconds, rate is bytes/s
+DEFAULTS = {
+    'loss': 0.0,          # random loss probability (in the good state when gilbert is set)
+    'gilbert': None,      # (p good->bad, p bad->good, loss in bad state): bursty loss
+    'delay': 0.0,
+    'jitter': 0.0,        # uniform +/- around delay; does not reorder by itself
+    'reorder': 0.0,       # probability that a packet is held back by reorder_delay
+    'reorder_delay': 0.01,
+    'duplicate': 0.0,
+    'rate': 0,            # token-bucket bottleneck, 0 = unlimited
+    'bucket': 15000,      # bucket depth in bytes
+    'queue': 0.2,         # longest a packet may wait for the bottleneck before it is dropped
+}
+
+
+class Impairment:
+    """Per-link network model: loss, bottleneck queue, delay, jitter, reordering, duplication.
+
+    schedule() turns one packet into the times it should be delivered at:
+    none when it is lost, two when it is duplicated. Settings can change
+    while packets flow (update); queue and loss state carry over.
+    """
+
+    def __init__(self, settings, rng):
+        self.rng = rng
+        self.__dict__.update(DEFAULTS)
+        self.update(settings)
+        self.bad = False
+        self.tokens = self.bucket
+        self.last_departure = 0.0
+        self.last_delivery = 0.0
+        self.received = 0
+        self.lost = 0
+        self.queue_drops = 0
+        self.reordered = 0
+        self.duplicated = 0
+
+    def update(self, settings):
+        for key, value in settings.items():
+            if key not in DEFAULTS:
+                raise ValueError("unknown impairment %r" % key)
+            setattr(self, key, value)
+
+    def drop(self):
+        rng = self.rng
+        if self.gilbert:
+            to_bad, to_good, bad_loss = self.gilbert
+            if self.bad:
+                self.bad = rng.random() >= to_good
+            else:
+                self.bad = rng.random() < to_bad
+            if self.bad:
+                return rng.random() < bad_loss
+        return self.loss > 0 and rng.random() < self.loss
+
+    def shape(self, size, now):
+        """Departure time through the token bucket, or None if the queue is full."""
+        rate = self.rate
+        start = max(now, self.last_departure)
+        tokens = min(self.bucket, self.tokens + (start - self.last_departure) * rate)
+        depart = start if tokens >= size else start + (size - tokens) / rate
+        if depart - now > self.queue:
+            return None
+        self.tokens = min(self.bucket, tokens + (depart - start) * rate) - size
+        self.last_departure = depart
+        return depart
+
+    def schedule(self, size, now):
+        self.received += 1
+        if self.drop():
+            self.lost += 1
+            return ()
+        deliver = now
+        if self.rate:
+            deliver = self.shape(size, now)
+            if deliver is None:
+                self.queue_drops += 1
+                return ()
+        deliver += self.delay
+        if self.jitter:
+            deliver += self.rng.uniform(-self.jitter, self.jitter)
+        rng = self.rng
+        if self.reorder and rng.random() < self.reorder:
+            self.reordered += 1
+            deliver = max(deliver, now) + self.reorder_delay
+        else:
+            # Jitter alone keeps packets in order, like a single queue would
+            deliver = max(deliver, now, self.last_delivery)
+            self.last_delivery = deliver
+        if self.duplicate and rng.random() < self.duplicate:
+            self.duplicated += 1
+            return (deliver, deliver)
+        return (deliver,)
+
+    def get_stats(self):
+        return {
+            'received': self.received,
+            'lost': self.lost,
+            'queue_drops': self.queue_drops,
+            'reordered': self.reordered,
+            'duplicated': self.duplicated,
+            'queue_delay_ms': max(0.0, self.last_departure - time.monotonic()) * 1000,
+        }
+
+
+class UdpRelay:
+    """Forwards datagrams arriving on one socket out of another, through an optional Impairment."""
+
+    def __init__(self, inSocket, outSocket, dest, impairment=None):
+        self.inSocket = inSocket
+        self.outSocket = outSocket
+        self.dest = dest
+        self.impairment = impairment
+        inSocket.setblocking(False)
+
+
+class ImpairmentEngine:
+    """One thread relays every registered UDP socket and releases delayed packets on time.
+
+    Packets that are due immediately are sent straight from the receive
+    loop; the rest wait in a heap ordered by delivery time.
+    """
+
+    def __init__(self, settings, script=(), seed=None, impair_rtcp=False):
+        self.settings = dict(settings)
+        self.script = sorted(script, key=lambda step: step[0])
+        self.rng = random.Random(seed)
+        self.impairRtcp = impair_rtcp
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.impairments = []
+        self.heap = []
+        self.counter = 0
+        self.started = None
+        self.forwarded = 0
+        self.send_errors = 0
+
+    def impairment(self):
+        with self.lock:
+            impairment = Impairment(self.settings, self.rng)
+            self.impairments.append(impairment)
+        return impairment
+
+    def add(self, relay):
+        with self.lock:
+            self.selector.register(relay.inSocket, selectors.EVENT_READ, relay)
+
+    def remove(self, relay):
+        with self.lock:
+            try:
+                self.selector.unregister(relay.inSocket)
+            except (KeyError, ValueError):
+                pass
+            if relay.impairment in self.impairments:
+                self.impairments.remove(relay.impairment)
+
+    def applyScript(self, now):
+        elapsed = now - self.started
+        while self.script and self.script[0][0] <= elapsed:
+            at, changes = self.script.pop(0)
+            with self.lock:
+                self.settings.update(changes)
+                for impairment in self.impairments:
+                    impairment.update(changes)
+            print(json.dumps({'t': round(elapsed, 3), 'apply': changes}), flush=True)
+
+    def run(self):
+        self.started = time.monotonic()
+        heap = self.heap
+        while True:
+            now = time.monotonic()
+            if self.script:
+                self.applyScript(now)
+            timeout = MAX_WAIT
+            if heap:
+                timeout = max(0.0, min(timeout, heap[0][0] - now))
+            try:
+                events = self.selector.select(timeout)
+            except OSError:
+                events = []  # a socket was closed while we waited
+            now = time.monotonic()
+            for key, _ in events:
+                self.receive(key.data, now)
+            while heap and heap[0][0] <= now:
+                _, _, sock, data, dest = heapq.heappop(heap)
+                self.send(sock, data, dest)
+
+    def receive(self, relay, now):
+        impairment = relay.impairment
+        for _ in range(RECV_BATCH):
+            try:
+                data = relay.inSocket.recv(65535)
+            except OSError:
+                return  # drained (or closed)
+            if impairment is None:
+                self.send(relay.outSocket, data, relay.dest)
+                continue
+            for deliver in impairment.schedule(len(data), now):
+                if deliver <= now:
+                    self.send(relay.outSocket, data, relay.dest)
+                else:
+                    self.counter += 1
+                    heapq.heappush(self.heap, (deliver, self.counter, relay.outSocket, data, relay.dest))
+
+    def send(self, sock, data, dest):
+        try:
+            sock.sendto(data, dest)
+            self.forwarded += 1
+        except OSError:
+            self.send_errors += 1
+
+    def get_stats(self):
+        with self.lock:
+            impairments = list(self.impairments)
+        stats = {'links': len(impairments), 'forwarded': self.forwarded, 'send_errors': self.send_errors,
+                 'queued': len(self.heap)}
+        for impairment in impairments:
+            for key, value in impairment.get_stats().items():
+                stats[key] = max(stats.get(key, 0), value) if key == 'queue_delay_ms' else stats.get(key, 0) + value
+        return stats
+
+
+class ProxySession:
+    """UDP sockets for one proxied SETUP: a pair facing the server and a pair facing the client."""
+
+    def __init__(self, engine, clientHost, clientRtp, clientRtcp):
+        self.engine = engine
+        self.clientHost = clientHost
+        self.clientRtp = clientRtp
+        self.clientRtcp = clientRtcp
+        self.serverRtp, self.serverRtcp = bind_port_pair()
+        self.serverRtp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        self.clientRtpOut, self.clientRtcpOut = bind_port_pair()
+        self.relays = [UdpRelay(self.serverRtp, self.clientRtpOut, (clientHost, clientRtp), engine.impairment())]
+        engine.add(self.relays[0])
+
+    def connectRtcp(self, serverHost, serverRtcpPort):
+        """Relay RTCP both ways once the server has named its RTCP port."""
+        impair = self.engine.impairRtcp
+        down = UdpRelay(self.serverRtcp, self.clientRtcpOut, (self.clientHost, self.clientRtcp),
+                        self.engine.impairment() if impair else None)
+        up = UdpRelay(self.clientRtcpOut, self.serverRtcp, (serverHost, serverRtcpPort),
+                      self.engine.impairment() if impair else None)
+        for relay in (down, up):
+            self.engine.add(relay)
+            self.relays.append(relay)
+
+    def close(self):
+        for relay in self.relays:
+            self.engine.remove(relay)
+        for sock in (self.serverRtp, self.serverRtcp, self.clientRtpOut, self.clientRtcpOut):
+            sock.close()
+
+
+def split_messages(buffer):
+    """Remove and return every complete RTSP message (headers plus Content-Length body) in buffer."""
+    messages = []
+    while True:
+        match = HEADER_END.search(buffer)
+        if match is None:
+            return messages
+        length = CONTENT_LENGTH.search(buffer, 0, match.start())
+        end = match.end() + (int(length.group(1)) if length else 0)
+        if len(buffer) < end:
+            return messages
+        messages.append(bytes(buffer[:end]))
+        del buffer[:end]
+
+
+class RtspProxy:
+    """Relays RTSP between clients and a server, rewriting SETUP transports so RTP
+    and RTCP flow through the impairment engine."""
+
+    def __init__(self, engine, listenPort, serverAddr):
+        self.engine = engine
+        self.listenPort = listenPort
+        self.serverAddr = serverAddr
+
+    def serve(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('', self.listenPort))
+        listener.listen(16)
+        while True:
+            client, address = listener.accept()
+            threading.Thread(target=self.relay, args=(client, address), daemon=True).start()
+
+    def relay(self, client, address):
+        sessions = []
+        pending = {}  # CSeq of a proxied SETUP -> its ProxySession
+        try:
+            server = socket.create_connection(self.serverAddr)
+        except OSError:
+            client.close()
+            return
+        buffers = {client: bytearray(), server: bytearray()}
+        peers = {client: server, server: client}
+        selector = selectors.DefaultSelector()
+        selector.register(client, selectors.EVENT_READ)
+        selector.register(server, selectors.EVENT_READ)
+        try:
+            while True:
+                for key, _ in selector.select():
+                    sock = key.fileobj
+                    data = sock.recv(65536)
+                    if not data:
+                        return
+                    buffers[sock] += data
+                    for message in split_messages(buffers[sock]):
+                        if sock is client:
+                            message = self.rewriteRequest(message, address[0], sessions, pending)
+                        else:
+                            message = self.rewriteReply(message, pending)
+                        peers[sock].sendall(message)
+        except OSError:
+            pass
+        finally:
+            selector.close()
+            for sock in (client, server):
+                sock.close()
+            for session in sessions:
+                session.close()
+
+    def rewriteRequest(self, message, clientHost, sessions, pending):
+        match = CLIENT_PORT.search(message)
+        cseq = CSEQ.search(message)
+        if not message.startswith(b'SETUP') or match is None or cseq is None:
+            return message
+        rtp = int(match.group(1))
+        rtcp = int(match.group(2)) if match.group(2) else rtp + 1
+        session = ProxySession(self.engine, clientHost, rtp, rtcp)
+        sessions.append(session)
+        pending[int(cseq.group(1))] = session
+        ports = b'client_port=%d-%d' % (session.serverRtp.getsockname()[1], session.serverRtcp.getsockname()[1])
+        return message[:match.start()] + ports + message[match.end():]
+
+    def rewriteReply(self, message, pending):
+        cseq = CSEQ.search(message)
+        session = pending.pop(int(cseq.group(1)), None) if cseq else None
+        match = SERVER_PORT.search(message)
+        if session is None or match is None:
+            return message
+        rtcp = int(match.group(2)) if match.group(2) else int(match.group(1)) + 1
+        session.connectRtcp(self.serverAddr[0], rtcp)
+        ports = b'server_port=%d-%d' % (session.clientRtpOut.getsockname()[1], session.clientRtcpOut.getsockname()[1])
+        return message[:match.start()] + ports + message[match.end():]
+
+
+def parse_setting(key, value):
+    """Convert a command-line/script value to the unit Impairment uses."""
+    if key == 'gilbert':
+        if not value or value == 'off':
+            return None
+        parts = [float(part) for part in str(value).split(':')] if isinstance(value, str) else list(value)
+        return (parts[0], parts[1], parts[2] if len(parts) > 2 else 1.0)
+    if key in ('delay', 'jitter', 'reorder_delay', 'queue'):
+        return float(value) / 1000  # milliseconds
+    if key == 'rate':
+        return float(value) * 1000 / 8  # kbit/s
+    return float(value)
+
+
+def parse_step(text):
+    """'T:key=value,key=value' -> (T seconds, {key: value})"""
+    at, _, changes = text.partition(':')
+    settings = {}
+    for change in changes.split(','):
+        key, _, value = change.partition('=')
+        key = key.strip().replace('-', '_')
+        if key not in DEFAULTS:
+            raise argparse.ArgumentTypeError("unknown impairment %r" % key)
+        settings[key] = parse_setting(key, value.strip())
+    return float(at), settings
+
+
+def load_script(path):
+    """JSON list of {"at": seconds, <setting>: value, ...} in command-line units."""
+    with open(path) as f:
+        steps = json.load(f)
+    return [(float(step.pop('at')), {key: parse_setting(key, value) for key, value in step.items()})
+            for step in steps]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="UDP impairment proxy. RTSP mode relays a server and routes each session's RTP "
+                    "through the impairments; --udp relays one fixed port.")
+    parser.add_argument('--listen', type=int, default=8555, help="RTSP port clients connect to")
+    parser.add_argument('--server', default='127.0.0.1:8554', metavar='HOST:PORT')
+    parser.add_argument('--udp', default=None, metavar='PORT:HOST:PORT',
+                        help="relay datagrams from a local port to HOST:PORT instead of proxying RTSP")
+    parser.add_argument('--loss', default=0.0, help="random loss probability")
+    parser.add_argument('--gilbert', default=None, metavar='P_GB:P_BG[:LOSS_BAD]',
+                        help="Gilbert-Elliott bursty loss: per-packet transition probabilities")
+    parser.add_argument('--delay', default=0.0, metavar='MS')
+    parser.add_argument('--jitter', default=0.0, metavar='MS')
+    parser.add_argument('--reorder', default=0.0, help="probability a packet is held back")
+    parser.add_argument('--reorder-delay', default=10.0, metavar='MS')
+    parser.add_argument('--duplicate', default=0.0)
+    parser.add_argument('--rate', default=0, metavar='KBPS', help="token-bucket bandwidth cap")
+    parser.add_argument('--bucket', default=15000, metavar='BYTES')
+    parser.add_argument('--queue', default=200.0, metavar='MS', help="bottleneck queue limit")
+    parser.add_argument('--step', action='append', type=parse_step, default=[], metavar='T:key=value,...',
+                        help="change settings T seconds after start, e.g. 10:loss=0.05,rate=2000")
+    parser.add_argument('--script', default=None, help="JSON list of steps: [{\"at\": 10, \"loss\": 0.05}]")
+    parser.add_argument('--impair-rtcp', action='store_true', help="also impair RTCP (both directions)")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--stats-interval', type=float, default=0, help="print JSON stats every N seconds")
+    args = parser.parse_args()
+
+    settings = {key: parse_setting(key, getattr(args, key)) for key in DEFAULTS}
+    script = list(args.step) + (load_script(args.script) if args.script else [])
+    engine = ImpairmentEngine(settings, script, args.seed, args.impair_rtcp)
+
+    if args.udp:
+        port, host, destPort = args.udp.split(':')
+        inSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        inSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECV_BUFFER_BYTES)
+        inSocket.bind(('', int(port)))
+        outSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        engine.add(UdpRelay(inSocket, outSocket, (host, int(destPort)), engine.impairment()))
+    else:
+        host, port = args.server.rsplit(':', 1)
+        proxy = RtspProxy(engine, args.listen, (host, int(port)))
+        threading.Thread(target=proxy.serve, name='rtsp-proxy', daemon=True).start()
+
+    if args.stats_interval:
+        def report():
+            while True:
+                time.sleep(args.stats_interval)
+                print(json.dumps(engine.get_stats()), flush=True)
+        threading.Thread(target=report, daemon=True).start()
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        engine.run()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(engine.get_stats()), flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import os, sys, time, json, argparse, selectors, subprocess, tempfile, shlex
+import multiprocessing
+
+from HeadlessClient import HeadlessClient, drive
+from ServerBenchmark import make_video, wait_for_port
+
+# Time allowed for TEARDOWN replies before sockets are closed anyway
+TEARDOWN_GRACE = 1.0
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(values, digits=1):
+    """min/avg/p50/p95/max of a list of numbers (None when the list is empty)."""
+    if not values:
+        return None
+    return {
+        'min': round(min(values), digits),
+        'avg': round(sum(values) / len(values), digits),
+        'p50': round(percentile(values, 0.5), digits),
+        'p95': round(percentile(values, 0.95), digits),
+        'max': round(max(values), digits),
+    }
+
+
+def run_sessions(host, port, filename, sessions, duration, ramp, nack, conn=None):
+    """Open sessions (spread over ramp seconds), play for duration, tear down; return per-session stats."""
+    selector = selectors.DefaultSelector()
+    clients = []
+    start = time.monotonic()
+    end = start + ramp + duration
+    for index in range(sessions):
+        client = HeadlessClient(host, port, filename, nack=nack)
+        clients.append(client)
+        try:
+            client.connect()
+            client.register(selector)
+        except OSError as e:
+            client.fail('connect: %s' % e)
+        # Keep the sessions already open served while the rest ramp up
+        drive(selector, clients, start + ramp * (index + 1) / sessions)
+    drive(selector, clients, end)
+    for client in clients:
+        client.teardown()
+    drive(selector, clients, time.monotonic() + TEARDOWN_GRACE,
+          until=lambda: all(client.state == client.CLOSED for client in clients))
+    stats = []
+    for client in clients:
+        client.close()
+        stats.append(client.get_stats())
+    selector.close()
+    if conn is not None:
+        conn.send(stats)
+        conn.close()
+    return stats
+
+
+def run_load(host, port, filename, sessions, duration, ramp=0.0, processes=1, nack=True):
+    """Spread sessions over client processes and return every session's stats."""
+    if processes <= 1:
+        return run_sessions(host, port, filename, sessions, duration, ramp, nack)
+    workers = []
+    for index in range(processes):
+        count = sessions // processes + (1 if index < sessions % processes else 0)
+        if not count:
+            continue
+        parent, child = multiprocessing.Pipe(duplex=False)
+        process = multiprocessing.Process(target=run_sessions,
+                                          args=(host, port, filename, count, duration, ramp, nack, child))
+        process.start()
+        workers.append((process, parent))
+    stats = []
+    for process, parent in workers:
+        try:
+            stats.extend(parent.recv())
+        except EOFError:
+            pass  # the worker died; its sessions are missing from the report
+        process.join()
+    return stats
+
+
+def aggregate(stats, sessions, duration):
+    """Combine per-session stats into the JSON report."""
+    playing = [s for s in stats if s['frames']]
+    received_bytes = sum(s['bytes'] for s in stats)
+    completed = sum(s['frames_completed'] for s in stats)
+    expired = sum(s['frames_expired'] for s in stats)
+    errors = {}
+    for s in stats:
+        if s['error']:
+            errors[s['error']] = errors.get(s['error'], 0) + 1
+    return {
+        'sessions': sessions,
+        'sessions_playing': len(playing),
+        'sessions_failed': sessions - len(playing),
+        'duration_s': duration,
+        'throughput_mbps': round(received_bytes * 8 / duration / 1e6, 2) if duration else None,
+        'packets_received': sum(s['packets'] for s in stats),
+        'frames_received': sum(s['frames'] for s in stats),
+        'fps': summarize([s['fps'] for s in playing]),
+        'ttff_ms': summarize([s['ttff_ms'] for s in playing]),
+        'loss_ratio': summarize([s['loss_ratio'] for s in stats if s['packets']], 4),
+        'reassembly_ratio': round(completed / (completed + expired), 4) if completed + expired else None,
+        'nacked_packets': sum(s['nacked_packets'] for s in stats),
+        'recovered_packets': sum(s['recovered_packets'] for s in stats),
+        'playout_delay_ms': summarize([s['playout_delay_ms'] for s in playing]),
+        'playout_late_frames': sum(s['playout_late_frames'] for s in stats),
+        'errors': errors,
+    }
+
+
+def spawn_server(port, directory, server_args):
+    """Start Server.py on port serving files from directory."""
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Server.py'), str(port)]
+    proc = subprocess.Popen(args + server_args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, cwd=directory)
+    if not wait_for_port(port):
+        proc.terminate()
+        raise RuntimeError("server did not start on port %d" % port)
+    return proc
+
+
+def stop_server(proc):
+    """Stop a spawned server and return the CPU seconds it used."""
+    proc.terminate()
+    _, _, usage = os.wait4(proc.pid, 0)
+    proc.returncode = 0
+    return usage.ru_utime + usage.ru_stime
+
+
+def cpu_seconds():
+    """CPU used by this process and its reaped children (client workers, spawned server)."""
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Open N headless RTSP sessions against a server and report JSON.")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--file', default='movie.Mjpeg', help="file to play (a synthetic one with --spawn)")
+    parser.add_argument('--sessions', type=int, default=10)
+    parser.add_argument('--duration', type=float, default=10.0, help="seconds of playback after the ramp")
+    parser.add_argument('--ramp', type=float, default=0.0, help="seconds over which sessions are opened")
+    parser.add_argument('--processes', type=int, default=1, help="client processes sharing the sessions")
+    parser.add_argument('--no-nack', dest='nack', action='store_false')
+    parser.add_argument('--spawn', action='store_true',
+                        help="start a local Server.py with a synthetic video and report its CPU use")
+    parser.add_argument('--server-args', default='', help="extra Server.py arguments with --spawn, e.g. --server-args=\"--async\"")
+    parser.add_argument('--frame-size', type=int, default=50000,
+                        help="synthetic frame size with --spawn (at most 99999 bytes)")
+    parser.add_argument('--output', default=None, help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    cpu_start = cpu_seconds()
+    with tempfile.TemporaryDirectory() as directory:
+        proc = None
+        filename = args.file
+        if args.spawn:
+            filename = args.file = 'load.Mjpeg'
+            # Long enough not to reach the end during the run at 20 fps
+            make_video(os.path.join(directory, filename), args.frame_size, int((args.ramp + args.duration) * 20) + 40)
+            proc = spawn_server(args.port, directory, shlex.split(args.server_args))
+        try:
+            stats = run_load(args.host, args.port, filename, args.sessions, args.duration, args.ramp,
+                             args.processes, args.nack)
+        finally:
+            server_cpu = stop_server(proc) if proc else None
+    client_cpu = cpu_seconds() - cpu_start - (server_cpu or 0)
+
+    # Sessions already stream while the rest ramp up
+    report = aggregate(stats, args.sessions, args.ramp + args.duration)
+    report['config'] = {key: value for key, value in vars(args).items() if key != 'output'}
+    # Clients near one core per process mean the load generator, not the server, is the limit
+    report['client_cpu_s'] = round(client_cpu, 3)
+    if server_cpu is not None:
+        report['server_cpu_s'] = round(server_cpu, 3)
+        cores = server_cpu / (args.ramp + args.duration) if args.ramp + args.duration else 0
+        report['sessions_per_core'] = round(len([s for s in stats if s['frames']]) / cores, 1) if cores else None
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+import json, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+PREFIX = 'rtsp_server'
+
+
+def format_prometheus(stats):
+    """Render process stats (and their per-session list) in Prometheus text format."""
+    lines = []
+
+    def emit(name, value, labels=''):
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s%s %s' % (name, labels, repr(float(value))))
+
+    def walk(prefix, values):
+        for key, value in values.items():
+            if isinstance(value, dict):
+                walk('%s_%s' % (prefix, key), value)
+            elif isinstance(value, (int, float)):
+                emit('%s_%s' % (prefix, key), value)
+
+    walk(PREFIX, stats)
+
+    sessions = stats.get('sessions', [])
+    for field in ('bitrate_bps', 'packets_per_second', 'packets_sent', 'bytes_sent', 'send_errors',
+                  'loss_ratio', 'jitter_ms', 'rtt_ms', 'fec_packets', 'frames_thinned'):
+        name = '%s_session_%s' % (PREFIX, field)
+        lines.append('# TYPE %s gauge' % name)
+        for session in sessions:
+            labels = '{session="%s",client="%s",state="%s",rendition="%s"}' % (
+                session['session'], session['client'], session['state'], session.get('rendition', 'source'))
+            lines.append('%s%s %s' % (name, labels, repr(float(session[field]))))
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path == '/metrics':
+            body = format_prometheus(self.server.stats_source()).encode()
+            content_type = 'text/plain; version=0.0.4'
+        elif path in ('/stats', '/stats.json'):
+            body = json.dumps(self.server.stats_source(), indent=2).encode()
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass # scrapes are frequent; keep them out of the server log
+
+
+class MetricsServer:
+    """Local HTTP endpoint serving /metrics (Prometheus) and /stats (JSON).
+
+    Runs on its own daemon thread and only reads counters, so scraping does
+    not touch the streaming threads or the frame clock.
+    """
+
+    def __init__(self, stats_source, port, host='127.0.0.1'):
+        self.httpd = ThreadingHTTPServer((host, port), MetricsHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stats_source = stats_source
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
@@ -0,0 +1,70 @@
+import time
+
+# A packet is NACKed at most this many times...
+MAX_RETRIES = 3
+# ...and given up on after this long (the frame is expiring anyway)
+GIVE_UP_AFTER = 0.5
+# Shortest wait before NACKing the same packet again, whatever the RTT
+MIN_RETRY_INTERVAL = 0.02
+# Gaps wider than this are treated as a stream restart, not loss
+MAX_GAP = 512
+
+
+class NackTracker:
+    """Finds missing RTP sequence numbers and decides when to NACK them.
+
+    Every fragment of a frame is numbered consecutively, so a gap in the
+    sequence is exactly the set of missing fragments. Each missing packet
+    is NACKed on detection, again after about one RTT if it is still
+    missing, and dropped after MAX_RETRIES or GIVE_UP_AFTER seconds.
+    """
+
+    def __init__(self, max_retries=MAX_RETRIES, give_up_after=GIVE_UP_AFTER):
+        self.max_retries = max_retries
+        self.give_up_after = give_up_after
+        self.expected = None
+        self.missing = {}  # seq -> [detected_at, last_nack_at, nacks_sent]
+        self.nacks_sent = 0
+        self.recovered = 0
+        self.unrecovered = 0
+
+    def on_packet(self, seq, now=None):
+        """Record a received packet; True if it fills a gap (a retransmission arrived)."""
+        now = time.monotonic() if now is None else now
+        if self.expected is None:
+            self.expected = (seq + 1) & 0xFFFF
+            return False
+        gap = (seq - self.expected) & 0xFFFF
+        if gap < 0x8000:
+            if gap <= MAX_GAP:
+                for offset in range(gap):
+                    self.missing[(self.expected + offset) & 0xFFFF] = [now, 0.0, 0]
+            self.expected = (seq + 1) & 0xFFFF
+        elif self.missing.pop(seq, None) is not None:
+            self.recovered += 1  # a retransmission (or a late reordered packet)
+            return True
+        return False
+
+    def due(self, rtt, now=None):
+        """Return the sequence numbers to NACK now."""
+        now = time.monotonic() if now is None else now
+        retry_after = max(MIN_RETRY_INTERVAL, 1.5 * rtt)
+        due = []
+        for seq, entry in list(self.missing.items()):
+            if now - entry[0] > self.give_up_after or entry[2] >= self.max_retries and now - entry[1] > retry_after:
+                del self.missing[seq]
+                self.unrecovered += 1
+            elif entry[2] < self.max_retries and now - entry[1] >= retry_after:
+                entry[1] = now
+                entry[2] += 1
+                due.append(seq)
+        self.nacks_sent += len(due)
+        return due
+
+    def get_stats(self):
+        return {
+            'nacked_packets': self.nacks_sent,
+            'recovered_packets': self.recovered,
+            'unrecovered_packets': self.unrecovered,
+            'pending_packets': len(self.missing)
+        }
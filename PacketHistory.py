@@ -0,0 +1,65 @@
+import time
+from array import array
+
+# Packets kept per session (about 1.4 MB at the 1400-byte MTU)
+DEFAULT_HISTORY = 1024
+
+
+class PacketHistory:
+    """Ring of the most recently sent RTP packets, indexed by sequence number.
+
+    All storage is allocated up front: packet i lives at slot seq % size of
+    one bytearray, so recording a packet is a single copy into place and a
+    lookup is O(1). A packet is only returned while its slot still holds it.
+    """
+
+    def __init__(self, size=DEFAULT_HISTORY, slot_size=1400):
+        self.size = size
+        self.slot_size = slot_size
+        self.data = bytearray(size * slot_size)
+        self.view = memoryview(self.data)
+        self.seqs = array('l', [-1]) * size
+        self.lengths = array('H', bytes(2 * size))
+
+    def store(self, seq, header, payload):
+        slot = seq % self.size
+        start = slot * self.slot_size
+        headerSize = len(header)
+        length = headerSize + len(payload)
+        if length > self.slot_size:
+            self.seqs[slot] = -1
+            return
+        self.seqs[slot] = -1  # readers must not see a half-written packet as valid
+        self.data[start:start + headerSize] = header
+        self.data[start + headerSize:start + length] = payload
+        self.lengths[slot] = length
+        self.seqs[slot] = seq
+
+    def get(self, seq):
+        """Return a copy of the packet sent with seq, or None once it has been overwritten."""
+        slot = seq % self.size
+        if self.seqs[slot] != seq:
+            return None
+        start = slot * self.slot_size
+        packet = bytes(self.view[start:start + self.lengths[slot]])
+        # The sender may have reused the slot while we copied
+        return packet if self.seqs[slot] == seq else None
+
+
+class TokenBucket:
+    """Rate limiter: rate tokens per second, at most burst saved up."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.last = time.monotonic()
+
+    def take(self, count=1):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens < count:
+            return False
+        self.tokens -= count
+        return True
@@ -0,0 +1,233 @@
+import os, sys, struct, mmap, argparse
+from array import array
+from bisect import bisect_right
+
+from VideoStream import VideoStream, DEFAULT_FPS
+from RtpPacket import RtpPacket, RTP_CLOCK_RATE
+from FecCodec import protect_fragments, parse_fec
+
+# movie.Mjpeg is packetized into movie.Mjpeg.pkt, indexed by movie.Mjpeg.pkt.idx
+CONTAINER_SUFFIX = '.pkt'
+INDEX_SUFFIX = '.idx'
+
+INDEX_MAGIC = b'RTPK'
+INDEX_VERSION = 1
+# magic, version, FEC k, FEC m, fps (millihertz), frames, packets, source size, source mtime (ns)
+INDEX_HEADER_STRUCT = struct.Struct('<4sBBBxIIIQQ')
+
+
+def container_path(source):
+    return source + CONTAINER_SUFFIX
+
+
+def index_path(source):
+    return source + CONTAINER_SUFFIX + INDEX_SUFFIX
+
+
+def _write_array(out, values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    out.write(values.tobytes())
+
+
+def _read_array(typecode, data, offset, count):
+    values = array(typecode)
+    end = offset + count * values.itemsize
+    values.frombytes(data[offset:end])
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values, end
+
+
+def packetize(source, max_payload, fec=None, fps=DEFAULT_FPS):
+    """Convert an MJPEG VideoStream file into a packetized container and its index.
+
+    The container holds every RTP packet of every frame back to back,
+    headers included, with fragment indexes, counts, frame sizes and marker
+    bits filled in; only the per-session fields (sequence number, timestamp,
+    SSRC, frame id) are left zero for the server to patch. The sidecar index
+    records, per frame, its first packet, data fragment count, size and
+    media timestamp, and the offset of every packet.
+    """
+    stream = VideoStream(source, fps)
+    packet = RtpPacket()
+    firstPackets = array('I', [0])
+    fragmentCounts = array('H')
+    frameSizes = array('I')
+    timestamps = array('I')
+    packetOffsets = array('Q', [0])
+    offset = 0
+    try:
+        with open(container_path(source) + '.tmp', 'wb') as out:
+            for frameNbr in range(stream.frame_count):
+                frame = memoryview(stream.readFrame(frameNbr))
+                fragments = [(frame[start:start + max_payload], 0) for start in range(0, len(frame), max_payload)]
+                if not fragments:
+                    fragments = [(frame, 0)]
+                fragments[-1] = (fragments[-1][0], 1)  # marker on the last data fragment
+                total = len(fragments)
+                packets = protect_fragments(fragments, *fec) if fec else enumerate(fragments)
+                for index, (payload, marker) in packets:
+                    packet.encode(2, 0, 0, 0, 0, marker, 26, 0, payload, 0, index, total, len(frame), 0)
+                    out.write(packet.header)
+                    out.write(payload)
+                    offset += len(packet.header) + len(payload)
+                    packetOffsets.append(offset)
+                firstPackets.append(len(packetOffsets) - 1)
+                fragmentCounts.append(total)
+                frameSizes.append(len(frame))
+                timestamps.append(int(frameNbr * RTP_CLOCK_RATE / fps) & 0xFFFFFFFF)
+    finally:
+        stream.close()
+
+    info = os.stat(source)
+    with open(index_path(source) + '.tmp', 'wb') as out:
+        k, m = fec or (0, 0)
+        out.write(INDEX_HEADER_STRUCT.pack(INDEX_MAGIC, INDEX_VERSION, k, m, int(fps * 1000),
+                                           len(frameSizes), len(packetOffsets) - 1, info.st_size, info.st_mtime_ns))
+        for values in (firstPackets, fragmentCounts, frameSizes, timestamps, packetOffsets):
+            _write_array(out, values)
+    # Drop the old index first and install the new one last, so a reader
+    # never pairs an index with a container it does not describe
+    if os.path.exists(index_path(source)):
+        os.remove(index_path(source))
+    os.replace(container_path(source) + '.tmp', container_path(source))
+    os.replace(index_path(source) + '.tmp', index_path(source))
+    return len(frameSizes), len(packetOffsets) - 1
+
+
+class PackedFrame:
+    """One frame of a packetized container: its packets as a view of the mapped file."""
+    __slots__ = ('view', 'offsets', 'fragments', 'size')
+
+    def __init__(self, view, offsets, fragments, size):
+        self.view = view
+        self.offsets = offsets  # start of each packet, then the end of the last
+        self.fragments = fragments  # data fragments; the remaining packets are FEC parity
+        self.size = size
+
+    def __len__(self):
+        return self.size
+
+    def packetCount(self):
+        return len(self.offsets) - 1
+
+
+class PacketizedStream:
+    """VideoStream counterpart for packetized containers; nextFrame returns PackedFrames.
+
+    The container is memory-mapped, so every session (and worker process)
+    serving the same file shares one copy through the page cache.
+    """
+
+    def __init__(self, source, cache=None):
+        self.filename = source
+        try:
+            self.file = open(container_path(source), 'rb')
+        except OSError:
+            raise IOError
+        if cache is not None:
+            index = cache.get_index(index_path(source), lambda: self.loadIndex(source))
+        else:
+            index = self.loadIndex(source)
+        (self.fec, self.fps, self.firstPackets, self.fragmentCounts, self.frameSizes,
+         self.timestamps, self.packetOffsets) = index
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) if self.packetOffsets[-1] else None
+        self.view = memoryview(self.map) if self.map is not None else None
+        self.frameNum = 0
+
+    @staticmethod
+    def loadIndex(source):
+        with open(index_path(source), 'rb') as f:
+            data = f.read()
+        (magic, version, k, m, fps, frames, packets,
+         size, mtime) = INDEX_HEADER_STRUCT.unpack_from(data)
+        if magic != INDEX_MAGIC or version != INDEX_VERSION:
+            raise IOError("%s is not a packetized stream index" % index_path(source))
+        offset = INDEX_HEADER_STRUCT.size
+        firstPackets, offset = _read_array('I', data, offset, frames + 1)
+        fragmentCounts, offset = _read_array('H', data, offset, frames)
+        frameSizes, offset = _read_array('I', data, offset, frames)
+        timestamps, offset = _read_array('I', data, offset, frames)
+        packetOffsets, offset = _read_array('Q', data, offset, packets + 1)
+        if len(packetOffsets) != packets + 1:
+            raise IOError("truncated index %s" % index_path(source))
+        return ((k, m) if k else None, fps / 1000, firstPackets, fragmentCounts, frameSizes,
+                timestamps, packetOffsets)
+
+    @staticmethod
+    def available(source, fec=None):
+        """True if source has an up-to-date container packetized with this FEC layout."""
+        try:
+            with open(index_path(source), 'rb') as f:
+                header = f.read(INDEX_HEADER_STRUCT.size)
+            info = os.stat(source)
+        except OSError:
+            return False
+        if len(header) < INDEX_HEADER_STRUCT.size:
+            return False
+        magic, version, k, m, _, _, _, size, mtime = INDEX_HEADER_STRUCT.unpack(header)
+        return (magic == INDEX_MAGIC and version == INDEX_VERSION and ((k, m) if k else None) == fec
+                and size == info.st_size and mtime == info.st_mtime_ns)
+
+    def nextFrame(self):
+        """Get next frame as a PackedFrame; b'' at the end of the stream."""
+        frame = self.frameNum
+        if frame >= len(self.frameSizes):
+            return b''
+        self.frameNum += 1
+        offsets = self.packetOffsets[self.firstPackets[frame]:self.firstPackets[frame + 1] + 1]
+        return PackedFrame(self.view, offsets, self.fragmentCounts[frame], self.frameSizes[frame])
+
+    def frameNbr(self):
+        return self.frameNum
+
+    def seek(self, frame):
+        self.frameNum = max(0, min(int(frame), len(self.frameSizes)))
+
+    def seekTime(self, seconds):
+        """Position the stream at the frame shown at the given time (looked up in the index)."""
+        target = int(seconds * RTP_CLOCK_RATE)
+        self.seek(bisect_right(self.timestamps, target) - 1 if target > 0 else 0)
+
+    @property
+    def frame_count(self):
+        return len(self.frameSizes)
+
+    @property
+    def duration(self):
+        return len(self.frameSizes) / self.fps
+
+    def close(self):
+        if self.view is not None:
+            try:
+                self.view.release()
+            except BufferError:
+                pass
+            self.view = None
+        if self.map is not None:
+            try:
+                self.map.close()
+            except BufferError:
+                pass # frame views still referenced; unmapped when they are released
+            self.map = None
+        self.file.close()
+
+
+def main():
+    from ServerWorker import MAX_PAYLOAD, FEC_MAX_PAYLOAD
+    parser = argparse.ArgumentParser(
+        description="Pre-packetize MJPEG files so the server only patches sequence numbers and timestamps.")
+    parser.add_argument('files', nargs='+')
+    parser.add_argument('--fps', type=float, default=DEFAULT_FPS)
+    parser.add_argument('--fec', type=parse_fec, default=None, metavar='K:M',
+                        help="include XOR parity; the server must run with the same --fec to use the container")
+    args = parser.parse_args()
+    for source in args.files:
+        frames, packets = packetize(source, FEC_MAX_PAYLOAD if args.fec else MAX_PAYLOAD, args.fec, args.fps)
+        print("%s: %d frames, %d packets -> %s" % (source, frames, packets, container_path(source)))
+
+
+if __name__ == "__main__":
+    main()
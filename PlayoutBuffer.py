@@ -0,0 +1,107 @@
+import time
+from collections import deque
+
+from RtpPacket import RTP_CLOCK_RATE
+
+# Bounds of the playout delay added on top of the fastest recent frame
+MIN_TARGET_DELAY = 0.04
+MAX_TARGET_DELAY = 1.0
+# The target covers the mean queueing delay plus this many mean deviations (as TCP's RTO does)
+DEVIATION_MULTIPLIER = 4
+# Weight of each new frame in the delay averages
+DELAY_GAIN = 1 / 16
+# The fastest transit is remembered this long, so the mapping follows clock drift
+TRANSIT_WINDOW = 10.0
+# A frame this far off the current mapping means a seek, a pause or a new source: start over
+RESYNC_THRESHOLD = 2.0
+
+
+class PlayoutBuffer:
+    """Schedules frames for display from their RTP media timestamps.
+
+    A frame is due at its media time plus an offset: the smallest transit
+    time (arrival minus media time) seen over the last TRANSIT_WINDOW
+    seconds, plus a target delay. The target tracks how much later than
+    that fastest frame frames actually arrive, so a steady path plays with
+    a short delay and a jittery one with a longer one, never more than
+    MAX_TARGET_DELAY. Frames already past their deadline are dropped and
+    early ones are held, so latency stays bounded instead of drifting with
+    arrival times.
+    """
+
+    def __init__(self, clock_rate=RTP_CLOCK_RATE, min_delay=MIN_TARGET_DELAY, max_delay=MAX_TARGET_DELAY,
+                 late_after=0.05):
+        self.clock_rate = clock_rate
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.late_after = late_after
+        self.frames_scheduled = 0
+        self.frames_late = 0
+        self.resyncs = 0
+        self.reset()
+
+    def reset(self):
+        """Forget the timestamp mapping (after PLAY, a seek or a rendition change)."""
+        self.last_timestamp = None
+        self.extended = 0  # timestamp unwrapped past 32 bits
+        self.transits = deque()  # (arrival, transit) with increasing transit: a sliding minimum
+        self.mean_delay = 0.0
+        self.deviation = 0.0
+        self.target = self.min_delay
+        self.latency = 0.0
+
+    def schedule(self, timestamp, arrival, now=None):
+        """Return the monotonic time a frame is due on screen, or None if it is too late to show.
+
+        timestamp is the frame's RTP timestamp and arrival the monotonic time
+        it was reassembled.
+        """
+        now = time.monotonic() if now is None else now
+        if self.last_timestamp is None:
+            self.extended = timestamp
+        else:
+            self.extended += ((timestamp - self.last_timestamp + 0x80000000) & 0xFFFFFFFF) - 0x80000000
+        self.last_timestamp = timestamp
+        media = self.extended / self.clock_rate
+        transit = arrival - media
+
+        transits = self.transits
+        if transits and abs(transit - transits[0][1]) > RESYNC_THRESHOLD:
+            self.resyncs += 1
+            self.reset()
+            self.last_timestamp = timestamp
+            self.extended = timestamp
+            media = timestamp / self.clock_rate
+            transit = arrival - media
+            transits = self.transits
+        while transits and transits[-1][1] >= transit:
+            transits.pop()
+        transits.append((arrival, transit))
+        while transits[0][0] < arrival - TRANSIT_WINDOW:
+            transits.popleft()
+        fastest = transits[0][1]
+
+        # How much later than the fastest recent frame this one arrived
+        delay = transit - fastest
+        error = delay - self.mean_delay
+        self.mean_delay += DELAY_GAIN * error
+        self.deviation += DELAY_GAIN * (abs(error) - self.deviation)
+        self.target = min(self.max_delay, max(self.min_delay,
+                                              self.mean_delay + DEVIATION_MULTIPLIER * self.deviation))
+
+        deadline = media + fastest + self.target
+        if deadline < now - self.late_after:
+            self.frames_late += 1
+            return None
+        self.frames_scheduled += 1
+        self.latency += DELAY_GAIN * (deadline - arrival - self.latency)
+        return max(deadline, now)
+
+    def get_stats(self):
+        return {
+            'playout_frames': self.frames_scheduled,
+            'playout_late_frames': self.frames_late,
+            'playout_resyncs': self.resyncs,
+            'playout_target_ms': self.target * 1000,
+            'playout_delay_ms': self.latency * 1000
+        }
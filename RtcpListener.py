@@ -0,0 +1,95 @@
+import selectors, threading, time
+
+from RtcpPacket import RtcpPacket
+
+# Seconds between sender reports. RFC 3550 suggests 5 s; with one stream per
+# session the RTCP share of bandwidth is still far below 1% at 1 s.
+REPORT_INTERVAL = 1.0
+
+
+class RtcpListener:
+    """Serves RTCP for every session in the process from one thread.
+
+    Each session registers its RTCP socket; the thread waits on all of them
+    with a selector, hands decoded reports to the session's handleRtcp and
+    asks every session for a sender report once per interval.
+    """
+
+    def __init__(self, interval=REPORT_INTERVAL):
+        self.interval = interval
+        self.selector = None
+        self.thread = None
+        self.lock = threading.Lock()
+        self.sessions = {}  # socket -> session
+        self.reports_received = 0
+        self.reports_sent = 0
+        self.errors = 0
+
+    def register(self, sock, session):
+        with self.lock:
+            if self.thread is None:
+                self.selector = selectors.DefaultSelector()
+                self.thread = threading.Thread(target=self.run, name='rtcp', daemon=True)
+                self.thread.start()
+            sock.setblocking(False)
+            self.sessions[sock] = session
+            self.selector.register(sock, selectors.EVENT_READ, session)
+
+    def unregister(self, sock):
+        with self.lock:
+            if self.sessions.pop(sock, None) is not None:
+                self.selector.unregister(sock)
+
+    def run(self):
+        next_report = time.monotonic() + self.interval
+        while True:
+            try:
+                events = self.selector.select(max(0, next_report - time.monotonic()))
+            except OSError:
+                events = [] # a socket was closed while we waited
+            for key, _ in events:
+                self.receive(key.fileobj, key.data)
+
+            now = time.monotonic()
+            if now >= next_report:
+                next_report = now + self.interval
+                with self.lock:
+                    sessions = list(self.sessions.values())
+                for session in sessions:
+                    try:
+                        if session.sendSenderReport():
+                            self.reports_sent += 1
+                    except OSError:
+                        self.errors += 1
+                    except Exception as e:
+                        # One broken session must not stop reports for all the others
+                        self.errors += 1
+                        print("RTCP sender report failed: %r" % e)
+
+    def receive(self, sock, session):
+        while True:
+            try:
+                data, address = sock.recvfrom(2048)
+            except OSError:
+                return # drained (or the socket was closed)
+            try:
+                packets = RtcpPacket.decode(data)
+            except ValueError:
+                self.errors += 1
+                continue
+            self.reports_received += len(packets)
+            try:
+                session.handleRtcp(packets)
+            except Exception as e:
+                self.errors += 1
+                print("RTCP handling failed: %r" % e)
+
+    def get_stats(self):
+        with self.lock:
+            sessions = len(self.sessions)
+        return {
+            'sessions': sessions,
+            'reports_sent': self.reports_sent,
+            'reports_received': self.reports_received,
+            'errors': self.errors
+        }
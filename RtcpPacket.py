@@ -0,0 +1,164 @@
+import struct
+from time import time
+
+RTCP_SR = 200
+RTCP_RR = 201
+RTCP_RTPFB = 205  # transport-layer feedback (RFC 4585)
+NACK_FMT = 1  # generic NACK
+
+# V/P/count, packet type, length in 32-bit words minus one
+RTCP_HEADER_STRUCT = struct.Struct('!BBH')
+# Sender info: SSRC, NTP timestamp (msw, lsw), RTP timestamp, packet count, octet count
+SENDER_INFO_STRUCT = struct.Struct('!IIIIII')
+# Report block: SSRC, fraction lost + cumulative lost (24-bit), extended highest
+# sequence number, interarrival jitter, last SR (LSR), delay since last SR (DLSR)
+REPORT_BLOCK_STRUCT = struct.Struct('!IIIIII')
+SSRC_STRUCT = struct.Struct('!I')
+# Feedback header: packet sender SSRC, media source SSRC
+FEEDBACK_STRUCT = struct.Struct('!II')
+# Generic NACK entry: first lost sequence number (PID), bitmask of the 16 after it (BLP)
+NACK_STRUCT = struct.Struct('!HH')
+
+# Seconds between the NTP epoch (1900) and the Unix epoch (1970)
+NTP_EPOCH_OFFSET = 2208988800
+
+
+def ntp_time(now=None):
+    """Return the 64-bit NTP timestamp of now as (seconds, fraction)."""
+    now = time() if now is None else now
+    seconds = now + NTP_EPOCH_OFFSET
+    return int(seconds) & 0xFFFFFFFF, int((seconds % 1) * (1 << 32)) & 0xFFFFFFFF
+
+
+def compact_ntp(now=None):
+    """Middle 32 bits of the NTP timestamp (1/65536 s units), as used by LSR/DLSR."""
+    msw, lsw = ntp_time(now)
+    return ((msw & 0xFFFF) << 16) | (lsw >> 16)
+
+
+class ReportBlock:
+    """Reception statistics for one source, carried in SR and RR packets."""
+    __slots__ = ('ssrc', 'fractionLost', 'cumulativeLost', 'highestSeq', 'jitter', 'lsr', 'dlsr')
+
+    def __init__(self, ssrc, fractionLost=0, cumulativeLost=0, highestSeq=0, jitter=0, lsr=0, dlsr=0):
+        self.ssrc = ssrc
+        self.fractionLost = fractionLost  # fixed point, lost / expected * 256
+        self.cumulativeLost = cumulativeLost
+        self.highestSeq = highestSeq
+        self.jitter = jitter  # RTP timestamp units
+        self.lsr = lsr
+        self.dlsr = dlsr  # 1/65536 s
+
+    def pack(self):
+        lost = max(-0x800000, min(0x7FFFFF, self.cumulativeLost)) & 0xFFFFFF
+        return REPORT_BLOCK_STRUCT.pack(self.ssrc, (self.fractionLost << 24) | lost, self.highestSeq & 0xFFFFFFFF,
+                                        int(self.jitter) & 0xFFFFFFFF, self.lsr, self.dlsr)
+
+    @classmethod
+    def unpack_from(cls, data, offset):
+        ssrc, lost, highestSeq, jitter, lsr, dlsr = REPORT_BLOCK_STRUCT.unpack_from(data, offset)
+        cumulativeLost = lost & 0xFFFFFF
+        if cumulativeLost & 0x800000:
+            cumulativeLost -= 0x1000000
+        return cls(ssrc, lost >> 24, cumulativeLost, highestSeq, jitter, lsr, dlsr)
+
+
+class RtcpPacket:
+    """RTCP sender (SR) or receiver (RR) report, RFC 3550 section 6.4, or a
+    generic NACK (RFC 4585 section 6.2.1) listing lost sequence numbers."""
+    __slots__ = ('packetType', 'ssrc', 'ntpMsw', 'ntpLsw', 'rtpTimestamp', 'packetCount', 'octetCount', 'blocks',
+                 'mediaSsrc', 'lost')
+
+    def __init__(self, packetType=RTCP_RR, ssrc=0, blocks=None):
+        self.packetType = packetType
+        self.ssrc = ssrc
+        self.ntpMsw = self.ntpLsw = 0
+        self.rtpTimestamp = 0
+        self.packetCount = 0
+        self.octetCount = 0
+        self.blocks = blocks or []
+        self.mediaSsrc = 0
+        self.lost = []
+
+    @classmethod
+    def sender_report(cls, ssrc, rtpTimestamp, packetCount, octetCount, now=None, blocks=None):
+        packet = cls(RTCP_SR, ssrc, blocks)
+        packet.ntpMsw, packet.ntpLsw = ntp_time(now)
+        packet.rtpTimestamp = rtpTimestamp & 0xFFFFFFFF
+        packet.packetCount = packetCount & 0xFFFFFFFF
+        packet.octetCount = octetCount & 0xFFFFFFFF
+        return packet
+
+    @classmethod
+    def nack(cls, ssrc, mediaSsrc, lost):
+        packet = cls(RTCP_RTPFB, ssrc)
+        packet.mediaSsrc = mediaSsrc
+        packet.lost = list(lost)
+        return packet
+
+    def compact_ntp(self):
+        """LSR value a receiver echoes back for this sender report."""
+        return ((self.ntpMsw & 0xFFFF) << 16) | (self.ntpLsw >> 16)
+
+    def encode(self):
+        if self.packetType == RTCP_RTPFB:
+            body = FEEDBACK_STRUCT.pack(self.ssrc, self.mediaSsrc)
+            entries = []
+            for seq in sorted(set(self.lost)):
+                # Sequence numbers within 16 of the last PID share its bitmask
+                if entries and 0 < (seq - entries[-1][0]) & 0xFFFF <= 16:
+                    entries[-1][1] |= 1 << (((seq - entries[-1][0]) & 0xFFFF) - 1)
+                else:
+                    entries.append([seq & 0xFFFF, 0])
+            body += b''.join(NACK_STRUCT.pack(pid, blp) for pid, blp in entries)
+            return RTCP_HEADER_STRUCT.pack(0x80 | NACK_FMT, RTCP_RTPFB, (4 + len(body)) // 4 - 1) + body
+        if self.packetType == RTCP_SR:
+            body = SENDER_INFO_STRUCT.pack(self.ssrc, self.ntpMsw, self.ntpLsw, self.rtpTimestamp,
+                                           self.packetCount, self.octetCount)
+        else:
+            body = SSRC_STRUCT.pack(self.ssrc)
+        body += b''.join(block.pack() for block in self.blocks[:31])
+        header = RTCP_HEADER_STRUCT.pack(0x80 | min(len(self.blocks), 31), self.packetType, (4 + len(body)) // 4 - 1)
+        return header + body
+
+    @classmethod
+    def decode(cls, data):
+        """Parse a compound RTCP datagram; return its SR, RR and NACK packets and skip other types."""
+        packets = []
+        offset = 0
+        while offset + RTCP_HEADER_STRUCT.size <= len(data):
+            flags, packetType, length = RTCP_HEADER_STRUCT.unpack_from(data, offset)
+            end = offset + (length + 1) * 4
+            if flags >> 6 != 2 or end > len(data):
+                raise ValueError("malformed RTCP packet")
+            count = flags & 0x1F
+            pos = offset + RTCP_HEADER_STRUCT.size
+            if packetType == RTCP_SR and pos + SENDER_INFO_STRUCT.size <= end:
+                packet = cls(RTCP_SR)
+                (packet.ssrc, packet.ntpMsw, packet.ntpLsw, packet.rtpTimestamp,
+                 packet.packetCount, packet.octetCount) = SENDER_INFO_STRUCT.unpack_from(data, pos)
+                pos += SENDER_INFO_STRUCT.size
+            elif packetType == RTCP_RR and pos + SSRC_STRUCT.size <= end:
+                packet = cls(RTCP_RR, SSRC_STRUCT.unpack_from(data, pos)[0])
+                pos += SSRC_STRUCT.size
+            elif packetType == RTCP_RTPFB and count == NACK_FMT and pos + FEEDBACK_STRUCT.size <= end:
+                packet = cls(RTCP_RTPFB)
+                packet.ssrc, packet.mediaSsrc = FEEDBACK_STRUCT.unpack_from(data, pos)
+                for pos in range(pos + FEEDBACK_STRUCT.size, end - NACK_STRUCT.size + 1, NACK_STRUCT.size):
+                    pid, blp = NACK_STRUCT.unpack_from(data, pos)
+                    packet.lost.append(pid)
+                    packet.lost.extend((pid + bit + 1) & 0xFFFF for bit in range(16) if blp >> bit & 1)
+                packets.append(packet)
+                offset = end
+                continue
+            else:
+                offset = end
+                continue
+            for _ in range(count):
+                if pos + REPORT_BLOCK_STRUCT.size > end:
+                    break
+                packet.blocks.append(ReportBlock.unpack_from(data, pos))
+                pos += REPORT_BLOCK_STRUCT.size
+            packets.append(packet)
+            offset = end
+        return packets
@@ -0,0 +1,235 @@
+import os, socket, time, json, argparse, random, tempfile
+import multiprocessing
+
+from ServerWorker import ServerWorker, MAX_PAYLOAD
+from RtpPacket import RtpPacket, PACKET_HEADER_SIZE
+from FrameBuffer import FrameBuffer
+from FecCodec import parse_fec
+from VideoStream import VideoStream
+from Packetizer import packetize, PacketizedStream
+from ServerBenchmark import make_video
+
+# Largest frame the 5-digit length prefix of the file format can describe
+MAX_FILE_FRAME = 99999
+
+PAYLOAD_SIZE = MAX_PAYLOAD
+
+# Typical MJPEG frame sizes
+FRAME_SIZES = {'720p': 90000, '1080p': 200000}
+
+
+def make_fragments(frame, payload_size=PAYLOAD_SIZE):
+    view = memoryview(frame)
+    return [(view[i:i + payload_size], 0) for i in range(0, len(view), payload_size)]
+
+
+def make_rtp(payload, frameNbr, marker=0):
+    """Previous send path: build a fresh RtpPacket (MJPEG, sequence number = frame number) per packet."""
+    rtpPacket = RtpPacket()
+    rtpPacket.encode(2, 0, 0, 0, frameNbr, marker, 26, 0, payload)
+    return rtpPacket.getPacket()
+
+
+def run_send_path(mode, frame_size, frames, address):
+    """Send frames to a loopback sink and return packets per CPU-second."""
+    worker = ServerWorker({})
+    worker.clientInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    fragments = make_fragments(os.urandom(frame_size))
+
+    start_cpu = time.process_time()
+    start = time.perf_counter()
+    frame = os.urandom(frame_size)
+    for frameNbr in range(frames):
+        if mode == 'concat':
+            # Previous path: a fresh RtpPacket and a header+payload copy per packet
+            for payload, marker in fragments:
+                worker.clientInfo['rtpSocket'].sendto(make_rtp(payload, frameNbr, marker), address)
+        else:
+            worker.sendFrame(frame, frameNbr, address)
+    cpu = time.process_time() - start_cpu
+    wall = time.perf_counter() - start
+    worker.clientInfo['rtpSocket'].close()
+
+    packets = frames * len(fragments)
+    return {
+        'mode': mode,
+        'frame_size': frame_size,
+        'packets': packets,
+        'packets_per_core_second': round(packets / cpu) if cpu > 0 else None,
+        'packets_per_second': round(packets / wall) if wall > 0 else None,
+    }
+
+
+def run_file_path(frame_size, frames, address):
+    """Serve one file packetized per send and from its Packetizer container; packets per CPU-second."""
+    frame_size = min(frame_size, MAX_FILE_FRAME)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        source = os.path.join(directory, 'bench.Mjpeg')
+        make_video(source, frame_size, min(frames, 500))
+        packetize(source, MAX_PAYLOAD)
+        for mode in ('file', 'packed'):
+            stream = VideoStream(source, use_mmap=True) if mode == 'file' else PacketizedStream(source)
+            worker = ServerWorker({})
+            worker.clientInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            start_cpu = time.process_time()
+            for _ in range(frames):
+                frame = stream.nextFrame()
+                if not frame:
+                    stream.seek(0)
+                    frame = stream.nextFrame()
+                worker.sendFrame(frame, stream.frameNbr(), address)
+            cpu = time.process_time() - start_cpu
+            packets = worker.network_monitor.total_packets_sent
+            worker.clientInfo['rtpSocket'].close()
+            stream.close()
+            results.append({
+                'mode': mode,
+                'frame_size': frame_size,
+                'packets': packets,
+                'packets_per_core_second': round(packets / cpu) if cpu > 0 else None,
+            })
+    return results
+
+
+def run_codec(iterations):
+    """Encode and decode headers with reused packet objects; return operations per second."""
+    payload = memoryview(os.urandom(PAYLOAD_SIZE))
+    encoder, decoder = RtpPacket(), RtpPacket()
+    buffer = bytearray(PACKET_HEADER_SIZE + PAYLOAD_SIZE)
+
+    start = time.process_time()
+    for seq in range(iterations):
+        encoder.encode(2, 0, 0, 0, seq, 0, 26, 0, payload)
+    encode_cpu = time.process_time() - start
+
+    buffer[:PACKET_HEADER_SIZE] = encoder.header
+    start = time.process_time()
+    for _ in range(iterations):
+        decoder.decode(buffer, len(buffer))
+    decode_cpu = time.process_time() - start
+
+    return {
+        'mode': 'codec',
+        'encodes_per_second': round(iterations / encode_cpu) if encode_cpu > 0 else None,
+        'decodes_per_second': round(iterations / decode_cpu) if decode_cpu > 0 else None,
+    }
+
+
+def receive_frames(rtpSocket, frames, conn, loss=0.0, seed=None):
+    """Reassemble frames from the loopback socket and report what arrived.
+
+    With loss set, each packet is discarded with that probability before
+    reassembly, as if the network had dropped it.
+    """
+    frame_buffer = FrameBuffer(max_buffer_size=frames + 1)
+    rng = random.Random(seed)
+    buffer = bytearray(65535)
+    packet = RtpPacket()
+    assembled = assembled_bytes = 0
+    first = last = None
+    rtpSocket.settimeout(1.0)
+    while assembled < frames:
+        try:
+            nbytes, _ = rtpSocket.recvfrom_into(buffer)
+        except socket.timeout:
+            break
+        if first is None:
+            first = time.perf_counter()
+        if loss and rng.random() < loss:
+            continue
+        packet.decode(buffer, nbytes)
+        frame = frame_buffer.add_frame_fragment(packet.frame_id(), packet.fragment_id(),
+                                                packet.total_fragments(), packet.get_payload(),
+                                                packet.frame_size())
+        if frame is not None:
+            frame_buffer.get_next_frame()
+            assembled += 1
+            assembled_bytes += len(frame)
+            last = time.perf_counter()
+    frame_buffer.stop()
+    conn.send((assembled, assembled_bytes, (last - first) if assembled else 0, frame_buffer.get_stats()))
+
+
+def run_loopback(label, frame_size, frames, fps, loss=0.0, fec=None, seed=None):
+    """Send fragmented frames through ServerWorker and reassemble them in another process."""
+    rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rtpSocket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 8 << 20)
+    rtpSocket.bind(('127.0.0.1', 0))
+    parent, child = multiprocessing.Pipe()
+    receiver = multiprocessing.Process(target=receive_frames, args=(rtpSocket, frames, child, loss, seed))
+    receiver.start()
+    time.sleep(0.2)
+
+    worker = ServerWorker({})
+    worker.clientInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    worker.fec = fec
+    frame = os.urandom(frame_size)
+    interval = 1.0 / fps if fps else 0
+    deadline = time.perf_counter()
+    for frameNbr in range(frames):
+        worker.sendFrame(frame, frameNbr, rtpSocket.getsockname())
+        if interval:
+            deadline += interval
+            time.sleep(max(0, deadline - time.perf_counter()))
+
+    assembled, assembled_bytes, elapsed, buffer_stats = parent.recv()
+    receiver.join()
+    worker.clientInfo['rtpSocket'].close()
+    rtpSocket.close()
+    result = {
+        'mode': 'loopback',
+        'resolution': label,
+        'frame_size': frame_size,
+        'frames_sent': frames,
+        'frames_reassembled': assembled,
+        'reassembly_ratio': round(assembled / frames, 4),
+        'frames_per_second': round(assembled / elapsed, 1) if elapsed else None,
+        'throughput_mbps': round(assembled_bytes * 8 / elapsed / 1e6, 1) if elapsed else None,
+    }
+    if loss or fec:
+        result['loss'] = loss
+        result['fec'] = '%d:%d' % fec if fec else None
+        result['parity_packets'] = worker.network_monitor.fec_packets_sent
+        result['fec_recovered_frames'] = buffer_stats['fec_recovered_frames']
+        result['fec_unrecoverable_frames'] = buffer_stats['fec_unrecoverable_frames']
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTP packetization/send microbenchmark (loopback).")
+    parser.add_argument('--frame-size', type=int, default=150000)
+    parser.add_argument('--frames', type=int, default=2000)
+    parser.add_argument('--fps', type=float, default=0, help="pace loopback sends (0 = as fast as possible)")
+    parser.add_argument('--loss', type=float, default=0.0,
+                        help="drop this share of loopback packets at the receiver, then compare with and without FEC")
+    parser.add_argument('--fec', type=parse_fec, default=(8, 1), metavar='K:M',
+                        help="parity layout used for the --loss comparison")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    if args.loss:
+        # Same synthetic loss pattern (seed) with and without parity
+        results = []
+        for label, frame_size in FRAME_SIZES.items():
+            for fec in (None, args.fec):
+                results.append(run_loopback(label, frame_size, args.frames, args.fps, args.loss, fec, args.seed))
+        print(json.dumps(results, indent=2))
+        return
+
+    # Sink that is never read: the kernel drops overflow, which is fine for send-side cost
+    sink = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sink.bind(('127.0.0.1', 0))
+    address = sink.getsockname()
+
+    results = [run_send_path(mode, args.frame_size, args.frames, address) for mode in ('concat', 'sendmsg')]
+    results.extend(run_file_path(args.frame_size, args.frames, address))
+    results.append(run_codec(args.frames * 100))
+    sink.close()
+    for label, frame_size in FRAME_SIZES.items():
+        results.append(run_loopback(label, frame_size, args.frames, args.fps))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
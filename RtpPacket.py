@@ -1,68 +1,123 @@
 import sys
+import struct
 from time import time
 
 HEADER_SIZE = 12
 
-class RtpPacket:	
+# RTP clock for video payloads (RFC 3551)
+RTP_CLOCK_RATE = 90000
+
+# Fragmentation payload header that follows the RTP header in every packet:
+# frame id, fragment index, fragment count, total frame size in bytes.
+# Every fragment but the last carries the same payload size, so a receiver
+# can place any fragment at index * len(payload) (the last at size - len).
+FRAG_HEADER_SIZE = 12
+
+# RTP header (V/P/X/CC, M/PT, sequence number, timestamp, SSRC) and fragmentation header
+PACKET_HEADER_STRUCT = struct.Struct('!BBHIIIHHI')
+# Sequence number, timestamp, SSRC and frame id: the per-session fields of a
+# prebuilt packet header, patched in place at SESSION_FIELDS_OFFSET
+SESSION_FIELDS_STRUCT = struct.Struct('!HIII')
+SESSION_FIELDS_OFFSET = 2
+PACKET_HEADER_SIZE = HEADER_SIZE + FRAG_HEADER_SIZE
+
+class RtpPacket:
+    """RTP packet with fragmentation header that can be reused: encode packs into
+    a preallocated header, decode parses fields straight from the received buffer
+    without copying."""
+    __slots__ = ('header', 'payload', 'flags', 'markerPt', 'seq', 'ts', 'ssrc',
+                 'frameId', 'fragmentId', 'totalFragments', 'frameSize')
+
     def __init__(self):
-        self.header = bytearray(HEADER_SIZE)
+        self.header = bytearray(PACKET_HEADER_SIZE)
         self.payload = None
+        self.flags = 0
+        self.markerPt = 0
+        self.seq = 0
+        self.ts = 0
+        self.ssrc = 0
+        self.frameId = 0
+        self.fragmentId = 0
+        self.totalFragments = 1
+        self.frameSize = 0
 		
-    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload):
-        """Encode the RTP packet with header fields and payload."""
-        timestamp = int(time())
-        
-        # Set RTP header fields - FIXED VERSION
-        self.header[0] = (version << 6) | (padding << 5) | (extension << 4) | cc
-        self.header[1] = (marker << 7) | pt  # ← QUAN TRỌNG: marker ở bit 7
-        self.header[2] = (seqnum >> 8) & 0xFF
-        self.header[3] = seqnum & 0xFF
-        self.header[4] = (timestamp >> 24) & 0xFF
-        self.header[5] = (timestamp >> 16) & 0xFF
-        self.header[6] = (timestamp >> 8) & 0xFF
-        self.header[7] = timestamp & 0xFF
-        self.header[8] = (ssrc >> 24) & 0xFF
-        self.header[9] = (ssrc >> 16) & 0xFF
-        self.header[10] = (ssrc >> 8) & 0xFF
-        self.header[11] = ssrc & 0xFF
+    def encode(self, version, padding, extension, cc, seqnum, marker, pt, ssrc, payload,
+               frameId=0, fragmentId=0, totalFragments=1, frameSize=None, timestamp=None):
+        """Encode the RTP packet with header fields, fragmentation header and payload.
+
+        timestamp is in RTP clock units (the frame's media time); without one
+        the packet is stamped with the current time on the same 90 kHz clock.
+        """
+        self.flags = (version << 6) | (padding << 5) | (extension << 4) | cc
+        self.markerPt = (marker << 7) | pt  # marker ở bit 7
+        self.seq = seqnum & 0xFFFF
+        self.ts = (int(time() * RTP_CLOCK_RATE) if timestamp is None else timestamp) & 0xFFFFFFFF
+        self.ssrc = ssrc & 0xFFFFFFFF
+        self.frameId = frameId & 0xFFFFFFFF
+        self.fragmentId = fragmentId
+        self.totalFragments = totalFragments
+        self.frameSize = len(payload) if frameSize is None else frameSize
+        PACKET_HEADER_STRUCT.pack_into(self.header, 0, self.flags, self.markerPt, self.seq, self.ts, self.ssrc,
+                                       self.frameId, self.fragmentId, self.totalFragments, self.frameSize)
 
         self.payload = payload
 
-    def decode(self, byteStream):
-        """Decode the RTP packet."""
-        self.header = bytearray(byteStream[:HEADER_SIZE])
-        self.payload = byteStream[HEADER_SIZE:]
+    def decode(self, byteStream, length=None):
+        """Decode the RTP packet.
+
+        The payload is a memoryview of byteStream, so it is only valid until
+        the caller reuses that buffer; length limits it to the bytes received.
+        """
+        (self.flags, self.markerPt, self.seq, self.ts, self.ssrc, self.frameId,
+         self.fragmentId, self.totalFragments, self.frameSize) = PACKET_HEADER_STRUCT.unpack_from(byteStream)
+        self.payload = memoryview(byteStream)[PACKET_HEADER_SIZE:length]
 	
     def version(self):
         """Return RTP version."""
-        return int(self.header[0] >> 6)
+        return self.flags >> 6
 	
     def seqNum(self):
         """Return sequence (frame) number."""
-        seqNum = self.header[2] << 8 | self.header[3]
-        return int(seqNum)
+        return self.seq
 	
     def timestamp(self):
         """Return timestamp."""
-        timestamp = self.header[4] << 24 | self.header[5] << 16 | self.header[6] << 8 | self.header[7]
-        return int(timestamp)
+        return self.ts
 	
     def payloadType(self):
         """Return payload type."""
-        pt = self.header[1] & 127
-        return int(pt)
-    #####
+        return self.markerPt & 127
+
     def marker(self):
         """Return marker bit."""
-        if len(self.header) < 2:
-            return 0
-        marker_bit = (self.header[1] >> 7) & 0x01
-        return int(marker_bit)
+        return self.markerPt >> 7
+	
+    def frame_id(self):
+        """Return the id of the frame this fragment belongs to."""
+        return self.frameId
+
+    def fragment_id(self):
+        """Return the fragment index within its frame."""
+        return self.fragmentId
+
+    def total_fragments(self):
+        """Return the number of fragments in the frame."""
+        return self.totalFragments
+
+    def frame_size(self):
+        """Return the size in bytes of the reassembled frame."""
+        return self.frameSize
 	
     def getPayload(self):
         """Return payload."""
         return self.payload
+
+    def get_payload(self):
+        """Return payload."""
+        return self.payload
 		
     def getPacket(self):
         """Return RTP packet."""
-        return self.header + self.payload if self.payload else self.header
\ No newline at end of file
+        PACKET_HEADER_STRUCT.pack_into(self.header, 0, self.flags, self.markerPt, self.seq, self.ts, self.ssrc,
+                                       self.frameId, self.fragmentId, self.totalFragments, self.frameSize)
+        return self.header + self.payload if self.payload else self.header
@@ -0,0 +1,94 @@
+import os, time, json, random, argparse
+
+from RtspParser import RtspParser, RtspParseError
+
+REQUESTS = [
+    b"SETUP movie.Mjpeg RTSP/1.0\r\nCSeq: 1\r\nTransport: RTP/UDP; client_port=25000\r\n\r\n",
+    b"PLAY movie.Mjpeg RTSP/1.0\r\nCSeq: 2\r\nSession: 123456\r\nRange: npt=0-\r\n\r\n",
+    b"GET_PARAMETER movie.Mjpeg RTSP/1.0\r\nCSeq: 3\r\nSession: 123456\r\nContent-Length: 9\r\n\r\nposition\n",
+    b"PAUSE movie.Mjpeg RTSP/1.0\r\nCSeq: 4\r\nSession: 123456\r\n\r\n",
+    b"TEARDOWN movie.Mjpeg RTSP/1.0\r\nCSeq: 5\r\nSession: 123456\r\n\r\n",
+]
+STREAM = b''.join(REQUESTS)
+
+
+def run_parse(mode, rounds):
+    """Parse the request set repeatedly; return requests per CPU-second."""
+    parser = RtspParser()
+    parsed = 0
+    start = time.process_time()
+    for _ in range(rounds):
+        if mode == 'single':
+            for request in REQUESTS:
+                parsed += len(parser.feed(request))
+        elif mode == 'pipelined':
+            parsed += len(parser.feed(STREAM))
+        else:
+            for i in range(len(STREAM)):
+                parsed += len(parser.feed(STREAM[i:i + 1]))
+    cpu = time.process_time() - start
+    assert parsed == rounds * len(REQUESTS), (mode, parsed)
+    return {
+        'mode': mode,
+        'requests': parsed,
+        'requests_per_second': round(parsed / cpu) if cpu > 0 else None,
+    }
+
+
+def random_splits(data, rng):
+    """Cut data into random chunks, as a TCP stream may deliver it."""
+    chunks, pos = [], 0
+    while pos < len(data):
+        size = rng.randint(1, 64)
+        chunks.append(data[pos:pos + size])
+        pos += size
+    return chunks
+
+
+def run_fuzz(iterations, seed):
+    """Self-check: any split of valid input parses identically, and garbage only raises RtspParseError."""
+    rng = random.Random(seed)
+    expected = [(r.method, r.uri, r.cseq, r.body) for r in RtspParser().feed(STREAM)]
+    rejected = 0
+    for _ in range(iterations):
+        parser = RtspParser()
+        got = []
+        for chunk in random_splits(STREAM, rng):
+            got.extend((r.method, r.uri, r.cseq, r.body) for r in parser.feed(chunk))
+        assert got == expected, got
+
+        data = bytearray(rng.choice(REQUESTS))
+        for _ in range(rng.randint(1, 8)):
+            op = rng.random()
+            pos = rng.randrange(len(data))
+            if op < 0.4:
+                data[pos] = rng.randrange(256)
+            elif op < 0.7:
+                del data[pos]
+            else:
+                data[pos:pos] = os.urandom(rng.randint(1, 16))
+        parser = RtspParser(max_header_bytes=512, max_body_bytes=512)
+        try:
+            for chunk in random_splits(bytes(data) * 3, rng):
+                parser.feed(chunk)
+        except RtspParseError:
+            rejected += 1
+    return {'mode': 'fuzz', 'iterations': iterations, 'rejected': rejected, 'seed': seed}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RTSP request parser microbenchmark.")
+    parser.add_argument('--rounds', type=int, default=20000)
+    parser.add_argument('--fuzz', type=int, default=0, metavar='N', help="also run N randomized self-check iterations")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    results = [run_parse(mode, args.rounds) for mode in ('single', 'pipelined')]
+    results.append(run_parse('bytewise', max(1, args.rounds // 100)))
+    if args.fuzz:
+        results.append(run_fuzz(args.fuzz, args.seed))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import re
+
+MAX_HEADER_BYTES = 16 * 1024
+MAX_BODY_BYTES = 64 * 1024
+
+# End of a header block; bare LF is accepted as well as CRLF
+HEADER_END = re.compile(rb'\r?\n\r?\n')
+
+
+class RtspParseError(ValueError):
+    """Raised when the byte stream is not a valid sequence of RTSP requests."""
+
+
+class RtspRequest:
+    __slots__ = ('method', 'uri', 'version', 'headers', 'body')
+
+    def __init__(self, method, uri, version, headers, body=b''):
+        self.method = method
+        self.uri = uri
+        self.version = version
+        self.headers = headers  # lower-case name -> value
+        self.body = body
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def cseq(self):
+        return self.headers.get('cseq', '0')
+
+    def __repr__(self):
+        return 'RtspRequest(%s %s)' % (self.method, self.uri)
+
+
+class RtspResponse:
+    __slots__ = ('version', 'status', 'reason', 'headers', 'body')
+
+    def __init__(self, version, status, reason, headers, body=b''):
+        self.version = version
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # lower-case name -> value
+        self.body = body
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    @property
+    def cseq(self):
+        return self.headers.get('cseq', '0')
+
+    def __repr__(self):
+        return 'RtspResponse(%d %s)' % (self.status, self.reason)
+
+
+class RtspParser:
+    """Incremental RTSP request parser.
+
+    Bytes can be fed in arbitrary chunks: partial messages are kept until
+    they complete, and every complete request in the buffer (pipelined
+    requests included) is returned in order. Headers end at a blank line;
+    a Content-Length body is read when present.
+    """
+
+    def __init__(self, max_header_bytes=MAX_HEADER_BYTES, max_body_bytes=MAX_BODY_BYTES):
+        self.buffer = bytearray()
+        self.scan_from = 0
+        self.pending = None  # request waiting for its body
+        self.max_header_bytes = max_header_bytes
+        self.max_body_bytes = max_body_bytes
+
+    def feed(self, data):
+        """Add received bytes and return the list of requests they complete."""
+        self.buffer += data
+        requests = []
+        pos = 0
+        buffer = self.buffer
+        while True:
+            if self.pending is not None:
+                request, length = self.pending
+                if len(buffer) - pos < length:
+                    break
+                request.body = bytes(buffer[pos:pos + length])
+                pos += length
+                self.pending = None
+                requests.append(request)
+                continue
+
+            # Skip blank lines between messages (keep-alive CRLFs)
+            while pos < len(buffer) and buffer[pos] in b'\r\n':
+                pos += 1
+            match = HEADER_END.search(buffer, max(pos, self.scan_from))
+            if match is None:
+                if len(buffer) - pos > self.max_header_bytes:
+                    raise RtspParseError("header block too large")
+                # Resume scanning just before the end; a terminator may straddle chunks
+                self.scan_from = max(pos, len(buffer) - 3)
+                break
+            request = self.parse_head(bytes(buffer[pos:match.start()]))
+            pos = match.end()
+            self.scan_from = 0
+
+            length = request.headers.get('content-length')
+            if length is None:
+                requests.append(request)
+                continue
+            try:
+                length = int(length)
+            except ValueError:
+                raise RtspParseError("invalid Content-Length")
+            if length < 0 or length > self.max_body_bytes:
+                raise RtspParseError("invalid Content-Length")
+            self.pending = (request, length)
+
+        if pos:
+            del buffer[:pos]
+            self.scan_from = max(0, self.scan_from - pos)
+        return requests
+
+    def parse_head(self, head):
+        lines = head.decode('utf-8', 'replace').replace('\r\n', '\n').split('\n')
+        parts = lines[0].split()
+        if len(parts) != 3 or not parts[2].startswith('RTSP/'):
+            raise RtspParseError("malformed request line: %r" % lines[0][:80])
+        method, uri, version = parts
+        return RtspRequest(method, uri, version, self.parse_headers(lines[1:]))
+
+    def parse_headers(self, lines):
+        headers = {}
+        name = None
+        for line in lines:
+            if line[:1] in (' ', '\t') and name is not None:
+                headers[name] += ' ' + line.strip()  # folded continuation line
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or not name.strip():
+                raise RtspParseError("malformed header line: %r" % line[:80])
+            name = name.strip().lower()
+            headers[name] = value.strip()
+        return headers
+
+
+class RtspReplyParser(RtspParser):
+    """Incremental parser for the replies a client reads back (status line instead of request line)."""
+
+    def parse_head(self, head):
+        lines = head.decode('utf-8', 'replace').replace('\r\n', '\n').split('\n')
+        parts = lines[0].split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith('RTSP/') or not parts[1].isdigit():
+            raise RtspParseError("malformed status line: %r" % lines[0][:80])
+        return RtspResponse(parts[0], int(parts[1]), parts[2] if len(parts) > 2 else '',
+                            self.parse_headers(lines[1:]))
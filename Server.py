@@ -1,17 +1,90 @@
-import sys, socket
+import os, sys, socket, signal, argparse, threading, time, multiprocessing
 
-from ServerWorker import ServerWorker
+from ServerWorker import ServerWorker, BroadcastChannel
+from AsyncServer import AsyncServer
+from ServerNetworkMonitor import ServerNetworkMonitor
+from MetricsServer import MetricsServer
+from FecCodec import parse_fec
+
+STATS_INTERVAL = 1.0
+# How long a stopping supervisor waits for each shard to exit
+SHARD_EXIT_TIMEOUT = 5.0
+
+# Supervisor sockets (the metrics endpoint) that forked shards close on start
+supervisorSockets = []
 
 class Server:	
 	
 	def main(self):
 		print("SERVER RUN...")
-		try:
-			SERVER_PORT = int(sys.argv[1])
-		except:
-			print("[Usage: Server.py Server_port]\n")
+		args = self.parseArgs(sys.argv[1:])
+		
+		if args.workers > 1:
+			ShardSupervisor(args).run()
+		else:
+			if args.metrics_port:
+				MetricsServer(ServerWorker.getProcessStats, args.metrics_port).start()
+			self.serve(args)
+	
+	def parseArgs(self, argv):
+		parser = argparse.ArgumentParser(usage="Server.py Server_port [options]")
+		parser.add_argument('port', type=int)
+		parser.add_argument('--async', dest='useAsync', action='store_true',
+							help="event-loop engine: all sessions on one thread")
+		parser.add_argument('--mmap', action='store_true',
+							help="serve frames straight from the page cache")
+		parser.add_argument('--cache-mb', type=int, default=None,
+							help="byte budget of the shared frame cache")
+		parser.add_argument('--send-workers', type=int, default=None,
+							help="size of the pool the frame clock dispatches sends to")
+		parser.add_argument('--workers', type=int, default=1,
+							help="number of worker processes sharing the port via SO_REUSEPORT")
+		parser.add_argument('--multicast', default=None, metavar='GROUP:PORT',
+							help="also send live/ channels to this multicast group")
+		parser.add_argument('--log-packets', type=int, default=None, metavar='N',
+							help="print one in every N sent frames/packets")
+		parser.add_argument('--nack-history', type=int, default=None, metavar='PACKETS',
+							help="packets kept per session for NACK retransmission (0 disables)")
+		parser.add_argument('--fec', type=parse_fec, default=None, metavar='K:M',
+							help="send M XOR parity packets with every K fragments of a frame")
+		parser.add_argument('--no-packed', dest='packed', action='store_false',
+							help="ignore Packetizer.py containers and packetize frames on every send")
+		parser.add_argument('--metrics-port', type=int, default=None,
+							help="serve /metrics (Prometheus) and /stats (JSON) on localhost")
+		return parser.parse_args(argv)
+	
+	def configure(self, args):
+		"""Apply process-wide ServerWorker settings (run in every worker process)."""
+		if args.mmap:
+			ServerWorker.useMmap = True
+		if args.cache_mb is not None:
+			ServerWorker.frameCache.resize(args.cache_mb * 1024 * 1024)
+		if args.send_workers is not None:
+			ServerWorker.scheduler.workers = args.send_workers
+		if args.log_packets:
+			ServerNetworkMonitor.log_packets = True
+			ServerNetworkMonitor.log_every = args.log_packets
+		if args.nack_history is not None:
+			ServerWorker.nackHistory = args.nack_history
+		if args.fec:
+			ServerWorker.fec = args.fec
+		if not args.packed:
+			ServerWorker.usePacked = False
+		if args.multicast:
+			group, port = args.multicast.rsplit(':', 1)
+			BroadcastChannel.multicastGroup = (group, int(port))
+	
+	def serve(self, args, reusePort=False):
+		"""Accept RTSP clients in this process until it is stopped."""
+		self.configure(args)
+		if args.useAsync:
+			AsyncServer(args.port, reusePort=reusePort).run()
+			return
+		
 		rtspSocket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-		rtspSocket.bind(('', SERVER_PORT))
+		if reusePort:
+			rtspSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+		rtspSocket.bind(('', args.port))
 		rtspSocket.listen(5)        
 
 		# Receive client info (address,port) through RTSP/TCP session
@@ -20,6 +93,90 @@ class Server:
 			clientInfo['rtspSocket'] = rtspSocket.accept()
 			ServerWorker(clientInfo).run()		
 
+def publishStats(shardId, statsQueue):
+	"""Periodically send this process's aggregated session stats to the supervisor."""
+	while True:
+		time.sleep(STATS_INTERVAL)
+		try:
+			statsQueue.put_nowait((shardId, ServerWorker.getProcessStats()))
+		except Exception:
+			pass
+
+def watchParent(parent):
+	"""Exit the worker once the supervisor that started it is gone (even if it was killed)."""
+	while os.getppid() == parent:
+		time.sleep(STATS_INTERVAL)
+	os._exit(0)
+
+def runShard(args, shardId, statsQueue):
+	"""Entry point of a worker process: own sessions accepted on the shared port."""
+	signal.signal(signal.SIGTERM, signal.SIG_DFL)
+	for sock in supervisorSockets:
+		sock.close()
+	threading.Thread(target=watchParent, args=(os.getppid(),), daemon=True).start()
+	threading.Thread(target=publishStats, args=(shardId, statsQueue), daemon=True).start()
+	Server().serve(args, reusePort=True)
+
+class ShardSupervisor:
+	"""Forks N worker processes on one SO_REUSEPORT port, restarts any that die
+	and aggregates their ServerNetworkMonitor stats."""
+	
+	def __init__(self, args):
+		if not hasattr(socket, 'SO_REUSEPORT'):
+			raise OSError("SO_REUSEPORT is not supported on this platform")
+		self.args = args
+		self.statsQueue = multiprocessing.Queue()
+		self.shards = {}
+		self.shardStats = {}
+		
+	def startShard(self, shardId):
+		process = multiprocessing.Process(target=runShard, args=(self.args, shardId, self.statsQueue),
+										  name='shard-%d' % shardId, daemon=True)
+		process.start()
+		self.shards[shardId] = process
+		
+	def run(self):
+		# SIGTERM (as sent by LoadGenerator and ServerBenchmark) stops the shards too
+		signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+		for shardId in range(self.args.workers):
+			self.startShard(shardId)
+		if self.args.metrics_port:
+			metrics = MetricsServer(self.aggregateStats, self.args.metrics_port).start()
+			supervisorSockets.append(metrics.httpd.socket)
+		try:
+			while True:
+				self.collectStats(STATS_INTERVAL)
+				for shardId, process in list(self.shards.items()):
+					if not process.is_alive():
+						print("Worker %d (pid %s) exited with %s, restarting" % (shardId, process.pid, process.exitcode))
+						self.shardStats.pop(shardId, None)
+						self.startShard(shardId)
+		except KeyboardInterrupt:
+			pass
+		finally:
+			for process in self.shards.values():
+				process.terminate()
+			for process in self.shards.values():
+				process.join(SHARD_EXIT_TIMEOUT)
+			
+	def collectStats(self, timeout):
+		"""Drain stats published by the workers, waiting up to timeout for the first."""
+		deadline = time.time() + timeout
+		while True:
+			try:
+				shardId, stats = self.statsQueue.get(timeout=max(0, deadline - time.time()))
+			except Exception:
+				return
+			self.shardStats[shardId] = stats
+	
+	def aggregateStats(self):
+		"""Combined stats of every worker process."""
+		shardStats = list(self.shardStats.values())
+		stats = ServerNetworkMonitor.merge_stats(shardStats)
+		stats['workers'] = len(self.shards)
+		stats['sessions'] = [session for shard in shardStats for session in shard.get('sessions', [])]
+		return stats
+
 if __name__ == "__main__":
 	(Server()).main()
 
@@ -0,0 +1,125 @@
+import sys, os, socket, selectors, subprocess, tempfile, threading, time, json, argparse
+
+FRAME_SIZE = 20000
+FRAME_COUNT = 2000
+
+
+def make_video(path, frame_size=FRAME_SIZE, frame_count=FRAME_COUNT):
+    """Write a synthetic MJPEG file using the 5-byte length-prefix format."""
+    frame = os.urandom(frame_size)
+    with open(path, 'wb') as f:
+        for _ in range(frame_count):
+            f.write(b'%05d' % frame_size)
+            f.write(frame)
+
+
+def wait_for_port(port, timeout=5.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def rtsp_request(sock, request):
+    sock.send(request.encode())
+    return sock.recv(4096).decode()
+
+
+def open_session(port, filename, seq=1):
+    """Open one RTSP session (SETUP + PLAY) and return its sockets."""
+    rtp = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    rtp.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+    rtp.bind(('127.0.0.1', 0))
+    rtp.setblocking(False)
+    rtsp = socket.create_connection(('127.0.0.1', port))
+    reply = rtsp_request(rtsp, f"SETUP {filename} RTSP/1.0\r\nCSeq: {seq}\r\nTransport: RTP/UDP; client_port={rtp.getsockname()[1]}\r\n\r\n")
+    session = reply.split('Session: ')[1].split()[0]
+    rtsp_request(rtsp, f"PLAY {filename} RTSP/1.0\r\nCSeq: {seq + 1}\r\nSession: {session}\r\n\r\n")
+    return rtsp, rtp, session
+
+
+def run_engine(mode, port, filename, sessions, duration):
+    """Run one server engine with N sessions and return CPU usage figures."""
+    args = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Server.py'), str(port)]
+    if mode == 'async':
+        args.append('--async')
+    proc = subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                            cwd=os.path.dirname(filename))
+    try:
+        if not wait_for_port(port):
+            raise RuntimeError(f"{mode} server did not start on port {port}")
+
+        clients = [open_session(port, os.path.basename(filename)) for _ in range(sessions)]
+
+        sel = selectors.DefaultSelector()
+        for _, rtp, _ in clients:
+            sel.register(rtp, selectors.EVENT_READ)
+        received = [0, 0]
+        stop = threading.Event()
+
+        def receive():
+            while not stop.is_set():
+                for key, _ in sel.select(0.1):
+                    try:
+                        while True:
+                            data = key.fileobj.recv(65535)
+                            received[0] += 1
+                            received[1] += len(data)
+                    except BlockingIOError:
+                        pass
+
+        receiver = threading.Thread(target=receive, daemon=True)
+        receiver.start()
+        time.sleep(duration)
+        stop.set()
+        receiver.join()
+
+        for rtsp, rtp, session in clients:
+            try:
+                rtsp.send(f"TEARDOWN {os.path.basename(filename)} RTSP/1.0\r\nCSeq: 3\r\nSession: {session}\r\n\r\n".encode())
+            except OSError:
+                pass
+            rtsp.close()
+            rtp.close()
+    finally:
+        proc.terminate()
+        _, _, usage = os.wait4(proc.pid, 0)
+        proc.returncode = 0
+
+    cpu = usage.ru_utime + usage.ru_stime
+    cores_used = cpu / duration
+    return {
+        'mode': mode,
+        'sessions': sessions,
+        'duration_s': duration,
+        'server_cpu_s': round(cpu, 3),
+        'cpu_per_stream_pct': round(100 * cores_used / sessions, 3),
+        'sessions_per_core': round(sessions / cores_used, 1) if cores_used > 0 else None,
+        'packets_received': received[0],
+        'mbytes_received': round(received[1] / (1024 * 1024), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare threaded and asyncio server engines.")
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--port', type=int, default=8554)
+    parser.add_argument('--modes', default='threaded,async')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        filename = os.path.join(tmp, 'bench.Mjpeg')
+        make_video(filename)
+        results = []
+        for i, mode in enumerate(args.modes.split(',')):
+            results.append(run_engine(mode, args.port + i, filename, args.sessions, args.duration))
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
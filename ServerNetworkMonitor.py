@@ -1,35 +1,203 @@
 import time
 import json
+from array import array
 from datetime import datetime
 
+# Number of recent samples kept for the sliding-window bandwidth
+RING_SIZE = 512
+
 class ServerNetworkMonitor:
-    def __init__(self):
-        self.packet_log = []
+    """Fixed-memory network monitor.
+
+    Totals are running counters, recent samples live in a ring of compact
+    arrays and destinations are aggregated in place, so memory is bounded
+    and every report is O(1). Per-packet logging is opt-in and sampled.
+    """
+
+    # Print one in every log_every packets when log_packets is enabled
+    log_packets = False
+    log_every = 100
+
+    def __init__(self, frame_cache=None):
+        self.frame_cache = frame_cache
         self.start_time = time.time()
         self.total_packets_sent = 0
         self.total_bytes_sent = 0
+        self.max_packet_size = 0
+        self.hd_packets_sent = 0
+        self.send_errors = 0
+        
+        # Ring of recent samples: send time, packets and bytes per sample
+        self.sample_times = array('d', bytes(8 * RING_SIZE))
+        self.sample_packets = array('I', bytes(4 * RING_SIZE))
+        self.sample_bytes = array('I', bytes(4 * RING_SIZE))
+        self.sample_count = 0
+        self.window_packets = 0
+        self.window_bytes = 0
+        
+        # (ip, port) -> [packets, bytes]
+        self.destinations = {}
+        
+        # Latest RTCP receiver-report feedback from the client
+        self.receiver_reports = 0
+        self.fraction_lost = 0.0
+        self.cumulative_lost = 0
+        self.jitter_ms = 0.0
+        self.rtt_ms = None
+        
+        # NACK retransmission: packets requested, resent, refused by the rate limit, no longer held
+        self.nack_requests = 0
+        self.retransmitted_packets = 0
+        self.retransmit_rate_limited = 0
+        self.retransmit_misses = 0
         
+        # XOR parity packets sent alongside the data fragments
+        self.fec_packets_sent = 0
+        
+        # Frames left out while receiver reports showed heavy loss
+        self.frames_thinned = 0
+        
+    def add_sample(self, packet_count, byte_count, destination):
+        index = self.sample_count % RING_SIZE
+        if self.sample_count >= RING_SIZE:
+            self.window_packets -= self.sample_packets[index]
+            self.window_bytes -= self.sample_bytes[index]
+        self.sample_times[index] = time.monotonic()
+        self.sample_packets[index] = packet_count
+        self.sample_bytes[index] = byte_count
+        self.window_packets += packet_count
+        self.window_bytes += byte_count
+        self.sample_count += 1
+        
+        self.total_packets_sent += packet_count
+        self.total_bytes_sent += byte_count
+        if destination is not None:
+            totals = self.destinations.get(destination)
+            if totals is None:
+                totals = self.destinations[destination] = [0, 0]
+            totals[0] += packet_count
+            totals[1] += byte_count
+
     def log_packet_sent(self, packet_size, destination_ip, destination_port, packet_type):
         """Log thông tin packet được gửi"""
-        log_entry = {
-            'timestamp': datetime.now().isoformat(),
-            'packet_size': packet_size,
-            'destination_ip': destination_ip,
-            'destination_port': destination_port,
-            'packet_type': packet_type,
-            'frame_time': time.time() - self.start_time
-        }
-        
-        self.packet_log.append(log_entry)
-        self.total_packets_sent += 1
-        self.total_bytes_sent += packet_size
+        self.add_sample(1, packet_size, (destination_ip, destination_port))
+        if packet_size > self.max_packet_size:
+            self.max_packet_size = packet_size
+        if 'HD' in packet_type:
+            self.hd_packets_sent += 1
         
-        # In log real-time (có thể tắt trong production)
-        print(f"Packet sent: {packet_type} | Size: {packet_size} bytes | To: {destination_ip}:{destination_port}")
+        # In log (lấy mẫu, tắt mặc định trong production)
+        if self.log_packets and self.total_packets_sent % self.log_every == 0:
+            print(f"Packet sent: {packet_type} | Size: {packet_size} bytes | To: {destination_ip}:{destination_port}")
     
+    def log_frame_sent(self, packet_count, byte_count, destination=None, max_packet_size=0, parity_packets=0):
+        """Cộng dồn số packet/byte của một frame (không log từng packet)"""
+        self.add_sample(packet_count, byte_count, destination)
+        self.fec_packets_sent += parity_packets
+        if max_packet_size > self.max_packet_size:
+            self.max_packet_size = max_packet_size
+        if self.log_packets and self.sample_count % self.log_every == 0:
+            print(f"Frame sent: {packet_count} packets | Size: {byte_count} bytes | To: {destination}")
+
+    def log_send_error(self):
+        self.send_errors += 1
+
+    def log_receiver_report(self, fraction_lost, cumulative_lost, jitter_ms, rtt_ms=None):
+        """Ghi nhận phản hồi RTCP RR của client"""
+        self.receiver_reports += 1
+        self.fraction_lost = fraction_lost
+        self.cumulative_lost = cumulative_lost
+        self.jitter_ms = jitter_ms
+        if rtt_ms is not None:
+            self.rtt_ms = rtt_ms
+
+    def log_frame_thinned(self):
+        self.frames_thinned += 1
+
+    def log_retransmit(self, requested, sent, sent_bytes, limited, missing):
+        """Cộng dồn kết quả xử lý một NACK"""
+        self.nack_requests += requested
+        self.retransmitted_packets += sent
+        self.retransmit_rate_limited += limited
+        self.retransmit_misses += missing
+        if sent:
+            self.add_sample(sent, sent_bytes, None)
+
+    def get_feedback_stats(self):
+        """Receiver feedback in merge_stats form; empty until the first report."""
+        if not self.receiver_reports:
+            return {}
+        stats = {
+            'receiver_reports': self.receiver_reports,
+            'packets_lost': self.cumulative_lost,
+            'avg_loss_ratio': self.fraction_lost,
+            'avg_jitter_ms': self.jitter_ms,
+            'max_jitter_ms': self.jitter_ms
+        }
+        if self.rtt_ms is not None:
+            stats['avg_rtt_ms'] = self.rtt_ms
+            stats['max_rtt_ms'] = self.rtt_ms
+        return stats
+
+    def window_span(self):
+        """Seconds covered by the samples currently held in the ring."""
+        if self.sample_count < 2:
+            return 0
+        newest = self.sample_times[(self.sample_count - 1) % RING_SIZE]
+        oldest = self.sample_times[self.sample_count % RING_SIZE if self.sample_count >= RING_SIZE else 0]
+        return newest - oldest
+
+    def recent_bandwidth_bps(self):
+        """Bandwidth over the samples currently held in the ring."""
+        span = self.window_span()
+        return self.window_bytes * 8 / span if span > 0 else 0
+
+    def recent_packet_rate(self):
+        """Packets per second over the samples currently held in the ring."""
+        span = self.window_span()
+        return self.window_packets / span if span > 0 else 0
+
+    def get_destination_stats(self):
+        return {f"{ip}:{port}": {'packets': packets, 'bytes': nbytes}
+                for (ip, port), (packets, nbytes) in self.destinations.items()}
+
+    @staticmethod
+    def merge_stats(stats_list):
+        """Gộp thống kê của nhiều session/process.
+
+        Counters are summed, 'max_*' fields take the maximum and 'avg_*' /
+        '*ratio' fields are averaged; nested dicts are merged the same way.
+        Sessions run side by side, so 'duration' is the longest one and the
+        overall bandwidth is the total data over that span.
+        """
+        merged = {}
+        averaged = {}
+        nested = {}
+        for stats in stats_list:
+            for key, value in stats.items():
+                if isinstance(value, dict):
+                    nested.setdefault(key, []).append(value)
+                elif not isinstance(value, (int, float)) or isinstance(value, bool):
+                    continue
+                elif key.startswith('max_') or key == 'duration':
+                    merged[key] = max(merged.get(key, value), value)
+                elif key.startswith('avg_') or key.endswith('ratio'):
+                    averaged.setdefault(key, []).append(value)
+                else:
+                    merged[key] = merged.get(key, 0) + value
+        for key, values in averaged.items():
+            merged[key] = sum(values) / len(values)
+        for key, values in nested.items():
+            merged[key] = ServerNetworkMonitor.merge_stats(values)
+        if 'current_bandwidth_mbps' in merged:
+            duration = merged.get('duration', 0)
+            merged['current_bandwidth_mbps'] = (merged.get('total_data_mb', 0) * 1024 * 1024 * 8 / (duration * 1000000)
+                                                if duration > 0 else 0)
+        return merged
+
     def generate_network_report(self):
         """Tạo báo cáo hiệu năng mạng"""
-        if not self.packet_log:
+        if not self.total_packets_sent:
             return "No packets sent yet"
             
         current_time = time.time()
@@ -48,8 +216,12 @@ class ServerNetworkMonitor:
             'average_packet_size_bytes': avg_packet_size,
             'packets_per_second': packets_per_second,
             'bandwidth_usage_bps': bandwidth_usage * 8,  # Convert to bits per second
-            'hd_streaming_enabled': any('HD' in log['packet_type'] for log in self.packet_log),
-            'fragmentation_used': any(log['packet_size'] > 1400 for log in self.packet_log)
+            'recent_bandwidth_bps': self.recent_bandwidth_bps(),
+            'send_errors': self.send_errors,
+            'receiver_feedback': self.get_feedback_stats(),
+            'destinations': len(self.destinations),
+            'hd_streaming_enabled': self.hd_packets_sent > 0,
+            'fragmentation_used': self.max_packet_size > 1400 or self.total_packets_sent > self.sample_count
         }
         
         return json.dumps(report, indent=2)
@@ -63,5 +235,22 @@ class ServerNetworkMonitor:
             'duration': session_duration,
             'total_packets': self.total_packets_sent,
             'total_data_mb': self.total_bytes_sent / (1024 * 1024),
-            'current_bandwidth_mbps': (self.total_bytes_sent * 8) / (session_duration * 1000000) if session_duration > 0 else 0
-        }
\ No newline at end of file
+            'current_bandwidth_mbps': (self.total_bytes_sent * 8) / (session_duration * 1000000) if session_duration > 0 else 0,
+            'recent_bandwidth_mbps': self.recent_bandwidth_bps() / 1000000,
+            'packets_per_second': self.recent_packet_rate(),
+            'send_errors': self.send_errors,
+            'rtcp': self.get_feedback_stats(),
+            'nack_requests': self.nack_requests,
+            'retransmitted_packets': self.retransmitted_packets,
+            'retransmit_rate_limited': self.retransmit_rate_limited,
+            'retransmit_misses': self.retransmit_misses,
+            'fec_packets': self.fec_packets_sent,
+            'frames_thinned': self.frames_thinned,
+            'frame_cache': self.get_cache_stats()
+        }
+
+    def get_cache_stats(self):
+        """Lấy thống kê frame cache (hit/miss/eviction)"""
+        if self.frame_cache is None:
+            return {}
+        return self.frame_cache.get_stats()
\ No newline at end of file
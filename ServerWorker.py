@@ -1,58 +1,188 @@
-from random import randint
-import sys, traceback, threading, socket
+from random import randint, randrange
+import os, threading, socket
 
-from VideoStream import VideoStream
-from RtpPacket import RtpPacket
+from VideoStream import VideoStream, DEFAULT_FPS
+from RtpPacket import RtpPacket, PACKET_HEADER_SIZE, RTP_CLOCK_RATE, SESSION_FIELDS_STRUCT, SESSION_FIELDS_OFFSET
+from RtcpPacket import RtcpPacket, RTCP_RR, RTCP_RTPFB, compact_ntp
+from RtcpListener import RtcpListener
+from PacketHistory import PacketHistory, TokenBucket, DEFAULT_HISTORY
+from FecCodec import protect_fragments, FEC_HEADER_SIZE
+from Packetizer import PacketizedStream, PackedFrame
 from ServerNetworkMonitor import ServerNetworkMonitor
+from FrameCache import FrameCache
+from FrameScheduler import FrameScheduler
+from RtspParser import RtspParser, RtspParseError
 
 import time
-import json
+
+# sendmsg lets the header and payload go out as separate buffers (not on Windows)
+HAVE_SENDMSG = hasattr(socket.socket, 'sendmsg')
+
+MTU = 1400  # Maximum Transmission Unit (datagram size)
+MAX_PAYLOAD = MTU - PACKET_HEADER_SIZE
+# Parity packets add a FEC prefix to a full fragment; with FEC on, fragments shrink to fit
+FEC_MAX_PAYLOAD = MAX_PAYLOAD - FEC_HEADER_SIZE
+
+# Fastest trick-play rate: PLAY with Scale: N sends every Nth frame (backwards if negative)
+MAX_SCALE = 64
+
+# SETUP of live/<file> subscribes to a shared broadcast channel for <file>
+LIVE_PREFIX = 'live/'
+
+# Even ports tried for a session's RTP/RTCP socket pair
+RTP_PORT_RANGE = (50000, 60000)
+PORT_PAIR_ATTEMPTS = 16
+
+# Retransmissions may use this share of the session's packet rate (at least
+# MIN_RETRANSMIT_RATE packets/s), halved while the client reports heavy loss;
+# over CONGESTED_LOSS, every other frame is also left out
+RETRANSMIT_SHARE = 0.1
+MIN_RETRANSMIT_RATE = 50
+CONGESTED_LOSS = 0.1
 
 class ServerWorker:
     SETUP = 'SETUP'
     PLAY = 'PLAY'
     PAUSE = 'PAUSE'
     TEARDOWN = 'TEARDOWN'
+    OPTIONS = 'OPTIONS'
+    GET_PARAMETER = 'GET_PARAMETER'
+    SET_PARAMETER = 'SET_PARAMETER'
+    METHODS = (OPTIONS, SETUP, PLAY, PAUSE, TEARDOWN, GET_PARAMETER, SET_PARAMETER)
     
     INIT = 0
     READY = 1
     PLAYING = 2
+    TORN_DOWN = 3
     state = INIT
 
     OK_200 = 0
     FILE_NOT_FOUND_404 = 1
     CON_ERR_500 = 2
+    BAD_REQUEST_400 = 3
+    SESSION_NOT_FOUND_454 = 4
+    INVALID_STATE_455 = 5
+    NOT_IMPLEMENTED_501 = 6
+    INVALID_PARAMETER_451 = 7
+    
+    ERROR_REPLIES = {
+        FILE_NOT_FOUND_404: '404 Not Found',
+        CON_ERR_500: '500 Internal Server Error',
+        BAD_REQUEST_400: '400 Bad Request',
+        SESSION_NOT_FOUND_454: '454 Session Not Found',
+        INVALID_STATE_455: '455 Method Not Valid in This State',
+        NOT_IMPLEMENTED_501: '501 Not Implemented',
+        INVALID_PARAMETER_451: '451 Parameter Not Understood',
+    }
     
     clientInfo = {}
     
+    # Serve frames as memoryviews of an mmap'd file instead of read() copies
+    useMmap = False
+    
+    # Stream a file's pre-packetized container (Packetizer.py) when it is up to date
+    usePacked = True
+    
+    # Frames shared by every session in the process
+    frameCache = FrameCache()
+    
+    # One frame clock paces every session in the process
+    scheduler = FrameScheduler()
+    
+    # One thread sends and receives RTCP reports for every session
+    rtcp = RtcpListener()
+    
+    # Packets kept per session for NACK retransmission (0 disables)
+    nackHistory = DEFAULT_HISTORY
+    history = None
+    
+    # XOR parity added to every frame as (k, m): m parity packets per k fragments, or None
+    fec = None
+    
+    # Live sessions of this process, for stats aggregation
+    sessions = set()
+    sessionsLock = threading.Lock()
+    
+    # Broadcast channel this session subscribes to (SETUP of live/<file>)
+    channel = None
+    
     def __init__(self, clientInfo):
         self.clientInfo = clientInfo
-        self.network_monitor = ServerNetworkMonitor()
+        self.network_monitor = ServerNetworkMonitor(frame_cache=self.frameCache)
+        with self.sessionsLock:
+            self.sessions.add(self)
+        
+        # One packet object per session; its header buffer is rewritten per fragment
+        self.rtpPacket = RtpPacket()
+        self.rtpSeq = randint(0, 0xFFFF)
+        self.ssrc = randint(1, 0xFFFFFFFF)
+        self.frameId = 0
+        # RTP timestamps run on the 90 kHz media clock from a random origin (RFC 3550 5.1)
+        self.timestampBase = randint(0, 0xFFFFFFFF)
+        self.lastTimestamp = self.timestampBase
+        self.lastTimestampAt = None # wall-clock time the last frame was sent
+        # Trick play: every scale-th frame is sent, counted from frame scaleOrigin
+        self.scale = 1
+        self.scaleOrigin = 0
+        self.thinnedLast = False
 
     def run(self):
         threading.Thread(target=self.recvRtspRequest).start()
     
     def recvRtspRequest(self):
-        """Receive RTSP request from the client."""
+        """Receive RTSP requests from the client until it disconnects."""
         connSocket = self.clientInfo['rtspSocket'][0]
-        while True:            
-            data = connSocket.recv(256)
-            if data:
-                print("Data received:\n" + data.decode("utf-8"))
-                self.processRtspRequest(data.decode("utf-8"))
+        parser = RtspParser()
+        try:
+            while True:
+                data = connSocket.recv(4096)
+                if not data:
+                    break # client closed the connection
+                try:
+                    requests = parser.feed(data)
+                except RtspParseError as e:
+                    print("Bad RTSP request: %s" % e)
+                    self.replyRtsp(self.BAD_REQUEST_400, '0')
+                    break
+                for request in requests:
+                    self.handleRequest(request)
+                if self.state == self.TORN_DOWN:
+                    break
+        except OSError:
+            pass
+        finally:
+            self.closeSession()
+            connSocket.close()
     
-    def processRtspRequest(self, data):
-        """Process RTSP request sent from the client."""
+    def handleRequest(self, request):
+        """Process a request; a bug or bad input handling it gets a 500 instead of ending the session."""
+        try:
+            self.processRtspRequest(request)
+        except OSError:
+            raise # the control connection itself failed
+        except Exception as e:
+            print("Error handling %s: %r" % (request.method, e))
+            self.replyRtsp(self.CON_ERR_500, request.cseq)
+
+    def processRtspRequest(self, request):
+        """Process one parsed RTSP request (an RtspParser.RtspRequest)."""
+        print("Data received:\n" + request.method + ' ' + request.uri)
+        
         # Get the request type
-        request = data.split('\n')
-        line1 = request[0].split(' ')
-        requestType = line1[0]
+        requestType = request.method
         
         # Get the media file name
-        filename = line1[1]
+        filename = request.uri
         
         # Get the RTSP sequence number 
-        seq = request[1].split(' ')
+        seq = request.cseq
+        
+        # Requests after SETUP must carry the session they belong to
+        session = request.header('session')
+        if session is not None and 'session' in self.clientInfo and \
+                session.split(';')[0].strip() != str(self.clientInfo['session']):
+            self.replyRtsp(self.SESSION_NOT_FOUND_454, seq)
+            return
         
         # Process SETUP request
         if requestType == self.SETUP:
@@ -60,37 +190,66 @@ class ServerWorker:
                 # Update state
                 print("processing SETUP\n")
                 
+                # Get the RTP/UDP port from the Transport header
+                ports = self.parseClientPorts(request.header('transport', ''))
+                if ports is None:
+                    self.replyRtsp(self.BAD_REQUEST_400, seq)
+                    return
+                self.clientInfo['rtpPort'], self.clientInfo['rtcpPort'] = ports
+                
                 try:
                     #self.clientInfo['videoStream'] = VideoStream(filename)
-                    self.setup_hd_streaming(filename)
+                    if filename.startswith(LIVE_PREFIX):
+                        self.setupBroadcast(filename[len(LIVE_PREFIX):])
+                    else:
+                        self.setup_hd_streaming(filename)
+                        self.openRtpPorts()
                     self.state = self.READY
                 except IOError:
-                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq[1])
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
+                    return
                 
                 # Generate a randomized RTSP session ID
                 self.clientInfo['session'] = randint(100000, 999999)
                 
                 # Send RTSP reply
-                self.replyRtsp(self.OK_200, seq[1])
-                
-                # Get the RTP/UDP port from the last line
-                self.clientInfo['rtpPort'] = request[2].split(' ')[3]
+                self.replyRtsp(self.OK_200, seq, self.transportHeader())
+            else:
+                self.replyRtsp(self.INVALID_STATE_455, seq)
         
         # Process PLAY request         
         elif requestType == self.PLAY:
+            start = self.parseNptRange(request.header('range'))
+            try:
+                scale = self.parseScale(request.header('scale'))
+            except ValueError:
+                self.replyRtsp(self.BAD_REQUEST_400, seq)
+                return
+            if self.channel:
+                start = None # live channels cannot be repositioned
+                scale = 1
             if self.state == self.READY:
                 print("processing PLAY\n")
                 self.state = self.PLAYING
                 
-                # Create a new socket for RTP/UDP
-                self.clientInfo["rtpSocket"] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-                
-                self.replyRtsp(self.OK_200, seq[1])
+                if start is not None or scale != self.scale:
+                    self.reposition(start, scale)
+                self.replyRtsp(self.OK_200, seq, self.playHeaders(start))
                 
-                # Create a new thread and start sending RTP packets
-                self.clientInfo['event'] = threading.Event()
-                self.clientInfo['worker']= threading.Thread(target=self.sendRtp) 
-                self.clientInfo['worker'].start()
+                # Start sending RTP packets
+                self.startStreaming()
+            
+            # PLAY with a Range or a new Scale while playing repositions the running session
+            elif self.state == self.PLAYING and (start is not None or scale != self.scale):
+                print("processing PLAY (seek)\n")
+                self.stopStreaming()
+                self.reposition(start, scale)
+                self.replyRtsp(self.OK_200, seq, self.playHeaders(start))
+                self.startStreaming()
+            elif self.state == self.PLAYING:
+                self.replyRtsp(self.OK_200, seq)
+            else:
+                self.replyRtsp(self.INVALID_STATE_455, seq)
         
         # Process PAUSE request
         elif requestType == self.PAUSE:
@@ -98,150 +257,522 @@ class ServerWorker:
                 print("processing PAUSE\n")
                 self.state = self.READY
                 
-                self.clientInfo['event'].set()
+                self.stopStreaming()
             
-                self.replyRtsp(self.OK_200, seq[1])
+                self.replyRtsp(self.OK_200, seq)
+            elif self.state == self.READY:
+                self.replyRtsp(self.OK_200, seq)
+            else:
+                self.replyRtsp(self.INVALID_STATE_455, seq)
         
         # Process TEARDOWN request
         elif requestType == self.TEARDOWN:
             print("processing TEARDOWN\n")
 
-            self.clientInfo['event'].set()
-            
-            self.replyRtsp(self.OK_200, seq[1])
-            
-            # Close the RTP socket
-            self.clientInfo['rtpSocket'].close()
+            self.stopStreaming()
             
-    def sendRtp(self):
-        """Send RTP packets over UDP."""
-        while True:
-            self.clientInfo['event'].wait(0.05) 
+            self.replyRtsp(self.OK_200, seq)
             
-            # Stop sending if request is PAUSE or TEARDOWN
-            if self.clientInfo['event'].isSet(): 
-                break 
-                
-            data = self.clientInfo['videoStream'].nextFrame()
-            if data: 
-                frameNumber = self.clientInfo['videoStream'].frameNbr()
-                try:
-                    address = self.clientInfo['rtspSocket'][1][0]
-                    port = int(self.clientInfo['rtpPort'])
-                    self.clientInfo['rtpSocket'].sendto(self.makeRtp(data, frameNumber),(address,port))
-                except:
-                    print("Connection Error")
-
-    def makeRtp(self, payload, frameNbr, marker = 0):
-        """RTP-packetize the video data."""
-        version = 2
-        padding = 0
-        extension = 0
-        cc = 0
-        marker_bit = marker
-        pt = 26 # MJPEG type
-        seqnum = frameNbr
-        ssrc = 0 
+            # Close the RTP socket and release the session
+            self.closeSession()
+            self.state = self.TORN_DOWN
         
-        rtpPacket = RtpPacket()
+        # Capability query; also usable as a keep-alive
+        elif requestType == self.OPTIONS:
+            self.replyRtsp(self.OK_200, seq, 'Public: ' + ', '.join(self.METHODS))
         
-        rtpPacket.encode(version, padding, extension, cc, seqnum, marker_bit, pt, ssrc, payload)
+        # Keep-alive
+        elif requestType == self.GET_PARAMETER:
+            self.replyRtsp(self.OK_200, seq)
         
-        return rtpPacket.getPacket()
+        # Rendition switch ("quality: <name>" in the body); an empty body is a keep-alive
+        elif requestType == self.SET_PARAMETER:
+            params = self.parseParameters(request.body)
+            quality = params.get('quality')
+            if not params:
+                self.replyRtsp(self.OK_200, seq)
+            elif quality is None or self.channel or not quality.isalnum():
+                self.replyRtsp(self.INVALID_PARAMETER_451, seq)
+            elif self.state not in (self.READY, self.PLAYING):
+                self.replyRtsp(self.INVALID_STATE_455, seq)
+            else:
+                try:
+                    self.switchRendition(quality)
+                except IOError:
+                    self.replyRtsp(self.FILE_NOT_FOUND_404, seq)
+                    return
+                self.replyRtsp(self.OK_200, seq)
         
-    def replyRtsp(self, code, seq):
+        else:
+            self.replyRtsp(self.NOT_IMPLEMENTED_501, seq)
+
+    def closeSession(self):
+        """Stop streaming and release every resource held by the session."""
+        self.stopStreaming()
+        self.closeRtp()
+        self.closeStream()
+        with self.sessionsLock:
+            self.sessions.discard(self)
+
+    @classmethod
+    def getProcessStats(cls):
+        """Aggregate the monitors of every live session in this process."""
+        with cls.sessionsLock:
+            sessions = list(cls.sessions)
+        stats = ServerNetworkMonitor.merge_stats(
+            [session.network_monitor.get_real_time_stats() for session in sessions])
+        stats['active_sessions'] = len(sessions)
+        stats['broadcast'] = BroadcastChannel.getStats()
+        stats['frame_cache'] = cls.frameCache.get_stats()
+        stats['scheduler'] = cls.scheduler.get_stats()
+        stats['rtcp_listener'] = cls.rtcp.get_stats()
+        stats['sessions'] = [session.getSessionStats() for session in sessions]
+        return stats
+
+    def getSessionStats(self):
+        """Per-session counters for the metrics endpoint."""
+        monitor = self.network_monitor
+        peer = self.clientInfo.get('rtspSocket', (None, None))[1]
+        return {
+            'session': str(self.clientInfo.get('session', '')),
+            'client': '%s:%s' % (peer[0], self.clientInfo.get('rtpPort', '')) if peer else '',
+            'state': ('init', 'ready', 'playing', 'torn_down')[self.state],
+            'rendition': self.clientInfo.get('quality', 'source'),
+            'bitrate_bps': monitor.recent_bandwidth_bps(),
+            'packets_per_second': monitor.recent_packet_rate(),
+            'packets_sent': monitor.total_packets_sent,
+            'bytes_sent': monitor.total_bytes_sent,
+            'send_errors': monitor.send_errors,
+            'loss_ratio': monitor.fraction_lost,
+            'jitter_ms': monitor.jitter_ms,
+            'rtt_ms': monitor.rtt_ms or 0,
+            'fec_packets': monitor.fec_packets_sent,
+            'frames_thinned': monitor.frames_thinned
+        }
+
+    def startStreaming(self):
+        """Open the RTP socket and register the session with the frame clock."""
+        if self.channel:
+            # Broadcast sessions just receive the channel's packets
+            self.channel.subscribe(self, self.rtpAddress())
+            return
+        if 'rtpSocket' not in self.clientInfo:
+            self.clientInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        
+        self.clientInfo['stream'] = self.scheduler.schedule(self.sendNextFrame, self.clientInfo['videoStream'].fps)
+
+    def stopStreaming(self):
+        """Cancel the session's frame clock (PAUSE or TEARDOWN)."""
+        if self.channel:
+            self.channel.unsubscribe(self)
+            return
+        stream = self.clientInfo.pop('stream', None)
+        if stream:
+            self.scheduler.cancel(stream)
+
+    def closeStream(self):
+        """Release the session's video file (or its broadcast channel)."""
+        if self.channel:
+            self.channel.leave()
+            self.channel = None
+        for key in ('videoStream', 'pendingStream'):
+            videoStream = self.clientInfo.pop(key, None)
+            if videoStream:
+                videoStream.close()
+
+    def closeRtp(self):
+        """Close the RTP socket if one was opened."""
+        rtpSocket = self.clientInfo.pop('rtpSocket', None)
+        if rtpSocket:
+            rtpSocket.close()
+        self.closeRtcp()
+
+    def openRtpPorts(self):
+        """Bind the session's RTP and RTCP sockets, as an even/odd port pair when one is free."""
+        for attempt in range(PORT_PAIR_ATTEMPTS + 1):
+            # Last resort: any two ports; the reply still names both
+            port = randrange(RTP_PORT_RANGE[0], RTP_PORT_RANGE[1], 2) if attempt < PORT_PAIR_ATTEMPTS else 0
+            rtpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            rtcpSocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            try:
+                rtpSocket.bind(('', port))
+                rtcpSocket.bind(('', port + 1 if port else 0))
+            except OSError:
+                rtpSocket.close()
+                rtcpSocket.close()
+                continue
+            self.clientInfo['rtpSocket'] = rtpSocket
+            self.clientInfo['rtcpSocket'] = rtcpSocket
+            if self.nackHistory:
+                self.history = PacketHistory(self.nackHistory, MTU)
+                self.retransmitBucket = TokenBucket(MIN_RETRANSMIT_RATE, MIN_RETRANSMIT_RATE)
+            self.rtcp.register(rtcpSocket, self)
+            return
+
+    def closeRtcp(self):
+        rtcpSocket = self.clientInfo.pop('rtcpSocket', None)
+        if rtcpSocket:
+            self.rtcp.unregister(rtcpSocket)
+            rtcpSocket.close()
+
+    def rtcpAddress(self):
+        """Client address RTCP reports are sent to."""
+        return (self.clientInfo['rtspSocket'][1][0], self.clientInfo['rtcpPort'])
+
+    def sendSenderReport(self):
+        """Send an RTCP SR while playing; called by the RTCP thread once per interval."""
+        rtcpSocket = self.clientInfo.get('rtcpSocket')
+        if rtcpSocket is None or self.state != self.PLAYING:
+            return False
+        now = time.time()
+        monitor = self.network_monitor
+        # The media clock has advanced in real time since the last frame went out
+        rtpTime = self.lastTimestamp
+        if self.lastTimestampAt is not None:
+            rtpTime += int((now - self.lastTimestampAt) * RTP_CLOCK_RATE)
+        report = RtcpPacket.sender_report(self.ssrc, rtpTime & 0xFFFFFFFF, monitor.total_packets_sent,
+                                          monitor.total_bytes_sent, now)
+        rtcpSocket.sendto(report.encode(), self.rtcpAddress())
+        return True
+
+    def handleRtcp(self, packets):
+        """Record the client's receiver reports about this session's stream."""
+        arrival = compact_ntp()
+        for packet in packets:
+            if packet.packetType == RTCP_RTPFB:
+                if packet.mediaSsrc == self.ssrc:
+                    self.retransmit(packet.lost)
+                continue
+            if packet.packetType != RTCP_RR:
+                continue
+            for block in packet.blocks:
+                if block.ssrc != self.ssrc:
+                    continue
+                rtt_ms = None
+                if block.lsr:
+                    # RFC 3550 6.4.1: RTT = arrival - LSR - DLSR, in 1/65536 s
+                    rtt_ms = ((arrival - block.lsr - block.dlsr) & 0xFFFFFFFF) * 1000 / 65536
+                    if rtt_ms > 60000:
+                        rtt_ms = None # clock went backwards or a stale report
+                self.network_monitor.log_receiver_report(block.fractionLost / 256, block.cumulativeLost,
+                                                         block.jitter * 1000 / RTP_CLOCK_RATE, rtt_ms)
+
+    def retransmit(self, lost):
+        """Resend the packets a client NACKed that are still in the history, within the rate budget."""
+        history = self.history
+        rtpSocket = self.clientInfo.get('rtpSocket')
+        if history is None or rtpSocket is None:
+            return
+        monitor = self.network_monitor
+        bucket = self.retransmitBucket
+        bucket.rate = max(MIN_RETRANSMIT_RATE, RETRANSMIT_SHARE * monitor.recent_packet_rate())
+        if monitor.fraction_lost > CONGESTED_LOSS:
+            bucket.rate /= 2 # the path is congested; resending everything would add to it
+        bucket.burst = bucket.rate / 4
+        address = self.rtpAddress()
+        sent = sentBytes = limited = missing = 0
+        for seq in lost:
+            packet = history.get(seq)
+            if packet is None:
+                missing += 1
+            elif not bucket.take():
+                limited += 1
+            else:
+                try:
+                    rtpSocket.sendto(packet, address)
+                    sent += 1
+                    sentBytes += len(packet)
+                except OSError:
+                    limited += 1 # socket buffer full
+        monitor.log_retransmit(len(lost), sent, sentBytes, limited, missing)
+
+    def getFeedback(self):
+        """Latest receiver feedback for the session (loss, jitter, RTT), for pacing decisions."""
+        monitor = self.network_monitor
+        return {
+            'fraction_lost': monitor.fraction_lost,
+            'cumulative_lost': monitor.cumulative_lost,
+            'jitter_ms': monitor.jitter_ms,
+            'rtt_ms': monitor.rtt_ms
+        }
+            
+    def sendNextFrame(self):
+        """Send the next frame over RTP/UDP; called by the scheduler at each frame deadline."""
+        data, frameNumber = self.readNextFrame()
+        if not data:
+            return False # end of stream
+        if self.thinForCongestion():
+            return True
+        try:
+            self.sendFrame(data, frameNumber, self.rtpAddress())
+        except:
+            self.network_monitor.log_send_error()
+            print("Connection Error")
+        return True
+
+    def thinForCongestion(self):
+        """True if the frame just read should not be sent.
+
+        While the client's receiver reports show more than CONGESTED_LOSS,
+        every other frame is left out, halving the session's bitrate until
+        the reported loss drops again. Frames keep their media timestamps,
+        so the client's playout just sees a lower frame rate.
+        """
+        if self.getFeedback()['fraction_lost'] <= CONGESTED_LOSS or self.thinnedLast:
+            self.thinnedLast = False
+            return False
+        self.thinnedLast = True
+        self.network_monitor.log_frame_thinned()
+        return True
+
+    def readNextFrame(self):
+        """Return (frame, frameNumber) from the session's stream; frame is empty at the end.
+
+        A rendition chosen by SET_PARAMETER replaces the stream here, so the
+        switch always lands on a frame boundary and keeps the play position.
+        """
+        pending = self.clientInfo.pop('pendingStream', None)
+        if pending:
+            current = self.clientInfo['videoStream']
+            pending.seek(current.frameNbr())
+            self.clientInfo['videoStream'] = pending
+            current.close()
+        videoStream = self.clientInfo['videoStream']
+        data = videoStream.nextFrame()
+        frameNbr = videoStream.frameNbr()
+        if self.scale != 1 and data:
+            # Trick play: jump straight to the next frame shown at this scale,
+            # so the frame clock (and the bandwidth) stays at the normal rate
+            following = frameNbr - 1 + self.scale
+            videoStream.seek(following if following >= 0 else videoStream.frame_count)
+        return data, frameNbr
+
+    def reposition(self, start, scale):
+        """Seek to start seconds (if given) and play every scale-th frame from there.
+
+        The RTP clock carries on one frame interval after the last frame
+        sent, so the client's playout sees a seek or a change of scale as
+        ordinary, evenly spaced frames.
+        """
+        videoStream = self.clientInfo['videoStream']
+        if start is not None:
+            videoStream.seekTime(start)
+        if scale < 0 and videoStream.frameNbr() >= videoStream.frame_count:
+            videoStream.seek(videoStream.frame_count - 1) # rewind from the end
+        if self.lastTimestampAt is not None:
+            self.timestampBase = self.lastTimestamp + int(RTP_CLOCK_RATE / videoStream.fps)
+        self.scaleOrigin = videoStream.frameNbr()
+        self.scale = scale
+
+    def rtpAddress(self):
+        """Client address RTP packets are sent to."""
+        return (self.clientInfo['rtspSocket'][1][0], int(self.clientInfo['rtpPort']))
+
+    def mediaTimestamp(self, frameNbr):
+        """RTP timestamp of frame frameNbr (counted from 1): its play time on the 90 kHz clock.
+
+        Frames are one frame interval apart at any scale; without a seek or
+        trick play this is the frame's position in the stream.
+        """
+        videoStream = self.clientInfo.get('videoStream')
+        fps = videoStream.fps if videoStream else DEFAULT_FPS
+        played = (frameNbr - 1 - self.scaleOrigin) // self.scale
+        return (self.timestampBase + int(played * RTP_CLOCK_RATE / fps)) & 0xFFFFFFFF
+
+    def sendFrame(self, frame, frameNbr, address):
+        """Fragment a frame to the MTU and send all fragments in one batched call.
+
+        The session's RtpPacket header is rewritten in place for each
+        fragment and sent alongside the payload view, so no per-packet
+        objects are built and the payload is never copied.
+        """
+        # Every packet of a frame carries the frame's media time, so the
+        # client can measure jitter and schedule playout from it
+        timestamp = self.lastTimestamp = self.mediaTimestamp(frameNbr)
+        self.lastTimestampAt = time.time()
+        if isinstance(frame, PackedFrame):
+            return self.sendPackedFrame(frame, address, timestamp)
+        fragments = self.fragment_hd_frame(frame, frameNbr, FEC_MAX_PAYLOAD if self.fec else MAX_PAYLOAD)
+        total = len(fragments)
+        frameSize = len(frame)
+        self.frameId += 1
+        # Parity packets are numbered past the data fragments (index >= total)
+        packets = protect_fragments(fragments, *self.fec) if self.fec else enumerate(fragments)
+        packet = self.rtpPacket
+        sentBytes = sentPackets = 0
+        for index, (payload, marker) in packets:
+            self.rtpSeq += 1
+            packet.encode(2, 0, 0, 0, self.rtpSeq, marker, 26, self.ssrc, payload,
+                          self.frameId, index, total, frameSize, timestamp)
+            self.sendPacket(packet.header, payload, address)
+            if self.history:
+                self.history.store(packet.seq, packet.header, payload)
+            sentPackets += 1
+            sentBytes += PACKET_HEADER_SIZE + len(payload)
+        self.network_monitor.log_frame_sent(sentPackets, sentBytes, address, parity_packets=sentPackets - total)
+
+    def sendPackedFrame(self, frame, address, timestamp):
+        """Send a frame of a packetized container.
+
+        Its packets are already fragmented and encoded, so each one only
+        gets this session's sequence number, timestamp, SSRC and frame id
+        patched into a copy of its header.
+        """
+        self.frameId += 1
+        frameId = self.frameId & 0xFFFFFFFF
+        header = self.rtpPacket.header
+        view = frame.view
+        offsets = frame.offsets
+        start = offsets[0]
+        for end in offsets[1:]:
+            payloadStart = start + PACKET_HEADER_SIZE
+            header[:] = view[start:payloadStart]
+            self.rtpSeq += 1
+            seq = self.rtpSeq & 0xFFFF
+            SESSION_FIELDS_STRUCT.pack_into(header, SESSION_FIELDS_OFFSET, seq, timestamp, self.ssrc, frameId)
+            payload = view[payloadStart:end]
+            self.sendPacket(header, payload, address)
+            if self.history:
+                self.history.store(seq, header, payload)
+            start = end
+        packets = len(offsets) - 1
+        self.network_monitor.log_frame_sent(packets, offsets[-1] - offsets[0], address,
+                                            parity_packets=packets - frame.fragments)
+
+    def sendPacket(self, header, payload, address):
+        """Send one RTP packet as header + payload scatter-gather buffers."""
+        if HAVE_SENDMSG:
+            self.clientInfo['rtpSocket'].sendmsg((header, payload), (), 0, address)
+        else:
+            self.clientInfo['rtpSocket'].sendto(header + payload, address)
+
+    def parseNptRange(self, value):
+        """Return the start time in seconds of a 'npt=' Range header, or None."""
+        if not value or not value.startswith('npt='):
+            return None
+        start = value[4:].split('-')[0].strip()
+        if not start or start == 'now':
+            return None
+        try:
+            seconds = 0.0
+            for part in start.split(':'):  # npt-sec or npt-hhmmss
+                seconds = seconds * 60 + float(part)
+        except ValueError:
+            return None
+        return seconds
+
+    def parseClientPorts(self, transport):
+        """Return (rtp, rtcp) from a Transport header's client_port=a[-b], or None if it is missing or invalid."""
+        if 'client_port=' not in transport:
+            return None
+        ports = transport.split('client_port=')[1].split(';')[0].split('-')
+        try:
+            rtpPort = int(ports[0])
+            rtcpPort = int(ports[1]) if len(ports) > 1 else rtpPort + 1
+        except ValueError:
+            return None
+        if len(ports) > 2 or not (0 < rtpPort <= 0xFFFF and 0 < rtcpPort <= 0xFFFF):
+            return None
+        return rtpPort, rtcpPort
+
+    def parseScale(self, value):
+        """Return the frame step for a Scale header (1 without one); ValueError if it is not a number.
+
+        Scales are rounded to a whole number of frames, at most MAX_SCALE
+        either way; slow motion (|scale| < 1) plays at the normal rate.
+        """
+        if value is None:
+            return 1
+        scale = float(value)
+        if scale != scale or scale == 0: # NaN or zero
+            raise ValueError(value)
+        step = int(min(MAX_SCALE, max(1, round(abs(scale)))))
+        return step if scale > 0 else -step
+
+    def playHeaders(self, start):
+        """Range (after a seek) and Scale (the step actually used, when not 1) for a PLAY reply."""
+        headers = [header for header in (self.rangeHeader(start),
+                                         'Scale: %d' % self.scale if self.scale != 1 else None) if header]
+        return '\r\n'.join(headers) or None
+
+    def transportHeader(self):
+        """Advertise the server's RTP/RTCP ports, or the multicast group of a broadcast session."""
+        if self.channel and self.channel.multicast:
+            group, port = self.channel.multicast
+            return 'Transport: RTP/UDP;multicast;destination=%s;port=%d' % (group, port)
+        if 'rtcpSocket' in self.clientInfo:
+            return 'Transport: RTP/UDP;unicast;client_port=%s-%d;server_port=%d-%d' % (
+                self.clientInfo['rtpPort'], self.clientInfo['rtcpPort'],
+                self.clientInfo['rtpSocket'].getsockname()[1], self.clientInfo['rtcpSocket'].getsockname()[1])
+        return None
+
+    def rangeHeader(self, start):
+        """Build the Range header echoed back on a PLAY reply."""
+        if start is None:
+            return None
+        stream = self.clientInfo['videoStream']
+        return 'Range: npt=%.3f-%.3f' % (stream.frameNbr() / stream.fps, stream.duration)
+
+    def replyRtsp(self, code, seq, extra=None):
         """Send RTSP reply to the client."""
         if code == self.OK_200:
-            reply = 'RTSP/1.0 200 OK\nCSeq: ' + seq + '\nSession: ' + str(self.clientInfo['session'])
-            connSocket = self.clientInfo['rtspSocket'][0]
-            connSocket.send(reply.encode())
+            reply = 'RTSP/1.0 200 OK\r\nCSeq: ' + seq
+            if 'session' in self.clientInfo:
+                reply += '\r\nSession: ' + str(self.clientInfo['session'])
+            if extra:
+                reply += '\r\n' + extra
         
         # Error messages
-        elif code == self.FILE_NOT_FOUND_404:
-            print("404 NOT FOUND")
-        elif code == self.CON_ERR_500:
-            print("500 CONNECTION ERROR")
+        else:
+            status = self.ERROR_REPLIES[code]
+            print(status)
+            reply = 'RTSP/1.0 ' + status + '\r\nCSeq: ' + seq
+        self.sendRtspReply(reply + '\r\n\r\n')
+
+    def sendRtspReply(self, reply):
+        """Write an RTSP reply on the client's control connection."""
+        connSocket = self.clientInfo['rtspSocket'][0]
+        connSocket.send(reply.encode())
 
     # ==================== CÁC HÀM MỚI - THỤT LỀ VÀO TRONG CLASS ====================
     
-    def fragment_hd_frame(self, frame_data, frame_number):
+    def fragment_hd_frame(self, frame_data, frame_number, max_payload=MAX_PAYLOAD):
         """Phân mảnh frame HD thành các RTP packet nhỏ hơn MTU"""
-        MTU = 1400  # Maximum Transmission Unit
         fragments = []
         
+        # Slices of a memoryview share the frame buffer instead of copying it
+        frame_data = memoryview(frame_data)
+        
         # Kiểm tra nếu frame cần phân mảnh
-        if len(frame_data) <= MTU - 12:  # Trừ header RTP
+        if len(frame_data) <= max_payload:  # Trừ header RTP + fragmentation header
             # Frame nhỏ, không cần phân mảnh
             fragments.append((frame_data, 1))  # (data, marker_bit)
         else:
             # Phân mảnh frame lớn
             frame_size = len(frame_data)
             offset = 0
-            fragment_count = 0
             
             while offset < frame_size:
                 # Tính kích thước fragment (trừ header RTP)
-                chunk_size = min(MTU - 12, frame_size - offset)
+                chunk_size = min(max_payload, frame_size - offset)
                 fragment_data = frame_data[offset:offset + chunk_size]
                 offset += chunk_size
                 
                 # Marker bit = 1 cho fragment cuối cùng
                 marker_bit = 1 if offset >= frame_size else 0
                 fragments.append((fragment_data, marker_bit))
-                fragment_count += 1
-                
-            print(f"Frame {frame_number} fragmented into {fragment_count} packets")
         
         return fragments
 
-    def calculate_adaptive_delay(self, frame_size, network_conditions=None):
-        """Tính delay tối ưu dựa trên kích thước frame và điều kiện mạng"""
-        BASE_DELAY = 0.04  # 40ms base delay cho video thường
-        
-        # Điều chỉnh delay dựa trên kích thước frame
-        if frame_size > 100000:  # Frame HD lớn
-            adaptive_delay = BASE_DELAY * 1.5  # Tăng delay cho frame lớn
-        elif frame_size > 50000:  # Frame HD trung bình
-            adaptive_delay = BASE_DELAY * 1.2
-        else:  # Frame nhỏ
-            adaptive_delay = BASE_DELAY
-        
-        # Điều chỉnh dựa trên điều kiện mạng (nếu có thông tin)
-        if network_conditions and network_conditions.get('congestion', False):
-            adaptive_delay *= 2  # Tăng delay gấp đôi khi mạng nghẽn
-        
-        return max(0.02, min(adaptive_delay, 0.1))  # Giới hạn trong khoảng 20-100ms
-
-    def send_rtp_packet(self, rtp_packet, address, port, retry_count=2):
-        """Gửi RTP packet với cơ chế retry và logging"""
-        max_retries = retry_count
-        retries = 0
-        
-        while retries <= max_retries:
-            try:
-                # Gửi packet
-                self.clientInfo['rtpSocket'].sendto(rtp_packet, (address, port))
-                
-                # Log packet đã gửi
-                packet_size = len(rtp_packet)
-                self.log_packet_sent(packet_size, address, port, "HD_FRAME")
-                
-                return True  # Gửi thành công
-                
-            except socket.error as e:
-                retries += 1
-                print(f"Packet send failed, retry {retries}/{max_retries}: {e}")
-                
-                if retries > max_retries:
-                    print("Max retries exceeded, packet lost")
-                    return False
-        
-        return False
+    def setupBroadcast(self, filename):
+        """Join the live channel for a file instead of opening a private stream."""
+        self.channel = BroadcastChannel.join(filename)
 
     def setup_hd_streaming(self, filename):
         """Thiết lập streaming cho video HD"""
         # Mở file video
-        self.clientInfo['videoStream'] = VideoStream(filename)
+        self.clientInfo['videoStream'] = self.openStream(filename)
+        self.clientInfo['filename'] = filename
         
         # Kiểm tra nếu là video HD (dựa trên kích thước frame đầu tiên)
         test_frame = self.clientInfo['videoStream'].nextFrame()
@@ -253,12 +784,175 @@ class ServerWorker:
             self.clientInfo['is_hd'] = False
             
         # Reset stream về đầu
-        self.clientInfo['videoStream'].file.seek(0)
-        self.clientInfo['videoStream'].frameNum = 0
+        self.clientInfo['videoStream'].seek(0)
 
-    def log_packet_sent(self, packet_size, address, port, packet_type):
-        """Log packet đã gửi"""
-        try:
-            self.network_monitor.log_packet_sent(packet_size, address, port, packet_type)
-        except:
-            print(f"Packet sent: {packet_type} | Size: {packet_size} bytes | To: {address}:{port}")
\ No newline at end of file
+    def openStream(self, filename):
+        """Open a file's packetized container if it matches this server's FEC setting, else the file itself."""
+        if self.usePacked and PacketizedStream.available(filename, self.fec):
+            return PacketizedStream(filename, cache=self.frameCache)
+        return VideoStream(filename, use_mmap=self.useMmap, cache=self.frameCache)
+
+    def renditionFile(self, quality):
+        """File holding a rendition of the session's video: movie.Mjpeg -> movie_<quality>.Mjpeg"""
+        root, ext = os.path.splitext(self.clientInfo['filename'])
+        return root + '_' + quality + ext
+
+    def switchRendition(self, quality):
+        """Open the requested rendition; the send path swaps it in at the next frame."""
+        videoStream = self.openStream(self.renditionFile(quality))
+        stale = self.clientInfo.pop('pendingStream', None)
+        if stale:
+            stale.close()
+        self.clientInfo['pendingStream'] = videoStream
+        self.clientInfo['quality'] = quality
+        print("Switching to rendition %s\n" % quality)
+
+    def parseParameters(self, body):
+        """Parse a text/parameters body ("name: value" lines) into a dict."""
+        params = {}
+        for line in body.decode('utf-8', 'replace').splitlines():
+            name, sep, value = line.partition(':')
+            if sep and name.strip():
+                params[name.strip().lower()] = value.strip()
+        return params
+
+
+class BroadcastChannel(ServerWorker):
+    """Live channel: one reader/packetizer whose packets fan out to every subscriber.
+
+    Each RTP packet is built once per channel and sent with one sendmsg per
+    subscriber (plus the multicast group, if configured). Channels follow a
+    wall-clock schedule and loop at the end of the file; viewers joining
+    mid-frame start receiving at the next frame boundary.
+    """
+    channels = {}
+    channelsLock = threading.Lock()
+    
+    # (group, base port) for optional multicast; the channel in slot i uses base port + 2 * i
+    multicastGroup = None
+    multicastTtl = 1
+    multicastSlots = set() # slots held by open channels, reused once a channel closes
+
+    def __init__(self, filename):
+        super().__init__({})
+        with self.sessionsLock:
+            self.sessions.discard(self) # a channel is not a client session
+        self.filename = filename
+        self.members = 0
+        self.subscribers = {}
+        self.targets = ()
+        self.targetsChanged = False
+        self.lock = threading.Lock()
+        self.setup_hd_streaming(filename)
+        self.clientInfo['rtpSocket'] = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        
+        self.multicast = None
+        self.slot = None
+        if self.multicastGroup:
+            # Called from join() with channelsLock held
+            group, basePort = self.multicastGroup
+            self.slot = 0
+            while self.slot in self.multicastSlots:
+                self.slot += 1
+            self.multicastSlots.add(self.slot)
+            self.multicast = (group, basePort + 2 * self.slot)
+            self.clientInfo['rtpSocket'].setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, self.multicastTtl)
+
+    @classmethod
+    def join(cls, filename):
+        """Return the channel for a file, creating it on first use."""
+        with cls.channelsLock:
+            channel = cls.channels.get(filename)
+            if channel is None:
+                channel = cls.channels[filename] = cls(filename)
+            channel.members += 1
+        return channel
+
+    def leave(self):
+        """Drop a member session; the channel closes when none remain."""
+        with self.channelsLock:
+            self.members -= 1
+            if self.members > 0:
+                return
+            self.channels.pop(self.filename, None)
+        self.stopChannel(wait=True)
+        self.closeRtp()
+        self.closeStream()
+        with self.channelsLock:
+            self.multicastSlots.discard(self.slot) # the group port is free once nothing sends to it
+
+    @classmethod
+    def getStats(cls):
+        with cls.channelsLock:
+            channels = list(cls.channels.values())
+        return {
+            'channels': len(channels),
+            'subscribers': sum(len(channel.subscribers) for channel in channels),
+            # packets are built once per channel, then sent once per subscriber
+            'packets_built': sum(channel.network_monitor.total_packets_sent for channel in channels),
+            'bytes_built': sum(channel.network_monitor.total_bytes_sent for channel in channels)
+        }
+
+    def subscribe(self, session, address):
+        """Add a viewer; it is picked up at the next frame boundary."""
+        with self.lock:
+            self.subscribers[session] = address
+            self.targetsChanged = True
+            if 'stream' not in self.clientInfo:
+                self.startChannel()
+
+    def unsubscribe(self, session):
+        with self.lock:
+            if self.subscribers.pop(session, None) is None:
+                return
+            self.targetsChanged = True
+            if not self.subscribers and not self.multicast:
+                self.stopChannel()
+
+    def startChannel(self):
+        """Start packetizing at the frame the wall-clock schedule is at now."""
+        videoStream = self.clientInfo['videoStream']
+        if videoStream.frame_count:
+            videoStream.seek(int(time.time() * videoStream.fps) % videoStream.frame_count)
+        self.clientInfo['stream'] = self.scheduler.schedule(self.broadcastFrame, videoStream.fps)
+
+    def stopChannel(self, wait=False):
+        stream = self.clientInfo.pop('stream', None)
+        if stream:
+            self.scheduler.cancel(stream, wait=wait)
+
+    def broadcastFrame(self):
+        """Read and packetize one frame, sending each packet to every subscriber."""
+        if self.targetsChanged:
+            # Membership changes only take effect between frames
+            with self.lock:
+                targets = list(self.subscribers.values())
+                if self.multicast:
+                    targets.append(self.multicast)
+                self.targets = tuple(targets)
+                self.targetsChanged = False
+        
+        videoStream = self.clientInfo['videoStream']
+        data = videoStream.nextFrame()
+        if not data:
+            videoStream.seek(0) # live channels loop
+            # ...and their media clock keeps running through the restart
+            self.timestampBase += int(videoStream.frame_count * RTP_CLOCK_RATE / videoStream.fps)
+            data = videoStream.nextFrame()
+            if not data:
+                return False
+        if self.targets:
+            self.sendFrame(data, videoStream.frameNbr(), None)
+        return True
+
+    def sendPacket(self, header, payload, address):
+        """Fan one packet out to every target; the address argument is unused."""
+        rtpSocket = self.clientInfo['rtpSocket']
+        for target in self.targets:
+            try:
+                if HAVE_SENDMSG:
+                    rtpSocket.sendmsg((header, payload), (), 0, target)
+                else:
+                    rtpSocket.sendto(header + payload, target)
+            except OSError:
+                pass # one unreachable viewer must not stop the others
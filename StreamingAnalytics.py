@@ -1,9 +1,13 @@
 
 import statistics
+from collections import deque
+
+# Most recent latency samples kept for the report (about 5 minutes at 30 fps)
+MAX_LATENCY_SAMPLES = 9000
 
 class StreamingAnalytics:
     def __init__(self):
-        self.latencies = []
+        self.latencies = deque(maxlen=MAX_LATENCY_SAMPLES)
         self.loss_events = 0
         self.quality_switches = []
 
@@ -15,8 +19,11 @@ class StreamingAnalytics:
 
     def generate_performance_report(self):
         avg_latency = statistics.mean(self.latencies) if self.latencies else 0
+        p95_latency = sorted(self.latencies)[int(len(self.latencies) * 0.95)] if self.latencies else 0
         return {
             'avg_latency': avg_latency,
+            'p95_latency': p95_latency,
+            'max_latency': max(self.latencies, default=0),
             'loss_events': self.loss_events,
             'quality_switches': self.quality_switches
         }
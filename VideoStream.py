@@ -1,25 +1,113 @@
+from array import array
+import mmap
+
+DEFAULT_FPS = 20
+PREFIX_SIZE = 5
+
 class VideoStream:
-	def __init__(self, filename):
+	def __init__(self, filename, fps=DEFAULT_FPS, use_mmap=False, cache=None):
 		self.filename = filename
 		try:
 			self.file = open(filename, 'rb')
 		except:
 			raise IOError
+		self.fps = fps
 		self.frameNum = 0
 		
+		# Frames are served as memoryview slices of the mapped file (zero-copy)
+		self.map = None
+		self.view = None
+		if use_mmap:
+			try:
+				self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+				self.view = memoryview(self.map)
+			except ValueError:
+				pass # empty file cannot be mapped
+		
+		# Frames and the index are shared with other sessions through the cache
+		self.cache = cache
+		if cache is not None:
+			self.cacheKey = cache.key(filename, self.file.fileno())
+			self.offsets, self.lengths = cache.get_index(filename, self.buildIndex, self.cacheKey)
+		else:
+			self.offsets, self.lengths = self.buildIndex()
+		
+	def buildIndex(self):
+		"""Scan the length prefixes once and record every frame's offset and length."""
+		offsets = array('Q')
+		lengths = array('I')
+		pos = 0
+		while True:
+			if self.map is not None:
+				data = self.map[pos:pos + PREFIX_SIZE]
+			else:
+				self.file.seek(pos)
+				data = self.file.read(PREFIX_SIZE) # Get the framelength from the first 5 bits
+			if len(data) < PREFIX_SIZE:
+				break
+			framelength = int(data)
+			offsets.append(pos + PREFIX_SIZE)
+			lengths.append(framelength)
+			pos += PREFIX_SIZE + framelength
+		self.file.seek(0)
+		return offsets, lengths
+		
 	def nextFrame(self):
 		"""Get next frame."""
-		data = self.file.read(5) # Get the framelength from the first 5 bits
-		if data: 
-			framelength = int(data)
-							
-			# Read the current frame
-			data = self.file.read(framelength)
-			self.frameNum += 1
-		return data
+		if self.frameNum >= len(self.offsets):
+			return b''
+		
+		frame = self.frameNum
+		self.frameNum += 1
+		# Mapped frames are already shared through the page cache, and a cached
+		# slice would pin (and outlive) this session's mapping
+		if self.cache is not None and self.view is None:
+			return self.cache.get_frame(self.cacheKey, frame, self.readFrame)
+		return self.readFrame(frame)
+		
+	def readFrame(self, frame):
+		"""Read the given (0-based) frame from the file."""
+		offset = self.offsets[frame]
+		length = self.lengths[frame]
+		if self.view is not None:
+			return self.view[offset:offset + length]
+		
+		# Read the current frame
+		self.file.seek(offset)
+		return self.file.read(length)
 		
 	def frameNbr(self):
 		"""Get frame number."""
 		return self.frameNum
 	
-	
\ No newline at end of file
+	def seek(self, frame):
+		"""Position the stream so that nextFrame returns the given (0-based) frame."""
+		self.frameNum = max(0, min(int(frame), len(self.offsets)))
+		
+	def seekTime(self, seconds):
+		"""Position the stream at the frame shown at the given time."""
+		self.seek(seconds * self.fps)
+		
+	@property
+	def frame_count(self):
+		"""Total number of frames in the file."""
+		return len(self.offsets)
+	
+	@property
+	def duration(self):
+		"""Length of the stream in seconds at the source frame rate."""
+		return len(self.offsets) / self.fps
+	
+	def close(self):
+		"""Release the mapping and the file handle."""
+		if self.view is not None:
+			self.view.release()
+			self.view = None
+		if self.map is not None:
+			try:
+				self.map.close()
+			except BufferError:
+				pass # frame views still referenced; unmapped when they are released
+			self.map = None
+		self.file.close()
+	
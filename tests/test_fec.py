@@ -0,0 +1,53 @@
+import os
+
+import pytest
+
+from FecCodec import protect_fragments, parse_fec
+from FrameBuffer import FrameBuffer
+from ServerWorker import ServerWorker, FEC_MAX_PAYLOAD
+
+
+def send(frame, k, m, lost=()):
+    """Protect a frame, drop the given fragment indexes and feed the rest to a FrameBuffer."""
+    fragments = ServerWorker({}).fragment_hd_frame(frame, 1, FEC_MAX_PAYLOAD)
+    buffer = FrameBuffer(fragment_timeout=100)
+    result = None
+    for index, (payload, marker) in protect_fragments(fragments, k, m):
+        if index in lost:
+            continue
+        complete = buffer.add_frame_fragment(1, index, len(fragments), bytes(payload), len(frame))
+        if complete is not None:
+            result = complete
+    return result, buffer.get_stats(), len(fragments)
+
+
+@pytest.mark.parametrize('k, m', [(4, 1), (8, 2), (1, 1), (10, 3)])
+def test_recovers_one_lost_fragment_per_group(k, m):
+    frame = os.urandom(FEC_MAX_PAYLOAD * 20 + 123)  # the last fragment is short
+    fragments = 21
+    lost = set(range(k // 2, fragments, k))  # one data fragment in every group
+    result, stats, total = send(frame, k, m, lost)
+    assert total == fragments
+    assert result == frame
+    assert stats['fec_recovered_fragments'] == len(lost)
+    assert stats['fec_recovered_frames'] == 1
+
+
+def test_recovers_short_last_fragment():
+    frame = os.urandom(FEC_MAX_PAYLOAD * 4 + 10)
+    result, stats, _ = send(frame, 5, 1, {4})
+    assert result == frame
+    assert stats['fec_recovered_fragments'] == 1
+
+
+def test_two_losses_covered_by_one_parity_are_not_recovered():
+    frame = os.urandom(FEC_MAX_PAYLOAD * 8)
+    result, stats, _ = send(frame, 4, 1, {0, 1})
+    assert result is None
+    assert stats['fec_recovered_fragments'] == 0
+
+
+@pytest.mark.parametrize('value', ['0:1', '4:5', '256:1', 'x:1'])
+def test_parse_fec_rejects_bad_settings(value):
+    with pytest.raises(ValueError):
+        parse_fec(value)
@@ -0,0 +1,73 @@
+import os
+
+import pytest
+
+from Packetizer import packetize, PacketizedStream, container_path, index_path
+from ServerBenchmark import make_video
+from ServerWorker import ServerWorker, MAX_PAYLOAD, FEC_MAX_PAYLOAD
+from VideoStream import VideoStream
+
+
+def sent_packets(stream, fec):
+    """Every packet a session sends for the stream, timestamps masked out."""
+    worker = ServerWorker({})
+    worker.fec = fec
+    worker.rtpSeq = 100
+    worker.ssrc = 7
+    packets = []
+    worker.sendPacket = lambda header, payload, address: packets.append(
+        bytes(header[:4]) + bytes(header[8:]) + bytes(payload))
+    while True:
+        frame = stream.nextFrame()
+        if not frame:
+            break
+        worker.sendFrame(frame, stream.frameNbr(), None)
+    stream.close()
+    return packets
+
+
+@pytest.fixture
+def movie(tmp_path):
+    path = str(tmp_path / 'movie.Mjpeg')
+    make_video(path, 30000, 12)
+    return path
+
+
+@pytest.mark.parametrize('fec', [None, (4, 1), (8, 3)])
+def test_container_round_trips(movie, fec):
+    packetize(movie, FEC_MAX_PAYLOAD if fec else MAX_PAYLOAD, fec)
+    assert os.path.exists(container_path(movie)) and os.path.exists(index_path(movie))
+    assert PacketizedStream.available(movie, fec)
+
+    packed = PacketizedStream(movie)
+    plain = VideoStream(movie)
+    assert packed.fec == fec
+    assert packed.frame_count == plain.frame_count
+    assert list(packed.frameSizes) == list(plain.lengths)
+    packed.close()
+    plain.close()
+
+    packets = sent_packets(PacketizedStream(movie), fec)
+    assert len(packets) >= 12 * 22
+    assert packets == sent_packets(VideoStream(movie), fec)
+
+
+def test_container_for_other_fec_layout_is_not_used(movie):
+    packetize(movie, MAX_PAYLOAD)
+    assert PacketizedStream.available(movie)
+    assert not PacketizedStream.available(movie, (4, 1))
+
+
+def test_container_goes_stale_when_source_changes(movie):
+    packetize(movie, MAX_PAYLOAD)
+    info = os.stat(movie)
+    os.utime(movie, ns=(info.st_atime_ns, info.st_mtime_ns + 1))
+    assert not PacketizedStream.available(movie)
+
+
+def test_seek_time_uses_index(movie):
+    packetize(movie, MAX_PAYLOAD)
+    stream = PacketizedStream(movie)
+    stream.seekTime(0.5)
+    assert stream.frameNbr() == round(0.5 * stream.fps)
+    stream.close()
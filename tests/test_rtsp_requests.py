@@ -0,0 +1,84 @@
+import socket
+import threading
+
+import pytest
+
+from RtspParser import RtspReplyParser, MAX_HEADER_BYTES
+from ServerBenchmark import make_video
+from ServerWorker import ServerWorker
+
+
+@pytest.fixture
+def rtsp(tmp_path):
+    """A ServerWorker reading requests from one end of a socket pair; yields the other end."""
+    client, server = socket.socketpair()
+    client.settimeout(5)
+    worker = ServerWorker({'rtspSocket': (server, ('127.0.0.1', 0))})
+    thread = threading.Thread(target=worker.recvRtspRequest, daemon=True)
+    thread.start()
+    movie = str(tmp_path / 'movie.Mjpeg')
+    make_video(movie, 2000, 10)
+    yield client, movie
+    client.close()
+    thread.join(5)
+
+
+def exchange(client, data):
+    """Send raw bytes and return the first reply, or None if the server closed the connection."""
+    client.sendall(data)
+    parser = RtspReplyParser()
+    while True:
+        chunk = client.recv(4096)
+        if not chunk:
+            return None
+        replies = parser.feed(chunk)
+        if replies:
+            return replies[0]
+
+
+def setup(movie, cseq, transport):
+    return ('SETUP %s RTSP/1.0\r\nCSeq: %d\r\nTransport: %s\r\n\r\n' % (movie, cseq, transport)).encode()
+
+
+@pytest.mark.parametrize('data', [
+    b'GARBAGE\r\n\r\n',
+    b'SETUP movie.Mjpeg HTTP/1.1\r\nCSeq: 1\r\n\r\n',
+    b'SETUP movie.Mjpeg RTSP/1.0\r\nno colon here\r\n\r\n',
+    b'SET_PARAMETER movie.Mjpeg RTSP/1.0\r\nCSeq: 1\r\nContent-Length: -1\r\n\r\n',
+    b'A' * (MAX_HEADER_BYTES + 1),
+])
+def test_unparseable_request_gets_400(rtsp, data):
+    client, _ = rtsp
+    reply = exchange(client, data)
+    assert reply.status == 400
+
+
+@pytest.mark.parametrize('transport', [
+    'RTP/UDP',
+    'RTP/UDP; client_port=',
+    'RTP/UDP; client_port=abc-def',
+    'RTP/UDP; client_port=70000-70001',
+    'RTP/UDP; client_port=0',
+    'RTP/UDP; client_port=1-2-3',
+])
+def test_bad_transport_gets_400_and_keeps_session(rtsp, transport):
+    client, movie = rtsp
+    assert exchange(client, setup(movie, 1, transport)).status == 400
+    reply = exchange(client, setup(movie, 2, 'RTP/UDP; client_port=25000-25001'))
+    assert reply.status == 200
+    assert reply.cseq == '2'
+    exchange(client, b'TEARDOWN %s RTSP/1.0\r\nCSeq: 3\r\n\r\n' % movie.encode())
+
+
+def test_bad_scale_gets_400(rtsp):
+    client, movie = rtsp
+    assert exchange(client, setup(movie, 1, 'RTP/UDP; client_port=25002-25003')).status == 200
+    reply = exchange(client, b'PLAY %s RTSP/1.0\r\nCSeq: 2\r\nScale: fast\r\n\r\n' % movie.encode())
+    assert reply.status == 400
+    exchange(client, b'TEARDOWN %s RTSP/1.0\r\nCSeq: 3\r\n\r\n' % movie.encode())
+
+
+def test_missing_file_gets_404(rtsp, tmp_path):
+    client, _ = rtsp
+    reply = exchange(client, setup(str(tmp_path / 'missing.Mjpeg'), 1, 'RTP/UDP; client_port=25004-25005'))
+    assert reply.status == 404